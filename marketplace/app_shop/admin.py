@@ -1,6 +1,15 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
 
-from .models import Category, Product, ProductImage, Tag, Review, Order
+from marketplace.admin import LargeTableAdminMixin
+from .models import Category, Product, ProductImage, Tag, Review, Order, OrderItem, SalesRollup
+from .sales import get_dashboard
+from .search import get_search_backend
 
 
 # Register your models here.
@@ -8,6 +17,7 @@ from .models import Category, Product, ProductImage, Tag, Review, Order
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = 'title',
+    search_fields = 'title',
 
     class Meta:
         verbose_name = 'Category'
@@ -21,14 +31,26 @@ class ProductImagesInline(admin.TabularInline):
 
 class ProductTagsInline(admin.StackedInline):
     model = Product.tags.through
+    autocomplete_fields = 'tag',
     extra = 1
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = 'title', 'short_description',
+class ProductAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = 'title', 'short_description', 'category', 'price', 'quantity',
+    list_select_related = 'category',
+    # Порядок и для автодополнения, которое разбивает выдачу на страницы тем же paginator
+    ordering = '-id',
+    autocomplete_fields = 'category',
+    # Поле для формы поиска и автодополнения, сам поиск идет по полнотекстовому индексу (get_search_results)
+    search_fields = 'title',
     inlines = [ProductImagesInline, ProductTagsInline]
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return get_search_backend().search(queryset, search_term), False
+
     class Meta:
         verbose_name = 'Product'
         verbose_name_plural = 'Products'
@@ -37,6 +59,7 @@ class ProductAdmin(admin.ModelAdmin):
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = 'name',
+    search_fields = 'name',
 
     class Meta:
         verbose_name = 'Tag'
@@ -44,14 +67,73 @@ class TagAdmin(admin.ModelAdmin):
 
 
 @admin.register(Review)
-class ReviewAdmin(admin.ModelAdmin):
-    list_display = 'author',
+class ReviewAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = '__str__', 'product', 'rate', 'date',
+    list_select_related = 'author', 'product',
+    autocomplete_fields = 'product', 'author',
+    date_hierarchy = 'date'
+    # Точное совпадение по уникальному индексу логина, а не LIKE по всей таблице
+    search_fields = 'author__username__exact',
 
     class Meta:
         verbose_name = 'Review'
         verbose_name_plural = 'Reviews'
 
 
+class OrderItemsInline(admin.TabularInline):
+    model = OrderItem
+    autocomplete_fields = 'product',
+    extra = 0
+
+
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
-    list_display = 'id',
+class OrderAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = 'id', 'user', 'status', 'total_cost', 'created_at',
+    list_select_related = 'user',
+    autocomplete_fields = 'user',
+    date_hierarchy = 'created_at'
+    search_fields = 'user__username__exact',
+    inlines = [OrderItemsInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        # Число ищется как номер заказа по первичному ключу
+        if search_term.strip().isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        return super().get_search_results(request, queryset, search_term)
+
+
+@admin.register(SalesRollup)
+class SalesRollupAdmin(admin.ModelAdmin):
+    """Аналитика продаж вместо списка записей: страница читает только предрасчитанные SalesRollup"""
+    dashboard_template = 'admin/app_shop/salesrollup/dashboard.html'
+    default_days = 30
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        date_to = self.get_date(request, 'to') or timezone.localdate()
+        date_from = self.get_date(request, 'from') or date_to - timedelta(days=self.default_days - 1)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Sales',
+            **get_dashboard(date_from, date_to),
+            **(extra_context or {}),
+        }
+        return TemplateResponse(request, self.dashboard_template, context)
+
+    @staticmethod
+    def get_date(request, name):
+        try:
+            return parse_date(request.GET.get(name, ''))
+        except ValueError:
+            return None
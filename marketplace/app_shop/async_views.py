@@ -0,0 +1,177 @@
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.views import View
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .cache import STATS_KEY, _aincrement, aget_versions, get_cache, get_response_key, make_etag
+from .facets import get_facets
+from .models import Product
+from .pagination import alist
+from .reviews import aget_first_page
+from .serializers import ProductCardSerializer
+from .views import CategoriesAPIView, CatalogAPIView, PopularProductsView, LimitedProductsView, SaleProductsView, \
+    BannerProductsView, TagsAPIView, ProductRetrieveAPIView
+
+
+class AsyncStorefrontView(View):
+    """
+    Async версия эндпоинта витрины только для чтения, подключается настройкой STOREFRONT_ASYNC_VIEWS.
+    Queryset, пагинация и сериализатор берутся у sync view из view_class, поэтому JSON, ETag и ключи кеша ответов
+    у обеих версий совпадают. Данные читаются через async ORM и async API кеша: в Django 4.2 запросы к БД
+    выполняются по очереди в потоке sync_to_async, зато ожидание не занимает поток сервера. Отдается только JSON
+    """
+    view_class = None
+    http_method_names = ['get', 'head', 'options']
+    media_type = 'application/json'
+
+    async def get(self, request, *args, **kwargs):
+        view = self.get_view(request, kwargs)
+        try:
+            versions = await aget_versions(view.cache_models)
+            etag = await self.get_etag(view, versions)
+            response = get_conditional_response(request, etag=etag) if etag is not None else None
+            if response is None:
+                data, cache_status = await self.get_cached_data(view, versions)
+                response = self.render(data)
+                if cache_status:
+                    response['X-Cache'] = cache_status
+        except (APIException, Http404) as exc:
+            return self.handle_exception(exc)
+        if etag is not None:
+            response['ETag'] = etag
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+    def get_view(self, request, kwargs):
+        """Экземпляр sync view для построения queryset, пагинации и сериализации"""
+        return self.view_class(request=Request(request), args=(), kwargs=kwargs, format_kwarg=None)
+
+    async def get_etag(self, view, versions):
+        # Тот же ETag, что у ConditionalGetMixin для JSON
+        return make_etag(self.view_class.__name__, self.media_type, view.request.META.get('QUERY_STRING', ''),
+                         *versions)
+
+    async def get_cached_data(self, view, versions):
+        """(данные ответа, HIT/MISS или None для view без кеша StorefrontCacheMixin)"""
+        cache_name = getattr(view, 'cache_name', None)
+        if cache_name is None:
+            return await self.get_data(view), None
+        cache = get_cache()
+        key = get_response_key(cache_name, versions, view.request.META.get('QUERY_STRING', ''))
+        data = await cache.aget(key)
+        if data is not None:
+            await _aincrement(STATS_KEY.format(cache_name, 'hits'))
+            return data, 'HIT'
+        await _aincrement(STATS_KEY.format(cache_name, 'misses'))
+        data = await self.get_data(view)
+        await cache.aset(key, data, getattr(settings, 'STOREFRONT_CACHE_TIMEOUT', 300))
+        return data, 'MISS'
+
+    async def get_data(self, view):
+        raise NotImplementedError
+
+    def render(self, data, status=200):
+        return HttpResponse(JSONRenderer().render(data), status=status, content_type=self.media_type)
+
+    def handle_exception(self, exc):
+        # Тело ошибки в формате обработчика исключений DRF
+        if isinstance(exc, Http404):
+            exc = NotFound()
+        data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+        return self.render(data, status=exc.status_code)
+
+
+class AsyncListView(AsyncStorefrontView):
+    async def get_data(self, view):
+        queryset = view.filter_queryset(view.get_queryset())
+        paginator = view.paginator
+        page = await paginator.apaginate_queryset(queryset, view.request, view) if paginator is not None else None
+        if page is None:
+            return await self.serialize(view, await alist(queryset))
+        return paginator.get_paginated_response(await self.serialize(view, page)).data
+
+    async def serialize(self, view, objects):
+        return view.get_serializer(objects, many=True).data
+
+
+class AsyncProductListView(AsyncListView):
+    async def serialize(self, view, products):
+        return await ProductCardSerializer.aserialize(products)
+
+
+class AsyncCategoriesView(AsyncStorefrontView):
+    view_class = CategoriesAPIView
+
+    async def get_data(self, view):
+        children = defaultdict(list)
+        async for category in view.get_queryset():
+            children[category.parent_id].append(category)
+        context = view.get_serializer_context()
+        context['children'] = children
+        return view.get_serializer_class()(children[None], many=True, context=context).data
+
+
+class AsyncCatalogView(AsyncProductListView):
+    view_class = CatalogAPIView
+
+    async def get_data(self, view):
+        params = view.request.query_params
+        if params.get('facets') not in ('1', 'true'):
+            return await super().get_data(view)
+        data = await super().get_data(view)
+        data['facets'] = await sync_to_async(get_facets)(view.get_queryset(), params)
+        return data
+
+
+class AsyncPopularProductsView(AsyncProductListView):
+    view_class = PopularProductsView
+
+
+class AsyncLimitedProductsView(AsyncProductListView):
+    view_class = LimitedProductsView
+
+
+class AsyncSaleProductsView(AsyncProductListView):
+    view_class = SaleProductsView
+
+
+class AsyncBannerProductsView(AsyncProductListView):
+    view_class = BannerProductsView
+
+
+class AsyncTagsView(AsyncListView):
+    view_class = TagsAPIView
+
+
+class AsyncProductView(AsyncStorefrontView):
+    view_class = ProductRetrieveAPIView
+
+    async def get_etag(self, view, versions):
+        pk = view.kwargs['pk']
+        version = await Product.objects.filter(pk=pk).values_list('version', flat=True).afirst()
+        if version is None:
+            return None
+        return make_etag('product', pk, version, self.media_type)
+
+    async def get_data(self, view):
+        pk = view.kwargs['pk']
+        try:
+            product = await view.get_queryset().prefetch_related('tags').aget(pk=pk)
+        except Product.DoesNotExist:
+            raise Http404
+        reviews_page = await aget_first_page(pk)
+        context = dict(view.get_serializer_context(), reviews_page=reviews_page)
+        return view.get_serializer(product, context=context).data
+
+
+# Sync view -> async версия для app_shop.urls
+ASYNC_VIEWS = {view.view_class: view for view in (
+    AsyncCategoriesView, AsyncCatalogView, AsyncPopularProductsView, AsyncLimitedProductsView, AsyncSaleProductsView,
+    AsyncBannerProductsView, AsyncTagsView, AsyncProductView,
+)}
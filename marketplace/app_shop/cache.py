@@ -0,0 +1,151 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+VERSION_KEY = 'storefront:version:{}'
+STATS_KEY = 'storefront:stats:{}:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'STOREFRONT_CACHE_ALIAS', 'default')]
+
+
+def get_versions(model_names):
+    """Текущие версии моделей одним запросом к кешу; отсутствующие версии инициализируются текущим временем"""
+    cache = get_cache()
+    keys = [VERSION_KEY.format(name) for name in model_names]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            initial = _initial_version()
+            cache.add(key, initial, timeout=None)
+            versions[key] = cache.get(key, initial)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(model_names):
+    """Async вариант get_versions для async views"""
+    cache = get_cache()
+    keys = [VERSION_KEY.format(name) for name in model_names]
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            initial = _initial_version()
+            await cache.aadd(key, initial, timeout=None)
+            versions[key] = await cache.aget(key, initial)
+    return [versions[key] for key in keys]
+
+
+def bump_version(model_name):
+    """Увеличивает версию модели, после чего все ответы, которые от нее зависят, перестают читаться из кеша"""
+    _increment(VERSION_KEY.format(model_name), initial=_initial_version())
+
+
+def _initial_version():
+    # Версии попадают в ETag, поэтому после очистки кеша они не должны начинаться заново с прежних значений
+    return int(time.time() * 1000)
+
+
+def get_response_key(cache_name, versions, query_string):
+    """Ключ закешированного ответа view витрины: общий для sync и async версий view"""
+    query = hashlib.md5(query_string.encode()).hexdigest()
+    return f'storefront:response:{cache_name}:{".".join(str(version) for version in versions)}:{query}'
+
+
+def make_etag(*parts):
+    """Сильный ETag из частей, однозначно определяющих содержимое ответа"""
+    return quote_etag(hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def get_stats():
+    """Счетчики попаданий и промахов по каждому закешированному view: {name: {'hits': .., 'misses': ..}}"""
+    cache = get_cache()
+    names = [view.cache_name for view in StorefrontCacheMixin.__subclasses__()]
+    keys = {STATS_KEY.format(name, kind): (name, kind) for name in names for kind in ('hits', 'misses')}
+    values = cache.get_many(keys)
+    stats = {name: {'hits': 0, 'misses': 0} for name in names}
+    for key, (name, kind) in keys.items():
+        stats[name][kind] = values.get(key, 0)
+    return stats
+
+
+def reset_stats():
+    get_cache().delete_many([STATS_KEY.format(view.cache_name, kind)
+                             for view in StorefrontCacheMixin.__subclasses__() for kind in ('hits', 'misses')])
+
+
+def _increment(key, initial=1):
+    cache = get_cache()
+    # add + incr работает на locmem, file и database бэкендах: incr падает только на отсутствующем ключе
+    if not cache.add(key, initial, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, initial, timeout=None)
+
+
+async def _aincrement(key, initial=1):
+    cache = get_cache()
+    if not await cache.aadd(key, initial, timeout=None):
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            await cache.aset(key, initial, timeout=None)
+
+
+class ConditionalGetMixin:
+    """
+    ETag для GET без сериализации ответа: по умолчанию из версий моделей cache_models, адреса запроса
+    и формата ответа. На If-None-Match с тем же ETag отдается 304.
+    Ставится перед StorefrontCacheMixin, чтобы 304 отдавался без чтения ответа из кеша
+    """
+    cache_models = ()
+
+    def get_etag(self, request, *args, **kwargs):
+        """ETag ответа или None, если его нельзя вычислить без выполнения запроса"""
+        return make_etag(type(self).__name__, request.accepted_media_type, request.META.get('QUERY_STRING', ''),
+                         *get_versions(self.cache_models))
+
+    def get(self, request, *args, **kwargs):
+        etag = self.get_etag(request, *args, **kwargs)
+        if etag is None:
+            return super().get(request, *args, **kwargs)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class StorefrontCacheMixin:
+    """
+    Кеширует ответ на GET для одинаковых для всех пользователей эндпоинтов витрины.
+    Ключ включает версии моделей из cache_models, поэтому сигналы об изменении этих моделей
+    (app_shop.signals) сразу делают старые записи недостижимыми, а сами записи истекают по таймауту
+    """
+    cache_name = None
+    cache_models = ()
+
+    def get(self, request, *args, **kwargs):
+        cache = get_cache()
+        key = get_response_key(self.cache_name, get_versions(self.cache_models), request.META.get('QUERY_STRING', ''))
+
+        data = cache.get(key)
+        if data is not None:
+            _increment(STATS_KEY.format(self.cache_name, 'hits'))
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _increment(STATS_KEY.format(self.cache_name, 'misses'))
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, getattr(settings, 'STOREFRONT_CACHE_TIMEOUT', 300))
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,76 @@
+from django.db.models import Count
+
+from .models import ProductTag
+
+TAG_MODES = ('any', 'all')
+# filter[tags] из описания API и tags[] / tags, которые передает фронтенд (axios сериализует массив как tags[])
+TAG_PARAMS = ('filter[tags]', 'tags[]', 'tags')
+TAG_MODE_PARAM = 'filter[tagsMode]'
+# Допустимые значения sort и поля сортировки, у каждого есть индекс (поле, id) в Product.Meta.indexes;
+# rating_rank - аннотация rating_rank_expression()
+SORT_FIELDS = {
+    'id': 'id',
+    'price': 'price',
+    'date': 'date',
+    'reviews': 'review_count',
+    'rating': 'rating_rank',
+    'quantity': 'quantity',
+}
+DEFAULT_SORT = 'id'
+# Сортировка, которую фронтенд передает, пока пользователь не выбрал свою (catalog.js, mounted)
+FRONTEND_DEFAULT_SORT = ('price', 'inc')
+
+
+def get_list(params, name):
+    if hasattr(params, 'getlist'):
+        return params.getlist(name)
+    value = params.get(name)
+    return value if isinstance(value, (list, tuple)) else [] if value is None else [value]
+
+
+def parse_tags(params):
+    """(отсортированные id тегов, режим any или all) из параметров запроса; id можно передать списком или через запятую"""
+    tag_ids = set()
+    for name in TAG_PARAMS:
+        for value in get_list(params, name):
+            for item in str(value).split(','):
+                try:
+                    tag_ids.add(int(item))
+                except ValueError:
+                    continue
+    mode = str(params.get(TAG_MODE_PARAM) or 'any').lower()
+    return sorted(tag_ids), mode if mode in TAG_MODES else 'any'
+
+
+def filter_by_tags(queryset, tag_ids, mode='any'):
+    """
+    any - товары хотя бы с одним из тегов: полусоединение id IN (SELECT product_id ... WHERE tag_id IN (...)).
+    all - товары со всеми тегами: тот же подзапрос с GROUP BY product_id HAVING COUNT(*) = количество тегов.
+    Подзапросы читают только индекс (tag, product) таблицы связи
+    """
+    if not tag_ids:
+        return queryset
+    links = ProductTag.objects.filter(tag_id__in=tag_ids)
+    if mode == 'all':
+        links = links.values('product_id').annotate(tag_count=Count('tag_id')).filter(tag_count=len(tag_ids))
+    return queryset.filter(id__in=links.values('product_id'))
+
+
+def get_ordering(params):
+    """
+    Сортировка каталога по sort и sortType (dec - по убыванию) из белого списка SORT_FIELDS,
+    неизвестные значения заменяются сортировкой по id. id добавляется в том же направлении:
+    порядок однозначен и целиком совпадает с индексом, который читается в прямом или обратном порядке
+    """
+    field = SORT_FIELDS.get(params.get('sort') or DEFAULT_SORT, SORT_FIELDS[DEFAULT_SORT])
+    prefix = '-' if params.get('sortType') == 'dec' else ''
+    return [prefix + field] if field == 'id' else [prefix + field, prefix + 'id']
+
+
+def is_explicit_sort(params):
+    """
+    Выбрал ли клиент сортировку сам. Отсутствующая или неизвестная сортировка и начальная сортировка фронтенда
+    (FRONTEND_DEFAULT_SORT) не считаются: результаты поиска тогда упорядочиваются по релевантности
+    """
+    sort = params.get('sort')
+    return sort in SORT_FIELDS and (sort, params.get('sortType') or 'inc') != FRONTEND_DEFAULT_SORT
@@ -0,0 +1,124 @@
+import hashlib
+import json
+from collections import defaultdict
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+
+from django.conf import settings
+from django.db.models import Count, Max, Min, Q
+
+from .cache import get_cache, get_versions
+from .catalog import parse_tags
+from .models import CategoryClosure
+
+# Параметры каталога, от которых зависит набор товаров; страница и сортировка на фасеты не влияют
+FILTER_PARAMS = ('filter[name]', 'filter[minPrice]', 'filter[maxPrice]', 'filter[freeDelivery]', 'filter[available]',
+                 'category')
+PRICE_PARAMS = ('filter[minPrice]', 'filter[maxPrice]')
+# Модели, при изменении которых закешированные фасеты устаревают
+FACET_MODELS = ('Product', 'Tag', 'Category')
+
+
+def get_filter_signature(query_params):
+    """Подпись фильтра: одинаковая для запросов, которые отличаются только записью значений, страницей или сортировкой"""
+    normalized = {}
+    for name in FILTER_PARAMS:
+        value = ' '.join(str(query_params.get(name, '')).lower().split())
+        if not value:
+            continue
+        if name in PRICE_PARAMS:
+            try:
+                value = repr(float(value))
+            except ValueError:
+                pass
+        normalized[name] = value
+    tag_ids, mode = parse_tags(query_params)
+    if tag_ids:
+        normalized['tags'] = [tag_ids, mode]
+    return hashlib.md5(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+def get_facets(queryset, query_params):
+    """Фасеты для отфильтрованного queryset каталога, кешируются по подписи фильтра и версиям моделей"""
+    cache = get_cache()
+    versions = '.'.join(str(version) for version in get_versions(FACET_MODELS))
+    key = f'storefront:facets:{versions}:{get_filter_signature(query_params)}'
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(queryset)
+        cache.set(key, facets, getattr(settings, 'STOREFRONT_CACHE_TIMEOUT', 300))
+    return facets
+
+
+def compute_facets(queryset):
+    """
+    Количество товаров по категориям (с учетом подкатегорий), диапазонам цены, бесплатной доставке, наличию
+    и самые частые теги. Счетчики считаются условной агрегацией COUNT(...) FILTER (WHERE ...): не больше пяти
+    запросов при любом количестве категорий и диапазонов. Запросы строятся от самого queryset, а не от подзапроса id:
+    условия полнотекстового поиска (app_shop.search) ссылаются на таблицу товаров по имени
+    """
+    products = queryset.order_by()
+    stats = products.aggregate(
+        total=Count('id'),
+        free_delivery=Count('id', filter=Q(free_delivery=True)),
+        available=Count('id', filter=Q(available=True)),
+        min_price=Min('price'),
+        max_price=Max('price'),
+    )
+    total = stats['total']
+    facets = {
+        'total': total,
+        'categories': [],
+        'price': {'min': stats['min_price'], 'max': stats['max_price'], 'buckets': []},
+        'freeDelivery': {'true': stats['free_delivery'], 'false': total - stats['free_delivery']},
+        'available': {'true': stats['available'], 'false': total - stats['available']},
+        'tags': [],
+    }
+    if not total:
+        return facets
+    facets['price']['buckets'] = get_price_buckets(products, stats['min_price'], stats['max_price'])
+    facets['categories'] = get_category_counts(products)
+    top_tags = getattr(settings, 'CATALOG_FACET_TOP_TAGS', 10)
+    facets['tags'] = [
+        {'id': row['tags__id'], 'name': row['tags__name'], 'count': row['count']}
+        for row in products.filter(tags__isnull=False).values('tags__id', 'tags__name').annotate(
+            count=Count('id')).order_by('-count', 'tags__id')[:top_tags]
+    ]
+    return facets
+
+
+def get_price_buckets(products, min_price, max_price):
+    """
+    Равные диапазоны от минимальной до максимальной цены, последний включает максимум.
+    Крайние границы округляются до копеек наружу, чтобы самый дешевый и самый дорогой товар попали в диапазоны
+    """
+    size = getattr(settings, 'CATALOG_FACET_PRICE_BUCKETS', 5)
+    if min_price == max_price:
+        size = 1
+    low = float(Decimal(str(min_price)).quantize(Decimal('0.01'), ROUND_FLOOR))
+    high = float(Decimal(str(max_price)).quantize(Decimal('0.01'), ROUND_CEILING))
+    step = (high - low) / size
+    bounds = [low] + [round(low + step * index, 2) for index in range(1, size)] + [high]
+    counts = products.aggregate(**{
+        f'bucket_{index}': Count('id', filter=Q(price__gte=low) & (
+            Q(price__lte=high) if index == size - 1 else Q(price__lt=high)))
+        for index, (low, high) in enumerate(zip(bounds, bounds[1:]))
+    })
+    return [{'min': low, 'max': high, 'count': counts[f'bucket_{index}']}
+            for index, (low, high) in enumerate(zip(bounds, bounds[1:]))]
+
+
+def get_category_counts(products):
+    """
+    Количество товаров в каждой активной категории вместе с подкатегориями: товары считаются по их категориям,
+    затем суммируются по предкам из CategoryClosure
+    """
+    direct = dict(products.values_list('category_id').annotate(count=Count('id')).order_by())
+    counts = defaultdict(int)
+    categories = {}
+    for ancestor_id, title, parent_id, descendant_id in CategoryClosure.objects.filter(
+            descendant_id__in=list(direct), ancestor__active=True).values_list(
+            'ancestor_id', 'ancestor__title', 'ancestor__parent_id', 'descendant_id'):
+        counts[ancestor_id] += direct[descendant_id]
+        categories[ancestor_id] = (title, parent_id)
+    return [{'id': category_id, 'title': categories[category_id][0], 'parent': categories[category_id][1],
+             'count': counts[category_id]} for category_id in sorted(counts)]
@@ -0,0 +1,127 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import LeaderboardEntry, Product, rating_rank_expression
+
+
+class Leaderboard:
+    """
+    Предрасчитанный топ-K товаров по одному критерию, хранится в LeaderboardEntry.
+
+    Инвариант: записи доски - это точный топ-m товаров, m <= size. Поэтому при изменении одного товара
+    достаточно сравнить его с худшей записью доски, не трогая остальной каталог. Полный пересчет нужен,
+    только когда доска опустела ниже min_size (товары удалялись или выпадали из топа).
+
+    Ключ ранжирования: (score, tiebreak, -product_id), больше - лучше.
+    """
+    name = None
+    ordering = ()
+
+    def __init__(self, size=None, min_size=None):
+        self.size = size or getattr(settings, 'LEADERBOARD_SIZE', 50)
+        self.min_size = min_size or getattr(settings, 'LEADERBOARD_MIN_SIZE', 5)
+
+    def get_score(self, product):
+        """(score, tiebreak) товара"""
+        raise NotImplementedError
+
+    def get_ranked_products(self):
+        """Полная сортировка каталога, из которой берется топ при пересчете"""
+        return Product.objects.order_by(*self.ordering)
+
+    def queryset(self):
+        """Товары доски в порядке рейтинга"""
+        return Product.objects.filter(leaderboard_entries__board=self.name).order_by(
+            '-leaderboard_entries__score', '-leaderboard_entries__tiebreak', 'id')
+
+    def rebuild(self):
+        with transaction.atomic():
+            LeaderboardEntry.objects.filter(board=self.name).delete()
+            entries = [self.make_entry(product) for product in self.get_ranked_products()[:self.size]]
+            LeaderboardEntry.objects.bulk_create(entries)
+        return len(entries)
+
+    def update(self, product):
+        """Учитывает изменение одного товара за O(K)"""
+        score, tiebreak = self.get_score(product)
+        key = (score, tiebreak, -product.id)
+        with transaction.atomic():
+            entries = list(LeaderboardEntry.objects.select_for_update().filter(board=self.name))
+            size = len(entries)
+            current = next((entry for entry in entries if entry.product_id == product.id), None)
+            others = [entry for entry in entries if entry.product_id != product.id]
+            worst = min(others, key=self.entry_key) if others else None
+
+            if current is not None:
+                if worst is None or key >= self.entry_key(worst):
+                    current.score, current.tiebreak = score, tiebreak
+                    current.save(update_fields=['score', 'tiebreak'])
+                else:
+                    # Товар опустился ниже худшей записи: за ним могут быть товары вне доски
+                    current.delete()
+                    size -= 1
+            elif worst is not None and key > self.entry_key(worst):
+                LeaderboardEntry.objects.create(board=self.name, product=product, score=score, tiebreak=tiebreak)
+                if size == self.size:
+                    worst.delete()
+                else:
+                    size += 1
+
+        if size < self.min_size:
+            self.rebuild()
+
+    def refresh(self):
+        """Пересчитывает доску, если в ней осталось меньше min_size записей"""
+        if LeaderboardEntry.objects.filter(board=self.name).count() < self.min_size:
+            self.rebuild()
+
+    def make_entry(self, product):
+        score, tiebreak = self.get_score(product)
+        return LeaderboardEntry(board=self.name, product=product, score=score, tiebreak=tiebreak)
+
+    @staticmethod
+    def entry_key(entry):
+        return entry.score, entry.tiebreak, -entry.product_id
+
+
+class TopRatedLeaderboard(Leaderboard):
+    """Наивысший рейтинг; при равенстве - больше отзывов, затем меньший id. Товары без отзывов идут последними"""
+    name = 'rated'
+
+    def get_score(self, product):
+        rating = product.average_rating()
+        return (rating if rating is not None else -1.0), product.review_count
+
+    def get_ranked_products(self):
+        return Product.objects.order_by(rating_rank_expression().desc(), F('review_count').desc(), 'id')
+
+
+class LowStockLeaderboard(Leaderboard):
+    """Наименьший остаток; при равенстве - меньший id"""
+    name = 'limited'
+    ordering = ('quantity', 'id')
+
+    def get_score(self, product):
+        return -product.quantity, 0
+
+
+LEADERBOARDS = {board.name: board for board in (TopRatedLeaderboard(), LowStockLeaderboard())}
+
+
+def update_leaderboards(product_id, boards=None):
+    """
+    Обновляет доски после фиксации текущей транзакции: к этому моменту товар может быть удален
+    (например, при каскадном удалении вместе с отзывами), и тогда доски только дополняются при необходимости.
+    Ошибка обновления доски только логируется: изменение товара уже зафиксировано,
+    а доску можно пересчитать командой rebuild_leaderboards
+    """
+    def update():
+        product = Product.objects.filter(pk=product_id).first()
+        for name in boards or LEADERBOARDS:
+            if product is None:
+                LEADERBOARDS[name].refresh()
+            else:
+                LEADERBOARDS[name].update(product)
+
+    transaction.on_commit(update, robust=True)
@@ -0,0 +1,365 @@
+import io
+import json
+import logging
+import math
+import platform
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from importlib import import_module
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, \
+    teardown_test_environment
+from django.urls import reverse
+from PIL import Image
+
+from app_shop.models import Category, Order, OrderItem, Product, ProductImage, Review, Tag
+from app_users.models import Profile, User
+
+URL_MODULES = ('app_shop.urls', 'cart.urls', 'app_users.urls')
+BENCH_PASSWORD = 'bench-password'
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон: создает детерминированный синтетический набор данных во временной тестовой БД, '
+        'вызывает все маршруты app_shop, cart и app_users через тестовый клиент и сохраняет '
+        'p50/p95/p99 задержки, число запросов к БД и пиковую память в JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--images', type=int, default=3, help='изображений на товар')
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--reviews', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=30, help='замеров на маршрут')
+        parser.add_argument('--routes', nargs='*', help='имена маршрутов (url name) для прогона, по умолчанию все')
+        parser.add_argument('--cold-cache', action='store_true', help='очищать кеш перед каждым запросом')
+        parser.add_argument('--keepdb', action='store_true', help='не удалять тестовую БД после прогона')
+        parser.add_argument('--output', default='bench_results.json')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+
+        setup_test_environment()
+        # Ошибки 500 попадают в отчет по статусам, трейсбеки django.request только засоряют вывод
+        request_logger = logging.getLogger('django.request')
+        old_level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False,
+                                                      keepdb=options['keepdb'])
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix='bench-media-')):
+                started = time.perf_counter()
+                scale = self.generate_dataset()
+                generation_seconds = time.perf_counter() - started
+                routes = self.run_routes()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+            request_logger.setLevel(old_level)
+
+        report = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'seed': options['seed'],
+                'scale': scale,
+                'dataset_seconds': round(generation_seconds, 3),
+                'requests_per_route': options['requests'],
+                'cold_cache': options['cold_cache'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'routes': routes,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+
+        self.print_report(routes)
+        self.stdout.write(self.style.SUCCESS(f'Report saved to {options["output"]}'))
+
+    # Синтетические данные
+
+    def generate_dataset(self):
+        options, rnd = self.options, self.random
+        chunk_size = options['chunk_size']
+
+        password = make_password(BENCH_PASSWORD)
+        # Первый пользователь - сотрудник, от его имени вызываются маршруты, требующие входа
+        users = User.objects.bulk_create([
+            User(username=f'bench{index}', name=f'Bench User {index}', password=password, is_staff=index == 0)
+            for index in range(max(1, options['users']))
+        ], batch_size=chunk_size)
+        Profile.objects.bulk_create([
+            Profile(user=user, fullName=user.name, email=f'{user.username}@example.com', phone='+79990000000')
+            for user in users
+        ], batch_size=chunk_size)
+        self.user = users[0]
+
+        roots = Category.objects.bulk_create([
+            Category(title=f'Category {index}', image=f'categories/category_{index}/image.png')
+            for index in range(max(1, options['categories'] // 4))
+        ])
+        categories = roots + Category.objects.bulk_create([
+            Category(title=f'Subcategory {index}', parent=rnd.choice(roots), image='categories/subcategory.png')
+            for index in range(options['categories'] - len(roots))
+        ])
+
+        products = []
+        for start in range(0, options['products'], chunk_size):
+            products += Product.objects.bulk_create([
+                Product(category=rnd.choice(categories), price=round(rnd.uniform(10, 5000), 2),
+                        quantity=rnd.randint(0, 500), title=f'Product {index} {rnd.choice(WORDS)}',
+                        full_description=' '.join(rnd.choices(WORDS, k=rnd.randint(20, 120))),
+                        free_delivery=rnd.random() < 0.5, available=rnd.random() < 0.9,
+                        discount=rnd.choice([0, 0, 0, 5, 10, 25]))
+                for index in range(start, min(start + chunk_size, options['products']))
+            ])
+        self.product = products[0]
+
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'products/product_{product.id}/images/{number}.jpg')
+            for product in products for number in range(options['images'])
+        ], batch_size=chunk_size)
+
+        tags = Tag.objects.bulk_create([Tag(name=f'tag {index}') for index in range(options['tags'])])
+        self.tag_ids = [tag.id for tag in tags[:3]]
+        if tags:
+            Tag.product.through.objects.bulk_create([
+                Tag.product.through(tag=tag, product=product)
+                for product in products for tag in rnd.sample(tags, min(len(tags), rnd.randint(0, 4)))
+            ], batch_size=chunk_size)
+
+        for start in range(0, options['reviews'], chunk_size):
+            Review.objects.bulk_create([
+                Review(product=rnd.choice(products), author=rnd.choice(users), rate=rnd.randint(1, 5),
+                       text=' '.join(rnd.choices(WORDS, k=rnd.randint(3, 30))))
+                for _ in range(start, min(start + chunk_size, options['reviews']))
+            ])
+
+        orders = []
+        for start in range(0, options['orders'], chunk_size):
+            chunk = [
+                self.make_order(rnd.choice(users), rnd.sample(products, min(len(products), rnd.randint(1, 5))))
+                for _ in range(start, min(start + chunk_size, options['orders']))
+            ]
+            orders += Order.objects.bulk_create([order for order, _ in chunk])
+            OrderItem.objects.bulk_create([item for _, items in chunk for item in items])
+        self.order = Order.objects.filter(user=self.user).first()
+        if self.order is None:
+            self.order, items = self.make_order(self.user, products[:1])
+            self.order.save()
+            OrderItem.objects.bulk_create(items)
+
+        # bulk_create не вызывает сигналы, поэтому денормализованные структуры строятся командами
+        for command in ('rebuild_category_tree', 'rebuild_product_ratings', 'rebuild_search_index',
+                        'rebuild_leaderboards'):
+            call_command(command, stdout=io.StringIO())
+
+        return {
+            'categories': len(categories), 'products': len(products), 'images': len(products) * options['images'],
+            'tags': len(tags), 'reviews': options['reviews'], 'users': len(users), 'orders': len(orders),
+        }
+
+    def make_order(self, user, products):
+        items = [OrderItem(product=product, category_id=product.category_id, title=product.title,
+                           price=round(product.price, 2), quantity=self.random.randint(1, 3))
+                 for product in products]
+        order = Order(user=user, delivery_type='free', payment_type='online', city='Moscow', address='Street 1',
+                      total_cost=round(sum(item.price * item.quantity for item in items), 2))
+        for item in items:
+            item.order = order
+        return order, items
+
+    # Прогон маршрутов
+
+    def get_scenarios(self):
+        """Запрос для каждого маршрута: (метод, путь, параметры client, нужен ли вход, подготовка перед запросом)"""
+        product_id, order_id = self.product.id, self.order.id
+        counter = iter(range(10 ** 9))
+        catalog_params = {
+            'filter[name]': WORDS[0], 'filter[minPrice]': '100', 'filter[maxPrice]': '4000',
+            'filter[freeDelivery]': '', 'filter[available]': 'true', 'category': '', 'sort': 'rating',
+            'sortType': 'dec', 'currentPage': '1', 'limit': '20',
+        }
+
+        def json_form(payload):
+            # Фронтенд отправляет JSON строкой в теле form-urlencoded запроса
+            return {'data': json.dumps(payload), 'content_type': 'application/x-www-form-urlencoded'}
+
+        def add_to_basket(client):
+            client.post(reverse('basket'), {'id': product_id, 'count': 1})
+
+        def login(client):
+            # Хеш пароля в сессии должен совпадать с текущим, а смена пароля его меняет
+            self.user.refresh_from_db(fields=['password'])
+            client.force_login(self.user)
+
+        return {
+            'categories-list': ('get', reverse('categories-list'), {}, False, None),
+            'catalog-list': ('get', reverse('catalog-list'), {'data': catalog_params}, False, None),
+            'popular-products': ('get', reverse('popular-products'), {}, False, None),
+            'limited-products': ('get', reverse('limited-products'), {}, False, None),
+            'sales-products': ('get', reverse('sales-products'), {'data': {'currentPage': 1, 'limit': 20}}, False,
+                               None),
+            'banners-products': ('get', reverse('banners-products'), {}, False, None),
+            'tags-list': ('get', reverse('tags-list'), {}, False, None),
+            'cache-stats': ('get', reverse('cache-stats'), {}, True, None),
+            'orders-list': ('get', reverse('orders-list'), {}, True, None),
+            'order-detail': ('get', reverse('order-detail', args=[order_id]), {}, True, None),
+            'payment-detail': ('post', reverse('payment-detail'), {'data': {'number': '9999999999999999'}}, True,
+                               None),
+            'product-detail': ('get', reverse('product-detail', args=[product_id]), {}, False, None),
+            'product-review': ('post', reverse('product-review', args=[product_id]),
+                               {'data': {'text': 'bench review', 'rate': 5}}, True, None),
+            'basket': ('get', reverse('basket'), {}, False, add_to_basket),
+            'sign-up': ('post', reverse('sign-up'),
+                        lambda: json_form({'name': 'Bench', 'username': f'bench-signup-{next(counter)}',
+                                           'password': BENCH_PASSWORD}), False, None),
+            'sign-in': ('post', reverse('sign-in'),
+                        json_form({'username': self.user.username, 'password': BENCH_PASSWORD}), False, None),
+            'sign-out': ('post', reverse('sign-out'), {}, False, login),
+            'profile': ('get', reverse('profile'), {}, True, None),
+            'profile-avatar': ('post', reverse('profile-avatar'), lambda: {'data': {'avatar': make_image()}}, True,
+                               None),
+            'change-password': ('post', reverse('change-password'),
+                                {'data': {'currentPassword': BENCH_PASSWORD, 'newPassword': BENCH_PASSWORD}}, True,
+                                # Смена пароля сбрасывает сессию, поэтому вход повторяется перед каждым запросом
+                                login),
+        }
+
+    def run_routes(self):
+        scenarios = self.get_scenarios()
+        # Дополнительные сценарии для остальных методов тех же маршрутов
+        tag_params = {'sort': 'price', 'sortType': 'inc', 'currentPage': '1', 'limit': '20',
+                      'filter[tags]': ','.join(map(str, self.tag_ids))}
+        extra = {
+            'catalog-list [tags any]': ('get', reverse('catalog-list'), {'data': tag_params}, False, None),
+            'catalog-list [tags all]': ('get', reverse('catalog-list'),
+                                        {'data': {**tag_params, 'filter[tagsMode]': 'all'}}, False, None),
+            'product-review [list]': ('get', reverse('product-review', args=[self.product.id]),
+                                      {'data': {'sort': 'rating', 'limit': 20}}, False, None),
+            'basket [post]': ('post', reverse('basket'), {'data': {'id': self.product.id, 'count': 1}}, False, None),
+            'basket [delete]': ('delete', reverse('basket'),
+                                {'data': json.dumps({'id': self.product.id, 'count': 1}),
+                                 'content_type': 'application/json'}, False,
+                                lambda client: client.post(reverse('basket'), {'id': self.product.id, 'count': 1})),
+            'orders-list [post]': ('post', reverse('orders-list'), {}, True,
+                                   lambda client: client.post(reverse('basket'), {'id': self.product.id, 'count': 1})),
+            'order-detail [post]': ('post', reverse('order-detail', args=[self.order.id]),
+                                    {'data': {'deliveryType': 'express', 'paymentType': 'online', 'status': 'accepted',
+                                              'city': 'Moscow', 'address': 'Street 2'}}, True, None),
+            'profile [post]': ('post', reverse('profile'),
+                               {'data': {'fullName': 'Bench User', 'email': 'bench@example.com',
+                                         'phone': '+79990000001'}}, True, None),
+        }
+
+        names = []
+        for module in URL_MODULES:
+            for pattern in import_module(module).urlpatterns:
+                names.append(pattern.name)
+                names += [name for name in extra if name.startswith(pattern.name + ' [')]
+        if self.options['routes']:
+            names = [name for name in names if name.split(' [')[0] in self.options['routes']]
+
+        results = {}
+        for name in names:
+            scenario = scenarios.get(name) or extra.get(name)
+            if scenario is None:
+                results[name] = {'skipped': 'no scenario'}
+                self.stderr.write(f'{name}: no scenario, skipped')
+                continue
+            results[name] = self.measure(*scenario)
+        return results
+
+    def measure(self, method, path, request_kwargs, authenticated, prepare):
+        client = Client(raise_request_exception=False)
+        if authenticated:
+            client.force_login(self.user)
+
+        def request():
+            if prepare:
+                prepare(client)
+            if self.options['cold_cache']:
+                cache.clear()
+            kwargs = request_kwargs() if callable(request_kwargs) else request_kwargs
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                elapsed = time.perf_counter() - started
+            return response.status_code, elapsed, len(queries)
+
+        request()  # прогрев
+        latencies, query_counts, statuses = [], [], {}
+        for _ in range(self.options['requests']):
+            status, elapsed, query_count = request()
+            latencies.append(elapsed * 1000)
+            query_counts.append(query_count)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+        # Пиковая память замеряется отдельным запросом, чтобы tracemalloc не искажал задержки
+        tracemalloc.start()
+        try:
+            request()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'method': method.upper(),
+            'path': path,
+            'statuses': statuses,
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'mean_ms': round(statistics.fmean(latencies), 3),
+            'queries_mean': round(statistics.fmean(query_counts), 2),
+            'queries_max': max(query_counts),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def print_report(self, routes):
+        self.stdout.write(f'{"route":<22} {"status":<12} {"p50":>9} {"p95":>9} {"p99":>9} {"queries":>8} {"peak KB":>9}')
+        for name, result in routes.items():
+            if 'skipped' in result:
+                self.stdout.write(f'{name:<22} skipped ({result["skipped"]})')
+                continue
+            statuses = ','.join(result['statuses'])
+            self.stdout.write(
+                f'{name:<22} {statuses:<12} {result["p50_ms"]:>9.2f} {result["p95_ms"]:>9.2f} '
+                f'{result["p99_ms"]:>9.2f} {result["queries_mean"]:>8.1f} {result["peak_memory_kb"]:>9.1f}')
+
+
+def percentile(values, percent):
+    """Перцентиль методом ближайшего ранга"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def make_image():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color=(200, 80, 40)).save(buffer, 'PNG')
+    buffer.seek(0)
+    buffer.name = 'avatar.png'
+    return buffer
+
+
+WORDS = ('chocolate', 'keyboard', 'chair', 'water', 'coffee', 'monitor', 'lamp', 'table', 'mouse', 'headphones',
+         'шоколад', 'кресло', 'клавиатура', 'вода', 'кофе', 'лампа', 'стол', 'мышь', 'наушники', 'монитор')
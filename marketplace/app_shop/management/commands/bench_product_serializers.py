@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from app_shop.models import Category, Product, ProductImage, Tag
+from app_shop.serializers import ProductSerializer, ProductCardSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость (строк/сек) ProductSerializer и ProductCardSerializer на синтетических товарах'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--images', type=int, default=3, help='изображений на товар')
+        parser.add_argument('--tags', type=int, default=20, help='всего тегов, у каждого товара до трех')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        # Данные создаются в транзакции, которая откатывается после замеров
+        try:
+            with transaction.atomic():
+                product_ids = self.create_products(options)
+                self.run(product_ids, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_products(self, options):
+        category = Category.objects.create(title='bench')
+        products = Product.objects.bulk_create([
+            Product(category=category, price=100 + index, quantity=index % 50, title=f'bench product {index}',
+                    full_description='lorem ipsum ' * 80, discount=index % 3 * 10)
+            for index in range(options['products'])
+        ])
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image=f'products/product_{product.id}/images/{number}.png')
+            for product in products for number in range(options['images'])
+        ])
+        tags = Tag.objects.bulk_create([Tag(name=f'bench tag {index}') for index in range(options['tags'])])
+        Tag.product.through.objects.bulk_create([
+            Tag.product.through(tag=tags[(product.id + shift) % len(tags)], product=product)
+            for product in products for shift in range(min(3, len(tags)))
+        ])
+        return [product.id for product in products]
+
+    def run(self, product_ids, repeat):
+        queryset = Product.objects.filter(id__in=product_ids).order_by('id')
+        variants = {
+            'ProductSerializer': lambda: ProductSerializer(queryset.prefetch_related('images'), many=True).data,
+            'ProductCardSerializer': lambda: ProductCardSerializer(
+                ProductCardSerializer.prepare_queryset(queryset), many=True).data,
+        }
+        results = {}
+        for name, serialize in variants.items():
+            best = None
+            for _ in range(repeat):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    data = serialize()
+                    elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = data
+            self.stdout.write(f'{name:<22} {len(data) / best:>10.0f} rows/sec  {len(queries)} queries')
+
+        if results['ProductSerializer'] == results['ProductCardSerializer']:
+            self.stdout.write(self.style.SUCCESS('Output is identical'))
+        else:
+            self.stdout.write(self.style.ERROR('Output differs'))
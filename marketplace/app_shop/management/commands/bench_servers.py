@@ -0,0 +1,234 @@
+import asyncio
+import importlib.util
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.urls import reverse
+
+from app_shop.models import Product
+from .bench import percentile
+
+# Режим -> (сервер, STOREFRONT_ASYNC_VIEWS)
+MODES = {
+    'wsgi': ('gunicorn', '0'),
+    'asgi-sync': ('uvicorn', '0'),
+    'asgi': ('uvicorn', '1'),
+}
+# Маршрут -> query string; product-detail получает pk первого товара
+ROUTES = {
+    'categories-list': '',
+    'catalog-list': 'limit=20&sort=price&sortType=inc',
+    'popular-products': '',
+    'limited-products': '',
+    'sales-products': '',
+    'banners-products': '',
+    'tags-list': '',
+    'product-detail': '',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает запросы/сек и p50/p99 эндпоинтов витрины под WSGI (gunicorn) и ASGI (uvicorn с sync и async '
+        'views) при большом числе одновременных keep-alive соединений. Серверы запускаются подпроцессами на '
+        'настроенной БД, в ней должны быть товары (например, после import_products)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--modes', nargs='*', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--routes', nargs='*', choices=list(ROUTES), help='маршруты для прогона, по умолчанию все')
+        parser.add_argument('--concurrency', type=int, default=200, help='одновременных соединений')
+        parser.add_argument('--duration', type=float, default=10, help='секунд нагрузки на маршрут')
+        parser.add_argument('--warmup', type=float, default=1, help='секунд прогрева перед замером')
+        parser.add_argument('--workers', type=int, default=1, help='процессов сервера в каждом режиме')
+        parser.add_argument('--threads', type=int, default=8, help='потоков на процесс gunicorn (gthread)')
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--output', default='bench_servers.json')
+
+    def handle(self, *args, **options):
+        missing = {MODES[mode][0] for mode in options['modes'] if importlib.util.find_spec(MODES[mode][0]) is None}
+        if missing:
+            raise CommandError(f'Не установлены {", ".join(sorted(missing))}: pip install {" ".join(sorted(missing))}')
+        paths = self.get_paths(options['routes'] or list(ROUTES))
+
+        results = {}
+        for mode in options['modes']:
+            port = get_free_port(options['host'])
+            server = self.start_server(mode, port, options)
+            try:
+                wait_for_server(server, options['host'], port, next(iter(paths.values())))
+                results[mode] = {}
+                for name, path in paths.items():
+                    self.stdout.write(f'{mode}: {name}')
+                    results[mode][name] = asyncio.run(run_load(options['host'], port, path, options))
+            finally:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+        report = {
+            'meta': {
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'concurrency': options['concurrency'],
+                'duration_seconds': options['duration'],
+                'workers': options['workers'],
+                'gunicorn_threads': options['threads'],
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'paths': paths,
+            'results': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+
+        self.print_report(results)
+        self.stdout.write(self.style.SUCCESS(f'Report saved to {options["output"]}'))
+
+    def get_paths(self, routes):
+        product_id = Product.objects.order_by('id').values_list('id', flat=True).first()
+        if product_id is None:
+            raise CommandError('В БД нет товаров, сначала загрузите каталог (import_products)')
+        paths = {}
+        for name in routes:
+            path = reverse(name, kwargs={'pk': product_id}) if name == 'product-detail' else reverse(name)
+            paths[name] = f'{path}?{ROUTES[name]}' if ROUTES[name] else path
+        return paths
+
+    def start_server(self, mode, port, options):
+        server, async_views = MODES[mode]
+        address = f'{options["host"]}:{port}'
+        if server == 'gunicorn':
+            command = ['gunicorn', 'marketplace.wsgi:application', '--bind', address,
+                       '--workers', str(options['workers']), '--threads', str(options['threads']),
+                       '--worker-class', 'gthread', '--log-level', 'warning']
+        else:
+            command = ['uvicorn', 'marketplace.asgi:application', '--host', options['host'], '--port', str(port),
+                       '--workers', str(options['workers']), '--log-level', 'warning', '--no-access-log']
+        env = dict(os.environ, STOREFRONT_ASYNC_VIEWS=async_views,
+                   DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'marketplace.settings'))
+        return subprocess.Popen([sys.executable, '-m', *command], cwd=settings.BASE_DIR, env=env)
+
+    def print_report(self, results):
+        self.stdout.write(f'{"route":<18} {"mode":<10} {"req/s":>9} {"p50":>9} {"p99":>9} {"errors":>7}')
+        for mode, routes in results.items():
+            for name, result in routes.items():
+                self.stdout.write(
+                    f'{name:<18} {mode:<10} {result["requests_per_second"]:>9.1f} {result["p50_ms"]:>9.2f} '
+                    f'{result["p99_ms"]:>9.2f} {result["errors"]:>7}')
+
+
+def get_free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(server, host, port, path, timeout=30):
+    """Ждет, пока сервер ответит на первый запрос"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise CommandError(f'Сервер завершился с кодом {server.returncode}')
+        try:
+            asyncio.run(fetch_once(host, port, path))
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError(f'Сервер не ответил за {timeout} с')
+
+
+async def fetch_once(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        return await request(reader, writer, host, path)
+    finally:
+        writer.close()
+
+
+async def request(reader, writer, host, path):
+    """GET по открытому keep-alive соединению: (статус, нужно ли переоткрыть соединение)"""
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\n\r\n'.encode())
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip().lower()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if not size:
+                break
+    else:
+        await reader.read()
+        return status, True
+    return status, headers.get('connection') == 'close'
+
+
+async def run_load(host, port, path, options):
+    """Держит concurrency соединений в цикле запросов: прогрев, затем замер в течение duration секунд"""
+    latencies, statuses = [], {}
+    errors = 0
+    measure_from = time.monotonic() + options['warmup']
+    stop_at = measure_from + options['duration']
+
+    async def worker():
+        nonlocal errors
+        reader = writer = None
+        while time.monotonic() < stop_at:
+            started = time.monotonic()
+            try:
+                if writer is None:
+                    reader, writer = await asyncio.open_connection(host, port)
+                status, reconnect = await request(reader, writer, host, path)
+            except (OSError, asyncio.IncompleteReadError, ValueError):
+                if started >= measure_from:
+                    errors += 1
+                if writer is not None:
+                    writer.close()
+                reader = writer = None
+                continue
+            finished = time.monotonic()
+            if started >= measure_from and finished <= stop_at:
+                latencies.append(finished - started)
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if reconnect:
+                writer.close()
+                reader = writer = None
+        if writer is not None:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(options['concurrency'])))
+    if not latencies:
+        return {'requests': 0, 'requests_per_second': 0, 'p50_ms': 0, 'p99_ms': 0, 'mean_ms': 0,
+                'errors': errors, 'statuses': statuses}
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / options['duration'], 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'errors': errors,
+        'statuses': statuses,
+    }
@@ -0,0 +1,63 @@
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_shop.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит товары заказов из JSON поля Order.products в строки OrderItem. '
+        'Каждая пачка заказов переносится в своей транзакции, повторный запуск продолжает с непереносенных заказов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        orders = Order.objects.filter(products__isnull=False).only('id', 'products').order_by('id')
+
+        converted = items = skipped = 0
+        last_id = 0
+        while True:
+            chunk = list(orders.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+
+            batch = []
+            for order in chunk:
+                for line in order.products if isinstance(order.products, list) else []:
+                    item = self.make_item(order, line)
+                    if item is None:
+                        skipped += 1
+                    else:
+                        batch.append(item)
+                order.products = None
+
+            with transaction.atomic():
+                OrderItem.objects.bulk_create(batch)
+                Order.objects.bulk_update(chunk, ['products'])
+            converted += len(chunk)
+            items += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Converted {converted} orders into {items} order items'))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f'Skipped {skipped} malformed order lines'))
+
+    @staticmethod
+    def make_item(order, line):
+        """Строка заказа из карточки товара старого формата, None для строк без id товара или с неверными данными"""
+        try:
+            return OrderItem(
+                order=order,
+                product_id=int(line['id']),
+                category_id=int(line['category']) if line.get('category') not in (None, '') else None,
+                title=str(line.get('title') or '')[:150],
+                price=round(Decimal(str(line.get('price') or 0)), 2),
+                quantity=max(int(line.get('count') or 1), 1),
+            )
+        except (KeyError, TypeError, ValueError, AttributeError, InvalidOperation):
+            return None
@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_shop.product_io import FIELDS, FORMATS, export_rows, get_format, get_writer
+
+
+class Command(BaseCommand):
+    help = (
+        f'Выгружает товары в CSV или JSONL (колонки: {", ".join(FIELDS)}). '
+        'Товары читаются пачками через iterator(), память не зависит от размера каталога. '
+        'Пути изображений указываются относительно MEDIA_ROOT, файл подходит для import_products --images-dir'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл выгрузки, "-" - стандартный вывод')
+        parser.add_argument('--format', choices=FORMATS, help='по умолчанию определяется по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path, chunk_size = options['path'], options['chunk_size']
+        self.verbosity = options['verbosity']
+        # При выводе в stdout прогресс пишется в stderr, чтобы не смешиваться с данными
+        log = self.stderr if path == '-' else self.stdout
+        file = sys.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        started = time.monotonic()
+        count = 0
+        try:
+            write = get_writer(file, get_format(path, options['format']))
+            for count, row in enumerate(export_rows(chunk_size=chunk_size), 1):
+                write(row)
+                if count % chunk_size == 0 and self.verbosity >= 1:
+                    elapsed = time.monotonic() - started
+                    log.write(f'{count} products in {elapsed:.1f}s ({count / max(elapsed, 1e-6):.0f} rows/s)')
+        finally:
+            if file is not sys.stdout:
+                file.close()
+        log.write(self.style.SUCCESS(f'Exported {count} products in {time.monotonic() - started:.1f}s'))
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_shop.models import ImportCheckpoint
+from app_shop.product_io import FIELDS, FORMATS, LIST_SEPARATOR, ProductImporter, get_format, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        f'Импортирует товары из CSV или JSONL (колонки: {", ".join(FIELDS)}; в CSV теги и изображения '
+        f'разделяются "{LIST_SEPARATOR}"). Строки с id существующего товара обновляют его. '
+        'Файл читается построчно, каждая пачка фиксируется вместе с позицией в файле, '
+        'поэтому прерванный импорт продолжается повторным запуском'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл импорта, "-" - стандартный ввод (без продолжения с позиции)')
+        parser.add_argument('--format', choices=FORMATS, help='по умолчанию определяется по расширению файла')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--images-dir', default='.', help='папка, относительно которой указаны пути изображений')
+        parser.add_argument('--restart', action='store_true', help='начать импорт файла с первой строки')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.verbosity = options['verbosity']
+        importer = ProductImporter(images_dir=options['images_dir'], chunk_size=options['chunk_size'],
+                                   on_error=lambda line, message: self.stderr.write(f'Row {line}: {message}'))
+        checkpoint = None if path == '-' else self.get_checkpoint(path, options['restart'])
+        skipped = checkpoint.rows if checkpoint else 0
+        if skipped:
+            self.stdout.write(f'Resuming after row {skipped}')
+
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        started = time.monotonic()
+        try:
+            for position in importer.run(read_rows(file, get_format(path, options['format'])), checkpoint):
+                self.report_progress(importer.stats, position, position - skipped, started)
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        stats = importer.stats
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {stats["created"]}, updated {stats["updated"]} products, attached {stats["images"]} images '
+            f'in {time.monotonic() - started:.1f}s'))
+        if stats['errors']:
+            self.stdout.write(self.style.WARNING(f'Skipped {stats["errors"]} invalid rows'))
+
+    def get_checkpoint(self, path, restart):
+        if not os.path.isfile(path):
+            raise CommandError(f'File not found: {path}')
+        stat = os.stat(path)
+        signature = f'{stat.st_size}:{stat.st_mtime_ns}'
+        key = hashlib.md5(os.path.abspath(path).encode()).hexdigest()
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(key=key, defaults={'signature': signature})
+        if checkpoint.signature != signature and checkpoint.rows and not restart:
+            raise CommandError(f'{path} changed after {checkpoint.rows} rows were imported, use --restart')
+        if restart or checkpoint.signature != signature:
+            checkpoint.signature, checkpoint.rows = signature, 0
+            checkpoint.save()
+        return checkpoint
+
+    def report_progress(self, stats, position, processed, started):
+        if self.verbosity < 1:
+            return
+        elapsed = time.monotonic() - started
+        self.stdout.write(f'Row {position}: {stats["created"]} created, {stats["updated"]} updated, '
+                          f'{stats["errors"]} errors, {processed / max(elapsed, 1e-6):.0f} rows/s')
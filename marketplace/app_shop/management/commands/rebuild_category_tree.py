@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app_shop.models import Category, CategoryClosure
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает таблицу предков категорий (CategoryClosure) по полю parent'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        parents = dict(Category.objects.values_list('id', 'parent_id'))
+
+        rows = []
+        for category_id in parents:
+            ancestor_id, depth = category_id, 0
+            while ancestor_id is not None:
+                rows.append(CategoryClosure(ancestor_id=ancestor_id, descendant_id=category_id, depth=depth))
+                ancestor_id, depth = parents.get(ancestor_id), depth + 1
+                if depth > len(parents):
+                    raise CommandError(f'Category {category_id} has a cycle in its parents')
+
+        with transaction.atomic():
+            CategoryClosure.objects.all().delete()
+            CategoryClosure.objects.bulk_create(rows, batch_size=options['chunk_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Created {len(rows)} closure rows for {len(parents)} categories'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app_shop.leaderboards import LEADERBOARDS
+from app_shop.models import LeaderboardEntry
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает предрасчитанные топы товаров (популярные и заканчивающиеся)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('boards', nargs='*', help=f'доски для пересчета: {", ".join(LEADERBOARDS)}; по умолчанию все')
+
+    def handle(self, *args, **options):
+        unknown = set(options['boards']) - set(LEADERBOARDS)
+        if unknown:
+            raise CommandError(f'Unknown leaderboards: {", ".join(sorted(unknown))}')
+        for name in options['boards'] or LEADERBOARDS:
+            count = LEADERBOARDS[name].rebuild()
+            self.stdout.write(self.style.SUCCESS(f'{name}: {count} entries'))
+        if not options['boards']:
+            # Записи досок, которых больше нет в LEADERBOARDS
+            removed, _ = LeaderboardEntry.objects.exclude(board__in=list(LEADERBOARDS)).delete()
+            if removed:
+                self.stdout.write(self.style.WARNING(f'Removed {removed} entries of unknown boards'))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from app_shop.cache import bump_version
+from app_shop.models import Product, Review, RATING_STARS
+
+RATING_FIELDS = ['review_count', 'rating_sum'] + [f'rate_{rate}_count' for rate in RATING_STARS]
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает хранимые рейтинг, количество отзывов и гистограмму оценок у товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        stats = {
+            row['product']: row
+            for row in Review.objects.filter(product__isnull=False).values('product').annotate(
+                review_count=Count('id'),
+                rating_sum=Sum('rate'),
+                **{f'rate_{rate}_count': Count('id', filter=Q(rate=rate)) for rate in RATING_STARS},
+            ).order_by()
+        }
+
+        updated = 0
+        products = Product.objects.only('id', *RATING_FIELDS).order_by('id')
+        batch = []
+        with transaction.atomic():
+            for product in products.iterator(chunk_size=chunk_size):
+                row = stats.get(product.id, {})
+                values = {field: row.get(field) or 0 for field in RATING_FIELDS}
+                if all(getattr(product, field) == value for field, value in values.items()):
+                    continue
+                for field, value in values.items():
+                    setattr(product, field, value)
+                product.version = F('version') + 1
+                batch.append(product)
+                if len(batch) >= chunk_size:
+                    updated += Product.objects.bulk_update(batch, RATING_FIELDS + ['version'])
+                    batch = []
+            if batch:
+                updated += Product.objects.bulk_update(batch, RATING_FIELDS + ['version'])
+            if updated:
+                # bulk_update не вызывает сигналы, кеш и ETag списков товаров сбрасываются здесь
+                transaction.on_commit(lambda: bump_version('Product'), robust=True)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated {updated} products'))
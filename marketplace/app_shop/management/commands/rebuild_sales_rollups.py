@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from app_shop.sales import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает дневную статистику продаж (SalesRollup) из строк заказов за период, по умолчанию за все время. '
+        'Заказы старого формата нужно сначала перенести командой convert_order_products'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='первый день периода, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='последний день периода, YYYY-MM-DD')
+
+    def handle(self, *args, **options):
+        dates = []
+        for name in ('date_from', 'date_to'):
+            try:
+                date = parse_date(options[name]) if options[name] else None
+            except ValueError:
+                date = None
+            if options[name] and date is None:
+                raise CommandError(f'Invalid date: {options[name]}')
+            dates.append(date)
+        created = rebuild_sales(*dates)
+        self.stdout.write(self.style.SUCCESS(f'Created {created} sales rollups'))
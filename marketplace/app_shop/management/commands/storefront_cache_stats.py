@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from app_shop.cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает счетчики попаданий и промахов кеша эндпоинтов витрины'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='обнулить счетчики после вывода')
+
+    def handle(self, *args, **options):
+        for name, stats in get_stats().items():
+            total = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / total * 100 if total else 0
+            self.stdout.write(f"{name:<12} hits={stats['hits']:<8} misses={stats['misses']:<8} hit ratio={ratio:.1f}%")
+        if options['reset']:
+            reset_stats()
@@ -1,14 +1,16 @@
-from django.db import models
-from django.db.models import Avg
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce, NullIf
 
 from app_users.models import User
 
 
 # Пути к media файлам
 def category_image_directory_path(instance, filename: str) -> str:
-    if instance.parent:
-        return f'categories/category_{instance.parent.id}/images/{filename}'
-    return f'categories/category_{instance.id}/images/{filename}'
+    # Изображения всех вложенных категорий хранятся в папке корневой категории
+    return f'categories/category_{instance.get_root_id()}/images/{filename}'
 
 
 def product_image_directory_path(instance, filename: str) -> str:
@@ -31,6 +33,80 @@ class Category(models.Model):
     def __str__(self):
         return self.title
 
+    def clean(self):
+        if self.pk and self.parent_id and CategoryClosure.objects.filter(
+                ancestor_id=self.pk, descendant_id=self.parent_id).exists():
+            raise ValidationError({'parent': 'Category cannot be moved into its own subcategory'})
+
+    def save(self, *args, **kwargs):
+        # Таблица предков CategoryClosure обновляется в одной транзакции с категорией
+        with transaction.atomic():
+            created = self._state.adding
+            if not created:
+                previous_parent_id = Category.objects.filter(pk=self.pk).values_list('parent_id', flat=True).first()
+            super().save(*args, **kwargs)
+            if created:
+                CategoryClosure.objects.bulk_create(
+                    [CategoryClosure(ancestor_id=self.pk, descendant_id=self.pk, depth=0)] + [
+                        CategoryClosure(ancestor_id=ancestor_id, descendant_id=self.pk, depth=depth + 1)
+                        for ancestor_id, depth in self.get_parent_ancestry()
+                    ])
+            elif previous_parent_id != self.parent_id:
+                self.move_subtree()
+
+    def get_parent_ancestry(self):
+        """Пары (id предка, глубина) для родителя, включая самого родителя с глубиной 0"""
+        if self.parent_id is None:
+            return []
+        return CategoryClosure.objects.filter(descendant_id=self.parent_id).values_list('ancestor_id', 'depth')
+
+    def move_subtree(self):
+        if CategoryClosure.objects.filter(ancestor_id=self.pk, descendant_id=self.parent_id).exists():
+            raise ValueError('Category cannot be moved into its own subcategory')
+        subtree = CategoryClosure.objects.filter(ancestor_id=self.pk)
+        # Отвязываем поддерево от прежних предков и привязываем к новым
+        CategoryClosure.objects.filter(descendant_id__in=subtree.values('descendant_id')).exclude(
+            ancestor_id__in=subtree.values('descendant_id')).delete()
+        nodes = list(subtree.values_list('descendant_id', 'depth'))
+        CategoryClosure.objects.bulk_create([
+            CategoryClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=ancestor_depth + depth + 1)
+            for ancestor_id, ancestor_depth in self.get_parent_ancestry()
+            for descendant_id, depth in nodes
+        ])
+
+    def get_root_id(self):
+        if self.parent_id is None:
+            return self.id
+        return CategoryClosure.objects.filter(descendant_id=self.parent_id).order_by('-depth').values_list(
+            'ancestor_id', flat=True).first()
+
+
+class CategoryClosure(models.Model):
+    """Все пары предок-потомок дерева категорий, включая саму категорию с depth=0"""
+    ancestor = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='descendants')
+    descendant = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='ancestors')
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_category_closure'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth'], name='category_closure_desc_idx'),
+        ]
+
+
+def rating_expression():
+    """Средний рейтинг товара из хранимых полей, NULL если отзывов нет"""
+    # Константы передаются литералами SQL, а не параметрами запроса: иначе SQLite не сопоставит
+    # выражение сортировки с индексом product_rating_idx
+    return Cast('rating_sum', FloatField()) / NullIf('review_count', RawSQL('0', ()))
+
+
+def rating_rank_expression():
+    """Рейтинг для сортировки: товары без отзывов (-1) ниже оцененных при любом порядке NULL в СУБД"""
+    return Coalesce(rating_expression(), RawSQL('-1.0', ()), output_field=FloatField())
+
 
 class Product(models.Model):
     category = models.ForeignKey(Category, related_name='category', on_delete=models.CASCADE)
@@ -43,22 +119,99 @@ class Product(models.Model):
     available = models.BooleanField(default=True, verbose_name='available')
     discount = models.PositiveSmallIntegerField(default=0, verbose_name='discount')
 
+    # Денормализованная статистика отзывов, обновляется сигналами из app_shop.signals
+    review_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='reviews count')
+    rating_sum = models.PositiveIntegerField(default=0, editable=False, verbose_name='rating sum')
+    rate_1_count = models.PositiveIntegerField(default=0, editable=False)
+    rate_2_count = models.PositiveIntegerField(default=0, editable=False)
+    rate_3_count = models.PositiveIntegerField(default=0, editable=False)
+    rate_4_count = models.PositiveIntegerField(default=0, editable=False)
+    rate_5_count = models.PositiveIntegerField(default=0, editable=False)
+
+    # Версия карточки товара для ETag: увеличивается при каждом изменении товара, его отзывов, изображений и тегов
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+            models.Index(fields=['date', 'id'], name='product_date_idx'),
+            models.Index(fields=['review_count', 'id'], name='product_reviews_idx'),
+            models.Index(fields=['quantity', 'id'], name='product_quantity_idx'),
+            models.Index(rating_rank_expression(), 'id', name='product_rating_idx'),
+            models.Index(fields=['id'], condition=models.Q(discount__gt=0), name='product_sale_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(available=True), name='product_available_price_idx'),
+        ]
+
+    # Поля, которые меняются только атомарными UPDATE (app_shop.signals, rebuild_product_ratings): обычное
+    # сохранение загруженной ранее копии товара не должно возвращать им старые значения, а версия - откатываться
+    # к значению копии перед увеличением в post_save
+    counter_fields = ('review_count', 'rating_sum', 'rate_1_count', 'rate_2_count', 'rate_3_count', 'rate_4_count',
+                      'rate_5_count', 'version')
+
     def __str__(self):
         return f'ID: {self.id} {self.title}'
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert'):
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                # Как в Model.save: у копии с отложенными полями сохраняются только загруженные
+                deferred = self.get_deferred_fields()
+                update_fields = [field.name for field in self._meta.concrete_fields
+                                 if not field.primary_key and field.attname not in deferred]
+            kwargs['update_fields'] = [name for name in update_fields if name not in self.counter_fields]
+        super().save(*args, **kwargs)
+
     def short_description(self):
         return self.full_description[:50]
 
     def reviews_count(self):
-
-        if not self.reviews:
-            return 0
-        reviews = self.reviews.count()
-        return reviews
+        return self.review_count
 
     def average_rating(self):
-        avg_rating = self.reviews.aggregate(rating=Avg('rate'))
-        return avg_rating['rating']
+        if not self.review_count:
+            return None
+        return self.rating_sum / self.review_count
+
+    def rating_histogram(self):
+        return {rate: getattr(self, f'rate_{rate}_count') for rate in RATING_STARS}
+
+
+# Оценки, для которых хранится гистограмма в Product.rate_<N>_count
+RATING_STARS = range(1, 6)
+
+
+class LeaderboardEntry(models.Model):
+    """Запись предрасчитанного топа товаров, см. app_shop.leaderboards"""
+    board = models.CharField(max_length=20)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    score = models.FloatField()
+    tiebreak = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'product'], name='unique_leaderboard_product'),
+        ]
+        indexes = [
+            models.Index(fields=['board', '-score', '-tiebreak', 'product'], name='leaderboard_rank_idx'),
+        ]
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Позиция команды import_products в файле: количество обработанных строк.
+    Обновляется в одной транзакции с импортом пачки, поэтому повторный запуск продолжает ровно с первой
+    незафиксированной строки
+    """
+    key = models.CharField(max_length=64, unique=True)
+    # Размер и время изменения файла: продолжать можно только импорт того же файла
+    signature = models.CharField(max_length=100)
+    rows = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Import checkpoint: {self.rows} rows'
+
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images', null=True, blank=True)
@@ -67,22 +220,60 @@ class ProductImage(models.Model):
 
 class Tag(models.Model):
     name = models.CharField(max_length=100)
-    product = models.ManyToManyField(Product, related_name='tags', )
+    product = models.ManyToManyField(Product, related_name='tags', through='ProductTag')
 
     def __str__(self):
         return self.name
 
 
+class ProductTag(models.Model):
+    """
+    Связь товаров и тегов (таблица прежней автоматической M2M связи Tag.product).
+    Оба составных индекса покрывают фильтр каталога по тегам без чтения строк таблицы:
+    (tag, product) - выбор товаров по тегам, (product, tag) - проверка тегов конкретного товара
+    """
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, db_index=False)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        db_table = 'app_shop_tag_product'
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'product'], name='unique_product_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['product', 'tag'], name='product_tag_product_idx'),
+        ]
+
+    def __str__(self):
+        return f'Tag {self.tag_id}: product {self.product_id}'
+
+
 class Review(models.Model):
-    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews', blank=True, null=True)
+    # Отдельный индекс по product_id не нужен: его покрывают составные индексы ниже
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews', blank=True, null=True,
+                                db_index=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     rate = models.PositiveSmallIntegerField(default=0)
     text = models.TextField(blank=True)
     date = models.DateTimeField(auto_now=True, editable=False)
 
+    class Meta:
+        indexes = [
+            # Навигация по датам в админке (date_hierarchy)
+            models.Index(fields=['date', 'id'], name='review_date_idx'),
+            # Страницы отзывов товара (app_shop.reviews): новые сначала и по оценке
+            models.Index(fields=['product', 'date', 'id'], name='review_product_date_idx'),
+            models.Index(fields=['product', 'rate', 'date', 'id'], name='review_product_rate_idx'),
+        ]
+
     def __str__(self):
         return f'review by: {self.author.name}'
 
+    def save(self, *args, **kwargs):
+        # Отзыв и статистика товара (см. app_shop.signals) сохраняются в одной транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Order(models.Model):
     DELIVERY_CHOICES = [
@@ -100,7 +291,7 @@ class Order(models.Model):
         ('delivered', 'order is already delivered'),
     ]
 
-    created_at = models.DateTimeField(auto_now=True)
+    created_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
     delivery_type = models.CharField(max_length=10)
     payment_type = models.CharField(max_length=10)
@@ -108,7 +299,66 @@ class Order(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='accepted')
     city = models.CharField(max_length=100)
     address = models.CharField(max_length=150)
-    products = models.JSONField()
+    # Устаревший формат: полные карточки товаров в JSON. Новые заказы хранят строки в OrderItem,
+    # старые переносятся командой convert_order_products
+    products = models.JSONField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Навигация по датам в админке (date_hierarchy)
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+        ]
 
     def __str__(self):
         return f'Order: {self.id}'
+
+
+class OrderItem(models.Model):
+    """
+    Строка заказа: цена и название товара на момент оформления.
+    Связь с товаром без ограничения в БД, чтобы удаление товара не теряло его id в истории заказов
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False,
+                                related_name='order_items')
+    # Категория товара на момент оформления, по ней строится статистика продаж категорий
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                                 related_name='+')
+    title = models.CharField(max_length=150)
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f'Order {self.order_id}: {self.title} x {self.quantity}'
+
+
+class SalesRollup(models.Model):
+    """
+    Продажи за день: по товару (заполнен product), по категории (заполнен category) или итог дня (оба пустые).
+    orders - количество заказов, в которые входил товар или категория.
+    Обновляется при оформлении заказа, смене статуса и правке строк (app_shop.sales),
+    пересчитывается командой rebuild_sales_rollups
+    """
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                                related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                                 related_name='+')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    orders = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], condition=models.Q(product__isnull=False),
+                                    name='unique_sales_rollup_product'),
+            models.UniqueConstraint(fields=['date', 'category'], condition=models.Q(category__isnull=False),
+                                    name='unique_sales_rollup_category'),
+            models.UniqueConstraint(fields=['date'], condition=models.Q(product__isnull=True, category__isnull=True),
+                                    name='unique_sales_rollup_total'),
+        ]
+        verbose_name = 'Sales'
+        verbose_name_plural = 'Sales'
+
+    def __str__(self):
+        return f'Sales {self.date}: {self.units} units, {self.revenue}'
@@ -0,0 +1,251 @@
+import base64
+import binascii
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
+
+from .models import rating_rank_expression
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Paginator, который кеширует COUNT(*) по тексту SQL запроса.
+    lastPage на глубоких страницах может отставать от реального не больше чем на CATALOG_COUNT_CACHE_TIMEOUT секунд
+    """
+
+    @cached_property
+    def count(self):
+        key = self.get_count_key()
+        count = cache.get(key)
+        if count is None:
+            count = super().count
+            cache.set(key, count, getattr(settings, 'CATALOG_COUNT_CACHE_TIMEOUT', 60))
+        return count
+
+    async def acount(self):
+        """Async вариант count для async views, результат запоминается в count"""
+        if 'count' not in self.__dict__:
+            key = self.get_count_key()
+            count = await cache.aget(key)
+            if count is None:
+                count = await self.object_list.acount()
+                await cache.aset(key, count, getattr(settings, 'CATALOG_COUNT_CACHE_TIMEOUT', 60))
+            self.__dict__['count'] = count
+        return self.count
+
+    def get_count_key(self):
+        return 'catalog-count:' + hashlib.md5(str(self.object_list.query).encode()).hexdigest()
+
+    def page(self, number):
+        # Срез не ограничивается закешированным count, чтобы устаревшее значение не обрезало страницу
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class CustomCatalogPagination(pagination.PageNumberPagination):
+    """
+    Кастомная пагинация с помощью PageNumberPagination
+    Метод get_paginated_response переопределен для соответствия с swagger
+
+    Если в запросе передан параметр cursor (пустой для первой страницы), включается keyset-пагинация:
+    страница выбирается условием по ключам сортировки и id вместо OFFSET, а в ответе вместо номеров страниц
+    возвращаются непрозрачные курсоры nextCursor/prevCursor
+    """
+    page_size = 1
+    max_page_size = 100
+    page_size_query_param = 'limit'
+    django_paginator_class = CachedCountPaginator
+
+    cursor_query_param = 'cursor'
+    # Параметры, несовместимые с keyset-пагинацией: порядок результатов поиска задает релевантность (search_rank),
+    # которая не может быть ключом курсора
+    keyset_unsupported_params = ('filter[name]',)
+    # Поля, по которым возможна keyset-пагинация (сортировки app_shop.catalog.SORT_FIELDS)
+    keyset_fields = {
+        'id': 'id',
+        'price': 'price',
+        'date': 'date',
+        'review_count': 'review_count',
+        'quantity': 'quantity',
+        'rating_rank': 'rating_rank',
+    }
+
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        queryset, page_size = self.prepare_keyset_page(queryset, request)
+        return self.finish_keyset_page(list(queryset[:page_size + 1]), page_size)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        Async вариант paginate_queryset для async views (app_shop.async_views)
+        """
+        self.request = request
+        if self.cursor_query_param in request.query_params:
+            queryset, page_size = self.prepare_keyset_page(queryset, request)
+            return self.finish_keyset_page([item async for item in queryset[:page_size + 1]], page_size)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        page_number = request.query_params.get(self.page_query_param, 1)
+        if page_number in self.last_page_strings:
+            await paginator.acount()
+            page_number = paginator.num_pages
+        try:
+            bottom = (max(int(page_number), 1) - 1) * page_size
+        except (TypeError, ValueError):
+            bottom = 0
+        await paginator.acount()
+        items = await alist(queryset[bottom:bottom + page_size])
+        try:
+            # Количество уже загружено, проверка номера страницы не обращается к БД
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = items
+        return items
+
+    def prepare_keyset_page(self, queryset, request):
+        """Queryset страницы keyset-пагинации (на одну строку больше размера страницы) и размер страницы"""
+        unsupported = [param for param in self.keyset_unsupported_params if request.query_params.get(param)]
+        if unsupported:
+            raise ValidationError({self.cursor_query_param: f'Cursor pagination is not supported with {unsupported[0]}'})
+        self.keyset = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset, self.keys = self.get_keyset_queryset(queryset)
+        self.cursor_values, self.backwards = self.decode_cursor(request.query_params.get(self.cursor_query_param, ''),
+                                                                self.keys)
+
+        if self.cursor_values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(self.keys, self.cursor_values,
+                                                              forward=not self.backwards))
+        if self.backwards:
+            queryset = queryset.order_by(*[(name if desc else '-' + name) for name, desc in self.keys])
+        return queryset, page_size
+
+    def finish_keyset_page(self, items, page_size):
+        """Строки страницы и курсоры соседних страниц из загруженных строк prepare_keyset_page"""
+        keys = self.keys
+        has_more = len(items) > page_size
+        items = items[:page_size]
+        if self.backwards:
+            items.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, self.cursor_values is not None
+
+        self.next_cursor = self.encode_cursor(items[-1], keys, backwards=False) if items and has_next else None
+        self.previous_cursor = self.encode_cursor(items[0], keys, backwards=True) if items and has_previous else None
+        return items
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return Response({
+                'items': data,
+                'nextCursor': self.next_cursor,
+                'prevCursor': self.previous_cursor,
+            })
+        return Response({
+            'items': data,
+            'currentPage': self.page.number,
+            'lastPage': self.page.paginator.num_pages
+        })
+
+    def get_keyset_queryset(self, queryset):
+        """Приводит сортировку queryset к поддерживаемым ключам и добавляет id для однозначности"""
+        if queryset.query.is_sliced:
+            # По срезу нельзя фильтровать, поэтому ограничиваем выборку подзапросом
+            prefetch = queryset._prefetch_related_lookups
+            ordering = queryset.query.order_by
+            queryset = queryset.model._default_manager.filter(pk__in=queryset.values('pk')) \
+                .prefetch_related(*prefetch).order_by(*ordering)
+
+        keys = []
+        for field in queryset.query.order_by:
+            if not isinstance(field, str):
+                continue
+            desc = field.startswith('-')
+            name = self.keyset_fields.get(field.lstrip('-'))
+            if name is None:
+                continue
+            keys.append((name, desc))
+            if name == 'id':
+                break
+        else:
+            keys.append(('id', False))
+
+        if any(name == 'rating_rank' for name, _ in keys) and 'rating_rank' not in queryset.query.annotations:
+            queryset = queryset.annotate(rating_rank=rating_rank_expression())
+        return queryset.order_by(*[('-' + name if desc else name) for name, desc in keys]), keys
+
+    @staticmethod
+    def get_keyset_filter(keys, values, forward):
+        """(k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... с учетом направления каждого ключа"""
+        condition = Q()
+        equal = Q()
+        for (name, desc), value in zip(keys, values):
+            lookup = 'lt' if desc == forward else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, item, keys, backwards):
+        values = []
+        for name, _ in keys:
+            value = getattr(item, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        payload = {'k': [name for name, _ in keys], 'v': values, 'b': backwards}
+        return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor, keys):
+        if not cursor:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if payload['k'] != [name for name, _ in keys] or len(payload['v']) != len(keys):
+                raise ValueError
+            return payload['v'], bool(payload['b'])
+        except (binascii.Error, KeyError, TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+
+
+class ReviewPagination(CustomCatalogPagination):
+    """
+    Отзывы товара: всегда keyset-пагинация (параметр cursor необязателен), ответ {items, nextCursor, prevCursor}
+    """
+    page_size = 10
+    keyset_fields = {
+        'id': 'id',
+        'date': 'date',
+        'rate': 'rate',
+    }
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, page_size = self.prepare_keyset_page(queryset, request)
+        return self.finish_keyset_page(list(queryset[:page_size + 1]), page_size)
+
+    def first_page_queryset(self, queryset):
+        """Queryset первой страницы без HTTP запроса (для карточки товара), строки передаются в finish_keyset_page"""
+        self.keyset = True
+        self.cursor_values, self.backwards = None, False
+        queryset, self.keys = self.get_keyset_queryset(queryset)
+        return queryset[:self.page_size + 1]
+
+
+async def alist(queryset):
+    return [item async for item in queryset]
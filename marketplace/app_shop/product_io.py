@@ -0,0 +1,284 @@
+import csv
+import json
+import os
+from collections import defaultdict
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+
+from .cache import bump_version
+from .leaderboards import LEADERBOARDS
+from .models import Category, Product, ProductImage, Tag
+from .search import get_search_backend
+
+# Колонки файлов import_products и export_products. category - id категории (при импорте можно указать название),
+# tags - названия тегов, images - пути к файлам изображений
+FIELDS = ('id', 'category', 'title', 'price', 'quantity', 'discount', 'free_delivery', 'available',
+          'full_description', 'tags', 'images')
+PRODUCT_FIELDS = ('title', 'price', 'quantity', 'discount', 'free_delivery', 'available', 'full_description')
+# Поля, в которых пустая строка CSV - значение, а не пропуск
+TEXT_FIELDS = ('title', 'full_description')
+BOOLEAN_FIELDS = ('free_delivery', 'available')
+BOOLEAN_VALUES = {'true': True, 'yes': True, '1': True, 'false': False, 'no': False, '0': False}
+# Разделитель списков тегов и изображений в CSV
+LIST_SEPARATOR = '|'
+FORMATS = ('csv', 'jsonl')
+
+
+def get_format(path, format=None):
+    """Формат из параметра или по расширению файла: .jsonl и .ndjson - JSON Lines, остальные - CSV"""
+    if format:
+        return format
+    return 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+
+
+def read_rows(file, format):
+    """Строки файла по одной: словари для CSV, исходные строки для JSONL (разбираются при проверке строки)"""
+    if format == 'csv':
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            yield line
+
+
+def parse_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    elif not isinstance(value, list):
+        raise ValidationError('must be a list')
+    return list(dict.fromkeys(str(item).strip() for item in value if str(item).strip()))
+
+
+def format_error(error):
+    if hasattr(error, 'error_dict'):
+        return '; '.join(f'{field}: {" ".join(messages)}' for field, messages in error.message_dict.items())
+    return '; '.join(error.messages)
+
+
+class ProductImporter:
+    """
+    Импорт товаров пачками по chunk_size строк. Строки проверяются full_clean, новые товары создаются
+    bulk_create, товары с id из БД обновляются bulk_update (отсутствующие в строке поля не меняются).
+    Категории и теги ищутся по словарям в памяти, отсутствующие теги создаются.
+    Пачка вместе с тегами, изображениями, поисковым индексом и позицией в файле (ImportCheckpoint)
+    фиксируется одной транзакцией
+    """
+
+    def __init__(self, images_dir='.', chunk_size=1000, on_error=None):
+        self.images_dir = images_dir
+        self.chunk_size = chunk_size
+        self.on_error = on_error or (lambda line, message: None)
+        self.stats = {'created': 0, 'updated': 0, 'images': 0, 'errors': 0}
+        self.category_ids = set(Category.objects.values_list('id', flat=True))
+        self.category_titles = {}
+        for category_id, title in Category.objects.order_by('id').values_list('id', 'title'):
+            # Название, которое носят несколько категорий, не определяет категорию
+            self.category_titles[title] = None if title in self.category_titles else category_id
+        self.tag_ids = {}
+        for tag_id, name in Tag.objects.order_by('-id').values_list('id', 'name'):
+            self.tag_ids[name] = tag_id
+
+    def run(self, rows, checkpoint=None):
+        """
+        Импортирует строки, пропуская первые checkpoint.rows. После каждой пачки возвращает (yield)
+        номер последней обработанной строки
+        """
+        start = checkpoint.rows if checkpoint else 0
+        rows = enumerate(islice(rows, start, None), start + 1)
+        imported = False
+        while chunk := list(islice(rows, self.chunk_size)):
+            self.import_chunk(chunk, checkpoint)
+            imported = True
+            yield chunk[-1][0]
+        if imported:
+            # Топы товаров пересчитываются один раз после импорта, а не после каждой пачки
+            for leaderboard in LEADERBOARDS.values():
+                leaderboard.rebuild()
+
+    def import_chunk(self, chunk, checkpoint=None):
+        rows = []
+        for line, row in chunk:
+            try:
+                rows.append((line, self.parse(row)))
+            except ValidationError as error:
+                self.report(line, error)
+        existing = Product.objects.in_bulk({row['id'] for _, row in rows if row['id'] is not None})
+        prepared = {}
+        for line, row in rows:
+            try:
+                if row['id'] in prepared:
+                    raise ValidationError({'id': ['Duplicate id in the same chunk.']})
+                prepared[row['id'] if row['id'] is not None else ('line', line)] = self.prepare(row, existing)
+            except ValidationError as error:
+                self.report(line, error)
+
+        created = [product for product, _, _ in prepared.values() if product.id not in existing]
+        updated = [product for product, _, _ in prepared.values() if product.id in existing]
+        with transaction.atomic():
+            Product.objects.bulk_create(created)
+            for product in updated:
+                product.version = F('version') + 1
+            Product.objects.bulk_update(updated, PRODUCT_FIELDS + ('category', 'version'))
+            self.save_tags([(product.id, tags) for product, tags, _ in prepared.values() if tags is not None])
+            self.save_images([(product.id, images) for product, _, images in prepared.values() if images])
+            get_search_backend().index_products([product.id for product, _, _ in prepared.values()])
+            if checkpoint is not None:
+                checkpoint.rows = chunk[-1][0]
+                checkpoint.save(update_fields=['rows', 'updated_at'])
+            # bulk_create и bulk_update не вызывают сигналы, кеш витрины сбрасывается здесь
+            transaction.on_commit(lambda: [bump_version(name) for name in ('Product', 'Tag', 'ProductImage')],
+                                  robust=True)
+        self.stats['created'] += len(created)
+        self.stats['updated'] += len(updated)
+
+    def report(self, line, error):
+        self.stats['errors'] += 1
+        self.on_error(line, format_error(error))
+
+    @staticmethod
+    def parse(row):
+        """Словарь строки с id, приведенным к int или None"""
+        if isinstance(row, str):
+            try:
+                row = json.loads(row)
+            except ValueError:
+                raise ValidationError('Invalid JSON.')
+            if not isinstance(row, dict):
+                raise ValidationError('Row must be a JSON object.')
+        product_id = row.get('id')
+        if product_id in (None, ''):
+            return {**row, 'id': None}
+        try:
+            return {**row, 'id': int(product_id)}
+        except (TypeError, ValueError):
+            raise ValidationError({'id': ['Enter a whole number.']})
+
+    def prepare(self, row, existing):
+        """(товар, названия тегов или None, пути изображений или None) для строки файла"""
+        product = existing.get(row['id']) or Product(id=row['id'])
+        for field in PRODUCT_FIELDS:
+            value = row.get(field)
+            if value is None or (value == '' and field not in TEXT_FIELDS):
+                continue
+            if field in BOOLEAN_FIELDS and isinstance(value, str):
+                value = BOOLEAN_VALUES.get(value.strip().lower(), value)
+            setattr(product, field, value)
+        errors = {}
+        category = row.get('category')
+        if category not in (None, ''):
+            category_id = self.get_category_id(category)
+            if category_id is None:
+                errors['category'] = [f'Unknown category: {category}.']
+            else:
+                product.category_id = category_id
+        elif product.category_id is None:
+            errors['category'] = ['This field cannot be blank.']
+        try:
+            product.full_clean(exclude=['category'], validate_unique=False, validate_constraints=False)
+        except ValidationError as error:
+            errors.update(error.message_dict)
+
+        tags = images = None
+        try:
+            if 'tags' in row:
+                tags = parse_list(row['tags'])
+                if any(len(name) > Tag._meta.get_field('name').max_length for name in tags):
+                    raise ValidationError('Tag name is too long.')
+        except ValidationError as error:
+            errors['tags'] = error.messages
+        try:
+            if row.get('images') not in (None, ''):
+                images = [os.path.join(self.images_dir, path) for path in parse_list(row['images'])]
+                missing = [path for path in images if not os.path.isfile(path)]
+                if missing:
+                    raise ValidationError(f'File not found: {", ".join(missing)}.')
+        except ValidationError as error:
+            errors['images'] = error.messages
+        if errors:
+            raise ValidationError(errors)
+        return product, tags, images
+
+    def get_category_id(self, value):
+        try:
+            category_id = int(value)
+        except (TypeError, ValueError):
+            return self.category_titles.get(str(value).strip())
+        return category_id if category_id in self.category_ids else None
+
+    def save_tags(self, product_tags):
+        """Заменяет теги товаров; product_tags - [(id товара, названия тегов)]"""
+        if not product_tags:
+            return
+        new_tags = [Tag(name=name) for name in dict.fromkeys(name for _, names in product_tags for name in names)
+                    if name not in self.tag_ids]
+        Tag.objects.bulk_create(new_tags)
+        self.tag_ids.update((tag.name, tag.id) for tag in new_tags)
+
+        through = Product.tags.through
+        through.objects.filter(product_id__in=[product_id for product_id, _ in product_tags]).delete()
+        through.objects.bulk_create([through(product_id=product_id, tag_id=self.tag_ids[name])
+                                     for product_id, names in product_tags for name in names])
+
+    def save_images(self, product_images):
+        """
+        Копирует изображения в хранилище и добавляет их к товарам; product_images - [(id товара, пути)].
+        Файл, который уже есть у товара под тем же именем, повторно не добавляется.
+        Производные изображения создаются при первом запросе (marketplace.renditions)
+        """
+        attached = defaultdict(set)
+        for product_id, name in ProductImage.objects.filter(
+                product_id__in=[product_id for product_id, _ in product_images]).values_list('product_id', 'image'):
+            attached[product_id].add(os.path.basename(name))
+        images = []
+        for product_id, paths in product_images:
+            for path in paths:
+                filename = os.path.basename(path)
+                if filename in attached[product_id]:
+                    continue
+                image = ProductImage(product_id=product_id)
+                with open(path, 'rb') as file:
+                    image.image.save(filename, File(file), save=False)
+                attached[product_id].add(filename)
+                images.append(image)
+        ProductImage.objects.bulk_create(images)
+        self.stats['images'] += len(images)
+
+
+def export_rows(queryset=None, chunk_size=1000):
+    """
+    Строки экспорта в виде словарей с колонками FIELDS. Товары читаются iterator(chunk_size),
+    теги и изображения - одним запросом на пачку, поэтому память не зависит от количества товаров
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    columns = ('id', 'category_id') + PRODUCT_FIELDS
+    products = queryset.order_by('id').values_list(*columns).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(products, chunk_size)):
+        ids = [values[0] for values in chunk]
+        tags, images = defaultdict(list), defaultdict(list)
+        for product_id, name in Product.tags.through.objects.filter(product_id__in=ids).order_by('id').values_list(
+                'product_id', 'tag__name'):
+            tags[product_id].append(name)
+        for product_id, name in ProductImage.objects.filter(product_id__in=ids).order_by('id').values_list(
+                'product_id', 'image'):
+            images[product_id].append(name)
+        for values in chunk:
+            row = dict(zip(('id', 'category') + PRODUCT_FIELDS, values))
+            row['tags'] = tags[row['id']]
+            row['images'] = images[row['id']]
+            yield row
+
+
+def get_writer(file, format):
+    """Функция записи одной строки экспорта в файл; для CSV сразу пишется заголовок"""
+    if format == 'jsonl':
+        return lambda row: file.write(json.dumps(row, ensure_ascii=False) + '\n')
+    writer = csv.DictWriter(file, FIELDS)
+    writer.writeheader()
+    return lambda row: writer.writerow({**row, 'tags': LIST_SEPARATOR.join(row['tags']),
+                                        'images': LIST_SEPARATOR.join(row['images'])})
@@ -0,0 +1,37 @@
+from .models import Review
+from .pagination import ReviewPagination, alist
+
+# Сортировки отзывов: по дате и по оценке (при равной оценке новые сначала)
+REVIEW_SORT_FIELDS = {
+    'date': ('date',),
+    'rating': ('rate', 'date'),
+}
+DEFAULT_REVIEW_SORT = 'date'
+
+
+def get_review_ordering(params):
+    """
+    Сортировка отзывов по sort из REVIEW_SORT_FIELDS, по умолчанию по убыванию (sortType=inc - по возрастанию).
+    Вместе с product_id порядок совпадает с индексами review_product_date_idx и review_product_rate_idx
+    """
+    fields = REVIEW_SORT_FIELDS.get(params.get('sort') or DEFAULT_REVIEW_SORT, REVIEW_SORT_FIELDS[DEFAULT_REVIEW_SORT])
+    prefix = '' if params.get('sortType') == 'inc' else '-'
+    return [prefix + field for field in (*fields, 'id')]
+
+
+def get_review_queryset(product_id, params=None):
+    return Review.objects.filter(product_id=product_id).select_related('author__profile').order_by(
+        *get_review_ordering(params or {}))
+
+
+def get_first_page(product_id):
+    """Первая страница отзывов товара (новые сначала) и курсор следующей"""
+    paginator = ReviewPagination()
+    queryset = paginator.first_page_queryset(get_review_queryset(product_id))
+    return paginator.finish_keyset_page(list(queryset), paginator.page_size), paginator.next_cursor
+
+
+async def aget_first_page(product_id):
+    paginator = ReviewPagination()
+    queryset = paginator.first_page_queryset(get_review_queryset(product_id))
+    return paginator.finish_keyset_page(await alist(queryset), paginator.page_size), paginator.next_cursor
@@ -0,0 +1,122 @@
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import Category, OrderItem, Product, SalesRollup
+
+# Статусы заказов, которые учитываются в продажах
+SALES_STATUSES = ('accepted', 'delivery', 'delivered')
+# Ключ итога дня в словаре продаж: (product_id, category_id)
+TOTAL = (None, None)
+
+
+def is_counted(status):
+    return status in SALES_STATUSES
+
+
+def get_order_sales(order):
+    """
+    Вклад заказа в статистику: {(product_id, category_id): [units, revenue, orders]} по строкам заказа,
+    с ключами (id товара, None), (None, id категории) и итогом заказа TOTAL
+    """
+    sales = defaultdict(lambda: [0, Decimal(0), 0])
+    for product_id, category_id, quantity, price in order.items.values_list('product_id', 'category_id',
+                                                                            'quantity', 'price'):
+        keys = [TOTAL, (product_id, None)] + ([(None, category_id)] if category_id is not None else [])
+        for key in keys:
+            sales[key][0] += quantity
+            sales[key][1] += price * quantity
+    for line in sales.values():
+        # Заказ считается один раз для итога, каждого товара и каждой категории
+        line[2] = 1
+    return dict(sales)
+
+
+def apply_sales(date, sales, sign):
+    """Прибавляет (sign=1) или вычитает (sign=-1) продажи за день атомарными UPDATE ... SET x = x + n"""
+    # Строки обновляются в одном порядке, чтобы параллельные заказы не блокировали друг друга взаимно
+    for (product_id, category_id), (units, revenue, orders) in sorted(
+            sales.items(), key=lambda item: (item[0][0] or 0, item[0][1] or 0)):
+        rows = SalesRollup.objects.filter(date=date, product_id=product_id, category_id=category_id)
+        changes = {'units': F('units') + sign * units, 'revenue': F('revenue') + sign * revenue,
+                   'orders': F('orders') + sign * orders}
+        if rows.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                SalesRollup.objects.create(date=date, product_id=product_id, category_id=category_id,
+                                           units=sign * units, revenue=sign * revenue, orders=sign * orders)
+        except IntegrityError:
+            # Строку дня успел создать параллельный заказ
+            rows.update(**changes)
+
+
+def record_order(order, sign=1):
+    """Добавляет заказ в статистику дня его оформления или убирает из нее (sign=-1)"""
+    sales = get_order_sales(order)
+    if sales:
+        apply_sales(timezone.localdate(order.created_at), sales, sign)
+
+
+def rebuild_sales(date_from=None, date_to=None):
+    """Пересчитывает статистику за период (по умолчанию за все время) из строк заказов, возвращает число строк"""
+    items = OrderItem.objects.filter(order__status__in=SALES_STATUSES).annotate(date=TruncDate('order__created_at'))
+    rollups = SalesRollup.objects.all()
+    if date_from:
+        items, rollups = items.filter(date__gte=date_from), rollups.filter(date__gte=date_from)
+    if date_to:
+        items, rollups = items.filter(date__lte=date_to), rollups.filter(date__lte=date_to)
+    revenue = ExpressionWrapper(F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    totals = {'units': Sum('quantity'), 'revenue': Sum(revenue), 'orders': Count('order', distinct=True)}
+
+    created = 0
+    with transaction.atomic():
+        rollups.delete()
+        # Итоги дней, товаров и категорий: три запроса GROUP BY, строки записываются пачками
+        for group in ('date',), ('date', 'product_id'), ('date', 'category_id'):
+            queryset = items.values(*group).annotate(**totals).order_by()
+            if 'category_id' in group:
+                queryset = queryset.filter(category_id__isnull=False)
+            rows = (SalesRollup(**values) for values in queryset.iterator(chunk_size=1000))
+            while batch := list(islice(rows, 1000)):
+                created += len(SalesRollup.objects.bulk_create(batch))
+    return created
+
+
+def get_dashboard(date_from, date_to, top_size=10):
+    """
+    Данные страницы аналитики за период только из SalesRollup: итоги, ряд по дням (по месяцам для периодов
+    длиннее квартала) и самые продаваемые товары и категории по выручке
+    """
+    rollups = SalesRollup.objects.filter(date__range=(date_from, date_to))
+    days = rollups.filter(product__isnull=True, category__isnull=True)
+    totals = {'units': Sum('units'), 'revenue': Sum('revenue'), 'orders': Sum('orders')}
+    by_month = (date_to - date_from).days > 92
+    series = days.annotate(period=TruncMonth('date') if by_month else F('date')).values('period').annotate(
+        **totals).order_by('period')
+    top_products = list(rollups.filter(product__isnull=False).values('product_id').annotate(**totals).order_by(
+        '-revenue', 'product_id')[:top_size])
+    titles = Product.objects.in_bulk([row['product_id'] for row in top_products])
+    for row in top_products:
+        product = titles.get(row['product_id'])
+        row['title'] = product.title if product else f'#{row["product_id"]}'
+    top_categories = list(rollups.filter(category__isnull=False).values('category_id').annotate(**totals).order_by(
+        '-revenue', 'category_id')[:top_size])
+    titles = Category.objects.in_bulk([row['category_id'] for row in top_categories])
+    for row in top_categories:
+        category = titles.get(row['category_id'])
+        row['title'] = category.title if category else f'#{row["category_id"]}'
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'totals': days.aggregate(**totals),
+        'by_month': by_month,
+        'series': list(series),
+        'top_products': top_products,
+        'top_categories': top_categories,
+    }
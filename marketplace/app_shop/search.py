@@ -0,0 +1,131 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Value, IntegerField
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+
+class BaseSearchBackend:
+    """
+    Интерфейс поискового индекса товаров.
+    search() фильтрует queryset и добавляет аннотацию search_rank: чем меньше значение, тем релевантнее товар.
+    """
+
+    def install(self):
+        """Создает структуры индекса в БД, вызывается после migrate"""
+
+    def rebuild(self, chunk_size=1000):
+        """Полностью перестраивает индекс, возвращает количество проиндексированных товаров"""
+        return 0
+
+    def index_products(self, product_ids):
+        """Обновляет записи индекса для переданных товаров"""
+
+    def remove_products(self, product_ids):
+        """Удаляет товары из индекса"""
+
+    def search(self, queryset, text):
+        raise NotImplementedError
+
+    @staticmethod
+    def get_terms(text):
+        return re.findall(r'\w+', text.lower())
+
+    @staticmethod
+    def get_documents(product_ids=None, chunk_size=1000):
+        """Строки индекса: (id, title, full_description, названия тегов через пробел)"""
+        products = Product.objects.only('id', 'title', 'full_description').prefetch_related('tags').order_by('id')
+        if product_ids is not None:
+            products = products.filter(id__in=product_ids)
+        for product in products.iterator(chunk_size=chunk_size):
+            yield product.id, product.title, product.full_description, ' '.join(tag.name for tag in product.tags.all())
+
+
+class ContainsSearchBackend(BaseSearchBackend):
+    """Поиск без индекса через LIKE по названию, используется для БД без поддержки полнотекстового поиска"""
+
+    def search(self, queryset, text):
+        return queryset.filter(title__icontains=text).annotate(search_rank=Value(0, output_field=IntegerField()))
+
+
+class SQLiteFTS5SearchBackend(BaseSearchBackend):
+    """Полнотекстовый индекс на виртуальной таблице SQLite FTS5, ранжирование по bm25"""
+    table = 'app_shop_product_search'
+    # Веса колонок для bm25: title, full_description, tags
+    weights = (10.0, 1.0, 5.0)
+
+    def install(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+                f'USING fts5(title, full_description, tags, tokenize="unicode61 remove_diacritics 2")'
+            )
+
+    def rebuild(self, chunk_size=1000):
+        self.install()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        return self._insert(self.get_documents(chunk_size=chunk_size), chunk_size)
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        self.remove_products(product_ids)
+        self._insert(self.get_documents(product_ids))
+
+    def remove_products(self, product_ids):
+        product_ids = list(product_ids)
+        if not product_ids:
+            return
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', product_ids)
+
+    def search(self, queryset, text):
+        terms = self.get_terms(text)
+        if not terms:
+            return queryset.annotate(search_rank=Value(0, output_field=IntegerField()))
+        # Каждое слово ищется по префиксу, слова объединяются через AND
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return queryset.extra(
+            tables=[self.table],
+            where=[f'{self.table}.rowid = {Product._meta.db_table}.id', f'{self.table} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'bm25({self.table}, {weights})'},
+        )
+
+    def _insert(self, documents, chunk_size=1000):
+        sql = f'INSERT INTO {self.table} (rowid, title, full_description, tags) VALUES (%s, %s, %s, %s)'
+        count = 0
+        batch = []
+        with connection.cursor() as cursor:
+            for document in documents:
+                batch.append(document)
+                if len(batch) >= chunk_size:
+                    cursor.executemany(sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+        return count
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """
+    Бэкенд поиска из settings.PRODUCT_SEARCH_BACKEND (путь к классу).
+    По умолчанию FTS5 для SQLite и поиск через LIKE для остальных БД.
+    """
+    backend_path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', None)
+    if backend_path:
+        return import_string(backend_path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTS5SearchBackend()
+    return ContainsSearchBackend()
@@ -1,7 +1,11 @@
-from django.db.models import Avg
+from collections import defaultdict
+
+from django.db.models.functions import Substr
 from rest_framework import serializers
 
-from .models import Category, Product, Tag, Order, Review
+from marketplace.renditions import image_data
+from .models import Category, Product, ProductImage, Tag, Order, Review
+from .reviews import get_first_page
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -13,21 +17,13 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'image', 'subcategories')
 
     def get_subcategories(self, obj):
-        subcategories = [
-            {
-                'id': subcategory.id,
-                'title': subcategory.title,
-                'image': {
-                    'src': (subcategory.image.url or ''),
-                    'alt': subcategory.title
-                }
-            }
-            for subcategory in obj.subcategories.all()
-        ]
-        return subcategories
+        # Дерево категорий, заранее собранное во view (parent_id -> дочерние категории)
+        children = self.context.get('children')
+        subcategories = children.get(obj.id, []) if children is not None else obj.subcategories.all()
+        return CategorySerializer(subcategories, many=True, context=self.context).data
 
     def get_image(self, obj):
-        return {'src': (obj.image.url or ''), 'alt': obj.title}
+        return image_data(obj.image, obj.title)
 
 
 class ProductSerializer(serializers.ModelSerializer):
@@ -59,15 +55,7 @@ class ProductSerializer(serializers.ModelSerializer):
         }
 
     def get_images(self, obj):
-        images = [
-            {
-                'src': product_image.image.url or '',
-                'alt': product_image.product.title
-            }
-            for product_image in obj.images.all()
-        ]
-
-        return images
+        return [image_data(product_image.image, obj.title) for product_image in obj.images.all()]
 
     def get_tags(self, obj):
         tags = [
@@ -80,14 +68,10 @@ class ProductSerializer(serializers.ModelSerializer):
         return tags
 
     def get_reviews(self, obj):
-        if not obj.reviews:
-            return 0
-        reviews = obj.reviews.count()
-        return reviews
+        return obj.reviews_count()
 
     def get_rating(self, obj):
-        avg_rating = obj.reviews.aggregate(rating=Avg('rate'))
-        return avg_rating['rating']
+        return obj.average_rating()
 
     def get_sale_price(self, obj):
         if not obj.discount:
@@ -95,20 +79,106 @@ class ProductSerializer(serializers.ModelSerializer):
         return round(obj.price - obj.price / 100 * obj.discount, 2)
 
 
+class ProductCardListSerializer(serializers.ListSerializer):
+    """Загружает изображения и теги всех товаров списка двумя запросами без создания моделей"""
+
+    def to_representation(self, data):
+        products = list(data)
+        images, tags = ProductCardSerializer.get_related_maps([product.id for product in products])
+        return [self.child.to_card(product, images[product.id], tags[product.id]) for product in products]
+
+
+class ProductCardSerializer(serializers.BaseSerializer):
+    """
+    Быстрая сериализация карточек товаров для списков, JSON совпадает с ProductSerializer.
+    Queryset нужно подготовить через prepare_queryset: загружаются только нужные колонки,
+    а описание обрезается в SQL, без чтения full_description целиком
+    """
+    fields = ('id', 'category_id', 'price', 'discount', 'quantity', 'date', 'title', 'free_delivery',
+              'review_count', 'rating_sum')
+    date_field = serializers.DateTimeField()
+    image_storage = ProductImage._meta.get_field('image').storage
+
+    class Meta:
+        list_serializer_class = ProductCardListSerializer
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset.prefetch_related(None).only(*cls.fields).annotate(
+            card_description=Substr('full_description', 1, 50))
+
+    @classmethod
+    def get_related_maps(cls, product_ids):
+        return cls.group_related(*cls.get_related_querysets(product_ids))
+
+    @classmethod
+    async def aget_related_maps(cls, product_ids):
+        """Async вариант get_related_maps"""
+        rows = []
+        for queryset in cls.get_related_querysets(product_ids):
+            rows.append([row async for row in queryset])
+        return cls.group_related(*rows)
+
+    @classmethod
+    async def aserialize(cls, products):
+        """Карточки уже загруженных товаров для async views"""
+        images, tags = await cls.aget_related_maps([product.id for product in products])
+        serializer = cls()
+        return [serializer.to_card(product, images[product.id], tags[product.id]) for product in products]
+
+    @staticmethod
+    def get_related_querysets(product_ids):
+        """Строки (id товара, файл) изображений и (id товара, id тега, название) тегов"""
+        return (
+            ProductImage.objects.filter(product_id__in=product_ids).order_by('id').values_list('product_id', 'image'),
+            Tag.product.through.objects.filter(product_id__in=product_ids).order_by('id').values_list(
+                'product_id', 'tag_id', 'tag__name'),
+        )
+
+    @staticmethod
+    def group_related(image_rows, tag_rows):
+        images = defaultdict(list)
+        for product_id, name in image_rows:
+            images[product_id].append(name)
+        tags = defaultdict(list)
+        for product_id, tag_id, tag_name in tag_rows:
+            tags[product_id].append({'id': tag_id, 'name': tag_name})
+        return images, tags
+
+    def to_representation(self, instance):
+        images, tags = self.get_related_maps([instance.id])
+        return self.to_card(instance, images[instance.id], tags[instance.id])
+
+    def to_card(self, product, images, tags):
+        description = getattr(product, 'card_description', None)
+        return {
+            'id': product.id,
+            'category': product.category_id,
+            'price': float(product.price),
+            'salePrice': round(product.price - product.price / 100 * product.discount, 2) if product.discount else None,
+            'count': product.quantity,
+            'date': self.date_field.to_representation(product.date),
+            'title': product.title,
+            'description': description if description is not None else product.short_description(),
+            'freeDelivery': product.free_delivery,
+            'images': [image_data(name, product.title, self.image_storage) for name in images],
+            'tags': tags,
+            'reviews': product.reviews_count(),
+            'rating': product.average_rating(),
+        }
+
+
 class ReviewSerializer(serializers.ModelSerializer):
-    # author = serializers.SerializerMethodField(method_name='get_author', read_only=True)
-    # email = serializers.SerializerMethodField(method_name='get_email', read_only=True)
+    # Профиль автора читается из select_related('author__profile') (app_shop.reviews.get_review_queryset)
+    author = serializers.CharField(source='author.profile.fullName', read_only=True)
+    email = serializers.CharField(source='author.profile.email', read_only=True)
 
     class Meta:
         model = Review
         fields = (
-            # 'author', 'email',
+            'author', 'email',
             'text', 'rate', 'date'
         )
-        # extra_kwargs = {
-        #     'author': {'source': 'author.profile.fullName'},
-        #     'email': {'source': 'author.profile.email'},
-        # }
 
     def get_author(self, obj):
         return obj.author.profile.fullName
@@ -118,6 +188,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     images = serializers.SerializerMethodField(method_name='get_images')
     tags = serializers.SerializerMethodField(method_name='get_tags')
     reviews = serializers.SerializerMethodField(method_name='get_reviews')
+    reviewsSummary = serializers.SerializerMethodField(method_name='get_reviews_summary')
     rating = serializers.SerializerMethodField(method_name='get_rating')
     salePrice = serializers.SerializerMethodField(method_name='get_sale_price')
     fullDescription = serializers.SerializerMethodField(method_name='get_full_description')
@@ -138,6 +209,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
                   'images',
                   'tags',
                   'reviews',
+                  'reviewsSummary',
                   'specifications',
                   'rating')
         extra_kwargs = {
@@ -147,15 +219,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         }
 
     def get_images(self, obj):
-        images = [
-            {
-                'src': product_image.image.url or '',
-                'alt': product_image.product.title
-            }
-            for product_image in obj.images.all()
-        ]
-
-        return images
+        return [image_data(product_image.image, obj.title) for product_image in obj.images.all()]
 
     def get_tags(self, obj):
         tags = [
@@ -167,18 +231,27 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         ]
         return tags
 
+    def get_reviews_page(self, obj):
+        """
+        Первая страница отзывов и курсор следующей (остальные - /api/product/<pk>/reviews).
+        Загружается один раз для reviews и reviewsSummary; async view передает ее в context['reviews_page']
+        """
+        if 'reviews_page' not in self.context:
+            self.context['reviews_page'] = get_first_page(obj.pk)
+        return self.context['reviews_page']
+
     def get_reviews(self, obj):
-        reviews = [
-            {
-                'author': review.author.profile.fullName,
-                'email': review.author.profile.email,
-                'text': review.text,
-                'rate': review.rate,
-                'date': review.date
-            }
-            for review in obj.reviews.all()
-        ]
-        return reviews
+        reviews, _ = self.get_reviews_page(obj)
+        return ReviewSerializer(reviews, many=True).data
+
+    def get_reviews_summary(self, obj):
+        _, next_cursor = self.get_reviews_page(obj)
+        return {
+            'count': obj.reviews_count(),
+            'rating': obj.average_rating(),
+            'histogram': obj.rating_histogram(),
+            'nextCursor': next_cursor,
+        }
 
     def get_sale_price(self, obj):
         if not obj.discount:
@@ -189,8 +262,7 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         return obj.full_description
 
     def get_rating(self, obj):
-        avg_rating = obj.reviews.aggregate(rating=Avg('rate'))
-        return avg_rating['rating']
+        return obj.average_rating()
 
     def get_specifications(self, obj):
         return [{
@@ -205,7 +277,24 @@ class TagsSerializer(serializers.ModelSerializer):
         fields = ('id', 'name',)
 
 
+class OrderListSerializer(serializers.ListSerializer):
+    """Товары всех строк списка заказов загружаются общим набором запросов: товары, изображения и теги"""
+
+    def to_representation(self, data):
+        orders = list(data.all() if hasattr(data, 'all') else data)
+        self.context['order_products'] = OrderSerializer.get_order_products(orders)
+        return super().to_representation(orders)
+
+
 class OrderSerializer(serializers.ModelSerializer):
+    """
+    Строки заказа (Order.items) отдаются в прежнем формате карточек товаров: цена, количество и название
+    берутся из строки, остальные поля - из текущего состояния товара.
+    Queryset должен загружать строки через prefetch_related('items')
+    """
+    # Формат даты карточки, в котором товары сохранялись в Order.products
+    legacy_date_format = '%a %b %d %Y %H:%M:%S GMT%z (%Z)'
+
     createdAt = serializers.SerializerMethodField(method_name='get_createdAt')
     fullName = serializers.SerializerMethodField(method_name='get_fullName')
     email = serializers.SerializerMethodField(method_name='get_email')
@@ -213,13 +302,11 @@ class OrderSerializer(serializers.ModelSerializer):
     deliveryType = serializers.SerializerMethodField(method_name='get_deliveryType')
     paymentType = serializers.SerializerMethodField(method_name='get_paymentType')
     totalCost = serializers.SerializerMethodField(method_name='get_totalCost')
-
-    # products = ProductSerializer(many=True)
-
-
+    products = serializers.SerializerMethodField(method_name='get_products')
 
     class Meta:
         model = Order
+        list_serializer_class = OrderListSerializer
         fields = ('id',
                   'createdAt',
                   'fullName',
@@ -255,4 +342,39 @@ class OrderSerializer(serializers.ModelSerializer):
     def get_totalCost(self, obj):
         return obj.total_cost
 
-
+    def get_products(self, obj):
+        if obj.products is not None:
+            # Заказ еще не перенесен в OrderItem командой convert_order_products
+            return obj.products
+        products = self.context.get('order_products')
+        if products is None:
+            products = self.get_order_products([obj])
+        return [self.to_legacy_card(item, products.get(item.product_id)) for item in obj.items.all()]
+
+    @staticmethod
+    def get_order_products(orders):
+        """{product_id: (товар, изображения, теги)} для строк всех заказов, удаленные товары отсутствуют"""
+        product_ids = {item.product_id for order in orders if order.products is None for item in order.items.all()}
+        if not product_ids:
+            return {}
+        products = ProductCardSerializer.prepare_queryset(Product.objects.filter(id__in=product_ids))
+        images, tags = ProductCardSerializer.get_related_maps(product_ids)
+        return {product.id: (product, images[product.id], tags[product.id]) for product in products}
+
+    def to_legacy_card(self, item, product_data):
+        product, images, tags = product_data or (None, [], [])
+        return {
+            'id': item.product_id,
+            'category': product.category_id if product else None,
+            'price': float(item.price),
+            'count': item.quantity,
+            'date': product.date.strftime(self.legacy_date_format) if product else None,
+            'title': item.title,
+            'description': product.card_description if product else '',
+            'freeDelivery': product.free_delivery if product else None,
+            # Как в Order.products: только src и alt, без производных изображений
+            'images': [{'src': ProductCardSerializer.image_storage.url(name), 'alt': item.title} for name in images],
+            'tags': tags,
+            'reviews': product.reviews_count() if product else 0,
+            'rating': product.average_rating() if product else None,
+        }
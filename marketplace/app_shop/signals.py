@@ -0,0 +1,284 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from app_users.models import Profile
+from marketplace.renditions import generate_field_renditions
+from .cache import bump_version
+from .leaderboards import update_leaderboards
+from .models import Category, Order, OrderItem, Product, ProductImage, Review, Tag, RATING_STARS
+from .sales import SALES_STATUSES, is_counted, record_order
+from .search import get_search_backend
+
+
+def apply_review_rate(product_id, rate: int, sign: int) -> None:
+    """Атомарно добавляет (sign=1) или вычитает (sign=-1) оценку из статистики товара"""
+    if product_id is None:
+        return
+    changes = {
+        'review_count': F('review_count') + sign,
+        'rating_sum': F('rating_sum') + sign * rate,
+    }
+    if rate in RATING_STARS:
+        field = f'rate_{rate}_count'
+        changes[field] = F(field) + sign
+    Product.objects.filter(pk=product_id).update(**changes)
+    update_leaderboards(product_id, boards=['rated'])
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rate(sender, instance, raw, **kwargs):
+    # Запоминаем прежние товар и оценку, чтобы при редактировании отзыва перенести их
+    instance._previous_rate = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_rate = Review.objects.filter(pk=instance.pk).values_list('product_id', 'rate').first()
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rate', None)
+    current = (instance.product_id, instance.rate)
+    if previous == current:
+        return
+    if previous is not None:
+        apply_review_rate(*previous, sign=-1)
+    apply_review_rate(*current, sign=1)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_delete(sender, instance, **kwargs):
+    apply_review_rate(instance.product_id, instance.rate, sign=-1)
+
+
+# Синхронизация поискового индекса товаров
+
+def install_search_index(sender, **kwargs):
+    get_search_backend().install()
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    get_search_backend().index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(m2m_changed, sender=Tag.product.through)
+def index_tagged_products(sender, instance, action, reverse, pk_set, **kwargs):
+    # reverse=True: изменение со стороны product.tags, instance - товар
+    if action == 'pre_clear' and not reverse:
+        instance._cleared_product_ids = list(instance.product.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        get_search_backend().index_products([instance.pk] if reverse else pk_set)
+    elif action == 'post_clear':
+        get_search_backend().index_products([instance.pk] if reverse else instance._cleared_product_ids)
+
+
+@receiver(post_save, sender=Tag.product.through)
+@receiver(post_delete, sender=Tag.product.through)
+def index_product_tag_row(sender, instance, raw=False, **kwargs):
+    # Строки связи сохраняются напрямую через ProductTagsInline в админке, без m2m_changed
+    if raw:
+        return
+    get_search_backend().index_products([instance.product_id])
+
+
+@receiver(post_save, sender=Tag)
+def index_renamed_tag_products(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    get_search_backend().index_products(instance.product.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Tag)
+def remember_tag_products(sender, instance, **kwargs):
+    instance._deleted_product_ids = list(instance.product.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+def index_deleted_tag_products(sender, instance, **kwargs):
+    get_search_backend().index_products(getattr(instance, '_deleted_product_ids', []))
+
+
+# Версии товаров для ETag карточки товара (Product.version)
+
+def bump_product_versions(product_ids):
+    """Увеличивает версии товаров одним UPDATE; product_ids - список id или queryset"""
+    Product.objects.filter(pk__in=product_ids).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Product)
+def bump_saved_product_version(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    # Product.save не записывает version, поэтому увеличение в БД идет от текущего значения строки, а не от копии
+    bump_product_versions([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def bump_reviewed_product_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_rate', None)
+    bump_product_versions({instance.product_id, previous[0] if previous else None} - {None})
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def bump_product_image_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_product_versions([instance.product_id])
+
+
+@receiver(m2m_changed, sender=Tag.product.through)
+def bump_tagged_product_versions(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        bump_product_versions([instance.pk] if reverse else pk_set)
+    elif action == 'post_clear':
+        bump_product_versions([instance.pk] if reverse else instance._cleared_product_ids)
+
+
+@receiver(post_save, sender=Tag.product.through)
+@receiver(post_delete, sender=Tag.product.through)
+def bump_product_tag_row_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_product_versions([instance.product_id])
+
+
+@receiver(post_save, sender=Tag)
+def bump_renamed_tag_product_versions(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    bump_product_versions(instance.product.values('id'))
+
+
+@receiver(post_delete, sender=Tag)
+def bump_deleted_tag_product_versions(sender, instance, **kwargs):
+    bump_product_versions(getattr(instance, '_deleted_product_ids', []))
+
+
+@receiver(post_save, sender=Profile)
+def bump_author_product_versions(sender, instance, raw, **kwargs):
+    # В отзывах карточки товара выводятся имя и email автора из профиля
+    if raw:
+        return
+    bump_product_versions(Review.objects.filter(author_id=instance.user_id).values('product_id'))
+
+
+# Предрасчитанные топы товаров (app_shop.leaderboards)
+
+@receiver(post_save, sender=Product)
+def update_product_leaderboards(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    update_leaderboards(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def refresh_product_leaderboards(sender, instance, **kwargs):
+    update_leaderboards(instance.pk)
+
+
+# Инвалидация кеша витрины (app_shop.cache). Версии увеличиваются после фиксации транзакции: иначе параллельный
+# запрос между увеличением версии и фиксацией прочитал бы старые строки и закешировал их под новой версией.
+# Секция стоит после топов товаров, поэтому ее on_commit выполняется после обновления досок (update_leaderboards)
+
+def bump_version_on_commit(model_name):
+    transaction.on_commit(lambda: bump_version(model_name), robust=True)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_storefront_version(sender, **kwargs):
+    bump_version_on_commit(sender.__name__)
+
+
+@receiver(m2m_changed, sender=Tag.product.through)
+@receiver(post_save, sender=Tag.product.through)
+@receiver(post_delete, sender=Tag.product.through)
+def bump_tags_version(sender, action='post_save', **kwargs):
+    if action.startswith('post'):
+        bump_version_on_commit('Tag')
+
+
+# Производные изображения (marketplace.renditions)
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=Category)
+def generate_image_renditions(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    generate_field_renditions(instance.image)
+
+
+# Статистика продаж (app_shop.sales). Новый заказ учитывается при оформлении, после создания строк
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, raw, **kwargs):
+    instance._previous_status = None
+    if raw or instance.pk is None:
+        return
+    instance._previous_status = Order.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Order)
+def update_sales_on_status_change(sender, instance, created, raw, **kwargs):
+    previous = getattr(instance, '_previous_status', None)
+    if raw or created or previous is None or is_counted(previous) == is_counted(instance.status):
+        return
+    record_order(instance, sign=1 if is_counted(instance.status) else -1)
+
+
+@receiver(pre_delete, sender=Order)
+def remove_deleted_order_sales(sender, instance, **kwargs):
+    if is_counted(instance.status):
+        record_order(instance, sign=-1)
+
+
+def get_counted_order(item, origin=None):
+    """Заказ строки, если он учитывается в продажах и строка изменяется сама, а не удаляется вместе с заказом"""
+    if origin is not None and getattr(origin, 'model', type(origin)) is not OrderItem:
+        return None
+    return Order.objects.filter(pk=item.order_id, status__in=SALES_STATUSES).only('id', 'created_at').first()
+
+
+# Правка строк заказа (например, в админке): вклад заказа вычитается до изменения и добавляется заново после
+
+@receiver(pre_save, sender=OrderItem)
+@receiver(pre_delete, sender=OrderItem)
+def remove_order_sales_before_item_change(sender, instance, raw=False, origin=None, **kwargs):
+    if raw:
+        return
+    order = get_counted_order(instance, origin)
+    if order is not None:
+        record_order(order, sign=-1)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def add_order_sales_after_item_change(sender, instance, raw=False, origin=None, **kwargs):
+    if raw:
+        return
+    order = get_counted_order(instance, origin)
+    if order is not None:
+        record_order(order)
@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models import F
+
+from .cache import bump_version
+from .leaderboards import update_leaderboards
+from .models import Product
+
+
+class OutOfStock(Exception):
+    """Остатка не хватило по части строк; lines - [{'id', 'title', 'requested', 'available'}]"""
+
+    def __init__(self, lines):
+        super().__init__('Not enough stock')
+        self.lines = lines
+
+
+def reserve_stock(lines):
+    """
+    Списывает остатки по строкам [(product_id, quantity)] целиком или никак.
+    Каждая строка списывается условным UPDATE ... SET quantity = quantity - n WHERE quantity >= n:
+    проверка и запись происходят в одном запросе, поэтому параллельные заказы не продают больше остатка,
+    а блокировки строк не держатся во время работы кода Python.
+    При нехватке хотя бы по одной строке поднимается OutOfStock, и транзакция откатывает все списания
+    """
+    # Строки обновляются в порядке id, чтобы параллельные заказы блокировали их в одном порядке
+    lines = sorted((product_id, quantity) for product_id, quantity in lines if quantity > 0)
+    with transaction.atomic():
+        failed = {}
+        for product_id, quantity in lines:
+            updated = Product.objects.filter(id=product_id, quantity__gte=quantity).update(
+                quantity=F('quantity') - quantity, version=F('version') + 1)
+            if not updated:
+                failed[product_id] = quantity
+
+        if failed:
+            # Товар мог быть удален после добавления в корзину, тогда его остаток считается нулевым
+            stock = {product_id: (title, available) for product_id, title, available in
+                     Product.objects.filter(id__in=failed).values_list('id', 'title', 'quantity')}
+            shortages = []
+            for product_id, quantity in failed.items():
+                title, available = stock.get(product_id, ('', 0))
+                shortages.append({'id': product_id, 'title': title, 'requested': quantity, 'available': available})
+            raise OutOfStock(shortages)
+
+        # update() не вызывает сигналы, поэтому топ заканчивающихся товаров и кеш витрины обновляются здесь,
+        # версия - после досок, как в app_shop.signals
+        for product_id, _ in lines:
+            update_leaderboards(product_id, boards=['limited'])
+        transaction.on_commit(lambda: bump_version('Product'), robust=True)
@@ -1 +1,1573 @@
-# Create your tests here.
+import asyncio
+import base64
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.http import Http404, HttpResponse
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.utils.encoders import JSONEncoder
+
+from app_users.models import Profile, User
+from marketplace.admin import EstimatedCountPaginator
+from marketplace.middleware import ReplicaRoutingMiddleware, SQLInstrumentationMiddleware
+from marketplace.renditions import get_rendition_name
+from marketplace.routers import PrimaryReplicaRouter, routing_context
+from marketplace.staticfiles import serve_static
+from .models import Category, CategoryClosure, ImportCheckpoint, LeaderboardEntry, Order, OrderItem, Product, \
+    ProductImage, Review, SalesRollup, Tag, RATING_STARS, rating_expression
+from .async_views import ASYNC_VIEWS
+from .cache import get_stats, get_versions
+from .catalog import SORT_FIELDS, filter_by_tags, get_ordering, is_explicit_sort, parse_tags
+from .facets import compute_facets, get_filter_signature, get_price_buckets
+from .leaderboards import LEADERBOARDS
+from .pagination import ReviewPagination
+from .product_io import FORMATS, ProductImporter, parse_list, read_rows
+from .reviews import get_review_queryset
+from .sales import rebuild_sales
+from .search import get_search_backend
+from .serializers import ProductCardSerializer, ProductSerializer
+from .urls import read_view
+from .views import CatalogAPIView, ProductListMixin, SaleProductsView
+from .stock import OutOfStock, reserve_stock
+
+
+class StockReservationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='category')
+        cls.first = Product.objects.create(category=category, price=10, quantity=5, title='first')
+        cls.second = Product.objects.create(category=category, price=20, quantity=1, title='second')
+        cls.user = User.objects.create_user(username='buyer', password='password', name='buyer')
+
+    def test_reserves_all_lines(self):
+        reserve_stock([(self.first.id, 2), (self.second.id, 1)])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.quantity, self.second.quantity), (3, 0))
+
+    def test_shortage_rolls_back_every_line(self):
+        with self.assertRaises(OutOfStock) as context:
+            reserve_stock([(self.first.id, 2), (self.second.id, 3)])
+        self.assertEqual(context.exception.lines,
+                         [{'id': self.second.id, 'title': 'second', 'requested': 3, 'available': 1}])
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.quantity, 5)
+
+    def test_checkout_reports_out_of_stock_lines(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('basket'), {'id': self.first.id, 'count': 1})
+        self.client.post(reverse('basket'), {'id': self.second.id, 'count': 2})
+
+        response = self.client.post(reverse('orders-list'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['items'],
+                         [{'id': self.second.id, 'title': 'second', 'requested': 2, 'available': 1}])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(len(self.client.get(reverse('basket')).json()), 2)
+
+        self.client.delete(reverse('basket'), {'id': self.second.id, 'count': 1}, content_type='application/json')
+        response = self.client.post(reverse('orders-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.get().items.count(), 2)
+        self.assertEqual(list(Product.objects.order_by('id').values_list('quantity', flat=True)), [4, 0])
+
+    def test_reservation_is_one_conditional_update_per_line(self):
+        # Проверка остатка и списание в одном UPDATE: между ними не может вклиниться другой заказ
+        with CaptureQueriesContext(connection) as context:
+            reserve_stock([(self.second.id, 1), (self.first.id, 2)])
+        updates = [query['sql'] for query in context.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 2)
+        for sql in updates:
+            self.assertRegex(sql, r'SET "quantity" = \("app_shop_product"\."quantity" - \d+\).*"quantity" >= \d+\)$')
+        # Строки обновляются в порядке id
+        self.assertIn(f'"id" = {self.first.id} ', updates[0])
+
+    def test_checkout_rejects_invalid_quantity(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('basket'), {'id': self.first.id, 'count': 1})
+        self.client.post(reverse('basket'), {'id': self.second.id, 'count': -2})
+
+        response = self.client.post(reverse('orders-list'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['items'], [{'id': self.second.id, 'requested': -2}])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.first.pk).quantity, 5)
+
+    def test_checkout_reports_deleted_products(self):
+        product = Product.objects.create(category=self.first.category, price=30, quantity=3, title='deleted')
+        self.client.force_login(self.user)
+        self.client.post(reverse('basket'), {'id': self.first.id, 'count': 1})
+        self.client.post(reverse('basket'), {'id': product.id, 'count': 1})
+        product_id = product.id
+        product.delete()
+
+        response = self.client.post(reverse('orders-list'))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['items'],
+                         [{'id': product_id, 'title': '', 'requested': 1, 'available': 0}])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(pk=self.first.pk).quantity, 5)
+
+
+class ImageRenditionsTestCase(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.product = Product.objects.create(category=Category.objects.create(title='category'), price=10,
+                                              quantity=1, title='product')
+
+    def make_image(self, size=(1000, 500)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (200, 80, 40)).save(buffer, 'JPEG')
+        return ContentFile(buffer.getvalue(), name='photo.jpg')
+
+    def test_renditions_are_generated_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product_image = ProductImage.objects.create(product=self.product, image=self.make_image())
+        name = product_image.image.name
+        for width, extension in ((200, 'webp'), (800, 'webp'), (400, 'jpg')):
+            with default_storage.open(get_rendition_name(name, width, extension)) as rendition:
+                image = Image.open(rendition)
+                self.assertEqual(image.size, (width, width // 2))
+                self.assertEqual(image.format, 'WEBP' if extension == 'webp' else 'JPEG')
+
+    def test_missing_rendition_is_generated_on_first_request(self):
+        name = default_storage.save('products/product_1/images/photo.jpg', self.make_image((300, 300)))
+        rendition = get_rendition_name(name, 800, 'webp')
+
+        response = self.client.get(f'/media/{rendition}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        # Изображение не увеличивается
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (300, 300))
+        self.assertTrue(default_storage.exists(rendition))
+
+        self.assertEqual(self.client.get(f'/media/{get_rendition_name(name, 123, "webp")}').status_code, 404)
+        self.assertEqual(self.client.get(f'/media/{get_rendition_name("missing.jpg", 200, "webp")}').status_code, 404)
+
+    def test_serializers_expose_srcset(self):
+        ProductImage.objects.create(product=self.product, image='products/product_1/images/photo.jpg')
+        products = Product.objects.prefetch_related('images')
+        data = ProductSerializer(products, many=True).data
+        self.assertEqual(data[0]['images'][0]['srcset'], ', '.join(
+            f'/media/products/product_1/images/renditions/photo.jpg.{width}w.webp {width}w'
+            for width in (200, 400, 800)))
+        cards = ProductCardSerializer(ProductCardSerializer.prepare_queryset(Product.objects.all()), many=True).data
+        self.assertEqual(cards[0]['images'], data[0]['images'])
+
+
+class ProductCardSerializerTestCase(TestCase):
+    query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+             'filter[available]': '', 'sort': 'id', 'sortType': 'inc', 'limit': 20}
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='phones')
+        tags = [Tag.objects.create(name=f'tag {index}') for index in range(3)]
+        user = User.objects.create_user(username='author', password='password', name='author')
+        for index in range(12):
+            product = Product.objects.create(
+                category=category, price=Decimal('99.99') + index, quantity=index, title=f'phone {index}',
+                discount=index % 3 * 10, free_delivery=bool(index % 2),
+                full_description=f'Описание телефона {index} ' * 5 if index % 4 else 'short')
+            for number in range(index % 3):
+                ProductImage.objects.create(product=product, image=f'products/product_{product.id}/images/{number}.jpg')
+            product.tags.set(tags[:index % 4])
+            for rate in range(1, index % 5 + 1):
+                Review.objects.create(product=product, author=user, rate=rate)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_card_matches_full_serializer(self):
+        full = ProductSerializer(Product.objects.prefetch_related('images', 'tags').order_by('id'), many=True).data
+        cards = ProductCardSerializer(ProductCardSerializer.prepare_queryset(Product.objects.order_by('id')),
+                                      many=True).data
+        self.assertEqual(json.loads(json.dumps(cards, cls=JSONEncoder)), json.loads(json.dumps(full, cls=JSONEncoder)))
+        # Одиночная карточка (без ListSerializer) совпадает с карточкой из списка
+        product = ProductCardSerializer.prepare_queryset(Product.objects.filter(pk=full[5]['id'])).get()
+        self.assertEqual(ProductCardSerializer(product).data, cards[5])
+
+    def test_list_page_queries(self):
+        url = reverse('catalog-list')
+        with mock.patch.object(ProductListMixin, 'fast_serializer', False):
+            full = self.client.get(url, self.query).json()
+        cache.clear()
+        # Количество товаров, товары страницы, изображения и теги
+        with self.assertNumQueries(4):
+            fast = self.client.get(url, self.query).json()
+        self.assertEqual(fast, full)
+        self.assertEqual(len(fast['items']), 12)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.product = Product.objects.create(category=Category.objects.create(title='category'), price=10,
+                                              quantity=1, title='product')
+        self.user = User.objects.create_user(username='author', password='password', name='author')
+        self.profile = Profile.objects.create(user=self.user, fullName='author')
+
+    def assertRevalidates(self, url, change):
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(etag, r'^"[0-9a-f]{32}"$')
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+        # Версии кеша витрины увеличиваются после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response
+
+    def test_product_etag_does_not_serialize(self):
+        url = reverse('product-detail', args=[self.product.id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f'"other", {etag}').status_code, 304)
+        self.assertEqual(self.client.get(reverse('product-detail', args=[0]), HTTP_IF_NONE_MATCH='*').status_code,
+                         404)
+
+    def test_product_etag_changes_on_related_writes(self):
+        url = reverse('product-detail', args=[self.product.id])
+        tag = Tag.objects.create(name='tag')
+        changes = [
+            lambda: Product.objects.filter(pk=self.product.pk).get().save(),
+            lambda: Review.objects.create(product=self.product, author=self.user, rate=5, text='review'),
+            lambda: ProductImage.objects.create(product=self.product, image='products/photo.jpg'),
+            lambda: tag.product.add(self.product),
+            lambda: rename_tag(tag, 'renamed'),
+            lambda: self.profile.save(),
+            lambda: reserve_stock([(self.product.id, 1)]),
+        ]
+        for index, change in enumerate(changes):
+            with self.subTest(index):
+                self.assertRevalidates(url, change)
+        self.assertEqual(self.client.get(url).json()['tags'], [{'id': tag.id, 'name': 'renamed'}])
+
+    def test_stale_product_save_changes_etag(self):
+        url = reverse('product-detail', args=[self.product.id])
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, author=self.user, rate=5)
+        version = Product.objects.get(pk=self.product.pk).version
+
+        def change():
+            stale.price = 20
+            stale.save()
+
+        response = self.assertRevalidates(url, change)
+        self.assertEqual(response.json()['price'], 20)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).version, version + 1)
+
+    def test_list_etag_follows_catalog_version(self):
+        self.assertRevalidates(reverse('popular-products'),
+                               lambda: Review.objects.create(product=self.product, author=self.user, rate=4))
+        response = self.assertRevalidates(reverse('tags-list'), lambda: Tag.objects.create(name='new'))
+        self.assertEqual(response['Vary'], 'Accept, Cookie')
+
+        query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+                 'filter[available]': '', 'category': '', 'sort': 'price', 'sortType': 'inc', 'currentPage': 1}
+        etag = self.client.get(reverse('catalog-list'), query)['ETag']
+        self.assertNotEqual(self.client.get(reverse('catalog-list'), {**query, 'currentPage': 2})['ETag'], etag)
+        self.assertEqual(self.client.get(reverse('catalog-list'), query, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image='products/photo.jpg')
+        self.assertEqual(self.client.get(reverse('catalog-list'), query, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class StorefrontCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        category = Category.objects.create(title='phones')
+        self.products = [Product.objects.create(category=category, price=price, quantity=price // 100,
+                                                title=f'phone {price}') for price in (100, 200, 300)]
+        self.user = User.objects.create_user(username='author', password='password', name='author')
+        for leaderboard in LEADERBOARDS.values():
+            leaderboard.rebuild()
+
+    def get_titles(self, name):
+        response = self.client.get(reverse(name))
+        return response['X-Cache'], [item['title'] for item in response.json()]
+
+    def test_write_invalidates_cached_lists_after_commit(self):
+        self.assertEqual(self.get_titles('limited-products'), ('MISS', ['phone 100', 'phone 200', 'phone 300']))
+        self.assertEqual(self.get_titles('limited-products')[0], 'HIT')
+
+        product = self.products[0]
+        product.title = 'renamed'
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.save()
+        # До фиксации версия прежняя: ответ из кеша не заменяется строками незафиксированной транзакции
+        self.assertEqual(self.get_titles('limited-products')[0], 'HIT')
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get_titles('limited-products'), ('MISS', ['renamed', 'phone 200', 'phone 300']))
+
+    def test_version_is_bumped_after_leaderboard_update(self):
+        self.client.get(reverse('popular-products'))
+        versions = get_versions(['Review'])
+        with self.captureOnCommitCallbacks() as callbacks:
+            Review.objects.create(product=self.products[2], author=self.user, rate=5)
+        for callback in callbacks:
+            callback()
+            if get_versions(['Review']) != versions:
+                # Когда версия меняется, доска уже обновлена и новый ответ кешируется с новым топом
+                self.assertEqual(LEADERBOARDS['rated'].queryset().first(), self.products[2])
+                break
+        else:
+            self.fail('Review version was not bumped')
+        self.assertEqual(self.get_titles('popular-products'), ('MISS', ['phone 300', 'phone 100', 'phone 200']))
+
+    def test_stats_count_hits_and_misses(self):
+        before = get_stats()['tags']
+        for _ in range(3):
+            self.client.get(reverse('tags-list'))
+        self.assertEqual(get_stats()['tags'], {'hits': before['hits'] + 2, 'misses': before['misses'] + 1})
+
+    def test_stats_view_is_admin_only(self):
+        url = reverse('cache-stats')
+        self.assertIn(self.client.get(url).status_code, (401, 403))
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'categories', 'popular', 'limited', 'sales', 'banners', 'tags'})
+
+
+class ProductSearchTestCase(TestCase):
+    query = {'filter[name]': 'phone', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+             'filter[available]': '', 'category': '', 'limit': 10}
+
+    def setUp(self):
+        category = Category.objects.create(title='phones')
+        self.cheap = Product.objects.create(category=category, price=10, quantity=1, title='case',
+                                            full_description='fits any phone')
+        self.phone = Product.objects.create(category=category, price=500, quantity=1, title='smart phone')
+        self.other = Product.objects.create(category=category, price=50, quantity=1, title='charger')
+
+    def search(self, text):
+        return list(get_search_backend().search(Product.objects.all(), text).order_by('id').values_list('id',
+                                                                                                          flat=True))
+
+    def get_ids(self, **params):
+        return [item['id'] for item in self.client.get(reverse('catalog-list'), {**self.query, **params}).json()['items']]
+
+    def test_search_orders_by_relevance_unless_sort_is_chosen(self):
+        # Совпадение в названии весит больше, чем в описании
+        self.assertEqual(self.get_ids(), [self.phone.id, self.cheap.id])
+        self.assertEqual(self.get_ids(sort='price', sortType='inc'), [self.phone.id, self.cheap.id])
+        self.assertEqual(self.get_ids(sort='price', sortType='dec'), [self.phone.id, self.cheap.id])
+        self.assertEqual(self.get_ids(sort='date', sortType='inc'), [self.cheap.id, self.phone.id])
+        self.assertFalse(is_explicit_sort({'sort': 'title'}))
+
+    def test_cursor_is_rejected_for_search(self):
+        # В режиме страниц поиск упорядочен по релевантности, курсор не может этот порядок продолжить
+        self.assertEqual(self.get_ids(page=1), [self.phone.id, self.cheap.id])
+        response = self.client.get(reverse('catalog-list'), {**self.query, 'cursor': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+        # Пустой filter[name] фронтенд передает всегда, он курсору не мешает
+        response = self.client.get(reverse('catalog-list'), {**self.query, 'filter[name]': '', 'cursor': ''})
+        self.assertEqual([item['id'] for item in response.json()['items']], [self.cheap.id, self.phone.id, self.other.id])
+
+    def test_index_follows_product_and_tag_changes(self):
+        self.phone.title = 'tablet'
+        self.phone.save()
+        self.assertEqual(self.search('smart'), [])
+        self.assertEqual(self.search('tablet'), [self.phone.id])
+
+        tag = Tag.objects.create(name='wireless')
+        tag.product.add(self.other)
+        self.assertEqual(self.search('wireless'), [self.other.id])
+        self.phone.tags.add(tag)
+        self.assertEqual(self.search('wireless'), [self.phone.id, self.other.id])
+        tag.product.remove(self.other)
+        self.assertEqual(self.search('wireless'), [self.phone.id])
+        tag.product.clear()
+        self.assertEqual(self.search('wireless'), [])
+
+        tag.product.through.objects.create(tag=tag, product=self.other)
+        self.assertEqual(self.search('wireless'), [self.other.id])
+        rename_tag(tag, 'magnetic')
+        self.assertEqual(self.search('wireless'), [])
+        self.assertEqual(self.search('magnetic'), [self.other.id])
+        tag.delete()
+        self.assertEqual(self.search('magnetic'), [])
+
+        self.other.delete()
+        self.assertEqual(self.search('charger'), [])
+
+    def test_rebuild_command_restores_index(self):
+        backend = get_search_backend()
+        backend.remove_products([self.cheap.id, self.phone.id])
+        self.assertEqual(self.search('phone'), [])
+        output = io.StringIO()
+        call_command('rebuild_search_index', stdout=output)
+        self.assertIn('indexed 3 products', output.getvalue())
+        self.assertEqual(self.search('phone'), [self.cheap.id, self.phone.id])
+
+
+class LeaderboardsTestCase(TestCase):
+    def setUp(self):
+        # Маленькие доски, чтобы изменения вытесняли записи и опускали доску ниже min_size
+        boards = {board.name: type(board)(size=3, min_size=2) for board in LEADERBOARDS.values()}
+        patcher = mock.patch.dict(LEADERBOARDS, boards)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        category = Category.objects.create(title='phones')
+        self.products = [Product.objects.create(category=category, price=100, quantity=10 + index,
+                                                title=f'phone {index}') for index in range(6)]
+        self.users = [User.objects.create_user(username=f'author{index}', password='password', name=f'author{index}')
+                      for index in range(3)]
+        for board in LEADERBOARDS.values():
+            board.rebuild()
+
+    def assertBoardsMatchRanking(self):
+        total = Product.objects.count()
+        for name, board in LEADERBOARDS.items():
+            with self.subTest(board=name):
+                entries = list(board.queryset())
+                self.assertGreaterEqual(len(entries), min(board.min_size, total))
+                self.assertEqual(entries, list(board.get_ranked_products()[:len(entries)]))
+
+    def change(self, action):
+        with self.captureOnCommitCallbacks(execute=True):
+            action()
+        self.assertBoardsMatchRanking()
+
+    def test_boards_follow_reviews(self):
+        phone = self.products
+        reviews = []
+        for index, (product, rate) in enumerate(((phone[4], 5), (phone[2], 3), (phone[5], 4), (phone[0], 5))):
+            self.change(lambda: reviews.append(Review.objects.create(product=product, author=self.users[index % 3],
+                                                                     rate=rate)))
+        self.assertEqual(list(LEADERBOARDS['rated'].queryset()), [phone[0], phone[4], phone[5]])
+
+        def edit(review, **fields):
+            for name, value in fields.items():
+                setattr(review, name, value)
+            review.save()
+
+        self.change(lambda: edit(reviews[0], rate=1))
+        self.change(lambda: edit(reviews[1], rate=5))
+        # Перенос отзыва на другой товар
+        self.change(lambda: edit(reviews[2], product=phone[1]))
+        self.change(lambda: reviews[3].delete())
+        self.assertEqual(list(LEADERBOARDS['rated'].queryset()), [phone[2], phone[1], phone[4]])
+
+    def test_boards_follow_stock_and_deletes(self):
+        phone = self.products
+        self.change(lambda: reserve_stock([(phone[5].id, 15)]))
+        self.assertEqual(LEADERBOARDS['limited'].queryset().first(), phone[5])
+
+        def restock(product, quantity):
+            product.refresh_from_db()
+            product.quantity = quantity
+            product.save()
+
+        self.change(lambda: restock(phone[5], 100))
+        self.change(lambda: restock(phone[3], 0))
+        self.change(lambda: Review.objects.create(product=phone[1], author=self.users[0], rate=4))
+        for product in (phone[3], phone[0], phone[1], phone[2]):
+            # Каскадное удаление вместе с отзывами; доска пересчитывается, когда в ней меньше min_size записей
+            self.change(product.delete)
+        self.assertEqual(list(LEADERBOARDS['limited'].queryset()), [phone[4], phone[5]])
+
+    def test_rebuild_removes_unknown_boards(self):
+        LeaderboardEntry.objects.create(board='newest', product=self.products[0], score=1, tiebreak=0)
+        out = io.StringIO()
+        call_command('rebuild_leaderboards', stdout=out)
+        self.assertIn('Removed 1 entries of unknown boards', out.getvalue())
+        self.assertEqual(set(LeaderboardEntry.objects.values_list('board', flat=True)), set(LEADERBOARDS))
+
+    def test_views_match_previous_queries(self):
+        phone = self.products
+        for product, rates in ((phone[1], (5, 4)), (phone[3], (2,)), (phone[4], (5, 5, 5)), (phone[0], (3, 3))):
+            for user, rate in zip(self.users, rates):
+                self.change(lambda: Review.objects.create(product=product, author=user, rate=rate))
+        LEADERBOARDS['rated'].size = 5
+        LEADERBOARDS['rated'].rebuild()
+
+        def ids(name):
+            return [item['id'] for item in self.client.get(reverse(name)).json()]
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.assertEqual(ids('popular-products'), [product.id for product in Product.objects.annotate(
+            rating=rating_expression()).order_by(F('rating').desc(nulls_last=True))[:5]])
+        self.assertEqual(ids('limited-products'), [product.id for product in Product.objects.order_by('quantity')[:3]])
+        banners = self.client.get(reverse('banners-products'), {'limit': 5}).json()['items']
+        self.assertEqual([item['id'] for item in banners],
+                         [product.id for product in Product.objects.order_by('id')[:5]])
+
+
+class CatalogPaginationTestCase(TestCase):
+    query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+             'filter[available]': '', 'category': '', 'sort': 'price', 'sortType': 'inc', 'limit': 2}
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.category = Category.objects.create(title='phones')
+        # Одинаковые цены: порядок внутри них определяет id
+        self.products = [Product.objects.create(category=self.category, price=price, quantity=1, title=f'phone {index}')
+                         for index, price in enumerate((300, 100, 200, 100, 100))]
+
+    def get(self, **params):
+        return self.client.get(reverse('catalog-list'), {**self.query, **params})
+
+    def expected_ids(self, *ordering):
+        return list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+
+    def walk(self, **params):
+        pages, cursor = [], ''
+        while cursor is not None:
+            data = self.get(cursor=cursor, **params).json()
+            pages.append(data)
+            cursor = data['nextCursor']
+        return pages
+
+    def test_keyset_pages_forward_and_backward(self):
+        for sort_type, ordering in (('inc', ('price', 'id')), ('dec', ('-price', '-id'))):
+            with self.subTest(sort_type=sort_type):
+                pages = self.walk(sortType=sort_type)
+                ids = self.expected_ids(*ordering)
+                self.assertEqual([[item['id'] for item in page['items']] for page in pages],
+                                 [ids[index:index + 2] for index in range(0, 5, 2)])
+                self.assertIsNone(pages[0]['prevCursor'])
+                # Назад от последней страницы - те же страницы в обратном порядке
+                cursor = pages[-1]['prevCursor']
+                for page in reversed(pages[:-1]):
+                    data = self.get(cursor=cursor, sortType=sort_type).json()
+                    self.assertEqual(data['items'], page['items'])
+                    cursor = data['prevCursor']
+                self.assertIsNone(cursor)
+
+    def test_ties_on_sort_key_are_not_skipped_or_repeated(self):
+        pages = self.walk(limit=1)
+        self.assertEqual([page['items'][0]['id'] for page in pages], self.expected_ids('price', 'id'))
+
+    def test_invalid_cursor_returns_404(self):
+        cursor = self.walk()[0]['nextCursor']
+        payload = json.loads(base64.urlsafe_b64decode(cursor))
+        other_sort = base64.urlsafe_b64encode(json.dumps({**payload, 'k': ['date', 'id']}).encode()).decode()
+        for value in ('broken', cursor[:-4], other_sort):
+            with self.subTest(cursor=value):
+                self.assertEqual(self.get(cursor=value).status_code, 404)
+        self.assertEqual(self.get(cursor=cursor, sort='date').status_code, 404)
+
+    def test_cached_count_does_not_truncate_last_page(self):
+        data = self.get(page=3).json()
+        self.assertEqual((len(data['items']), data['lastPage']), (1, 3))
+        Product.objects.create(category=self.category, price=400, quantity=1, title='phone 5')
+        # Количество страниц берется из кеша, но последняя страница не обрезается по устаревшему количеству
+        data = self.get(page=3).json()
+        self.assertEqual(data['lastPage'], 3)
+        self.assertEqual([item['id'] for item in data['items']], self.expected_ids('price', 'id')[4:6])
+
+
+class CategoryTreeTestCase(TestCase):
+    query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+             'filter[available]': '', 'sort': 'id', 'sortType': 'inc', 'limit': 20}
+
+    def setUp(self):
+        self.electronics = Category.objects.create(title='electronics')
+        self.phones = Category.objects.create(title='phones', parent=self.electronics)
+        self.smartphones = Category.objects.create(title='smartphones', parent=self.phones)
+        self.books = Category.objects.create(title='books')
+        self.products = {category: Product.objects.create(category=category, price=100, quantity=1,
+                                                          title=f'{category.title} item')
+                         for category in (self.electronics, self.phones, self.smartphones, self.books)}
+
+    def get_catalog(self, category):
+        items = self.client.get(reverse('catalog-list'), {**self.query, 'category': category.id}).json()['items']
+        return {item['id'] for item in items}
+
+    def ids(self, *categories):
+        return {self.products[category].id for category in categories}
+
+    def closure(self):
+        return set(CategoryClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth'))
+
+    def test_catalog_filter_includes_descendants_after_move(self):
+        self.assertEqual(self.get_catalog(self.electronics), self.ids(self.electronics, self.phones, self.smartphones))
+        self.assertEqual(self.get_catalog(self.phones), self.ids(self.phones, self.smartphones))
+
+        self.phones.parent = self.books
+        self.phones.save()
+        self.assertEqual(self.get_catalog(self.electronics), self.ids(self.electronics))
+        self.assertEqual(self.get_catalog(self.books), self.ids(self.books, self.phones, self.smartphones))
+        self.assertIn((self.books.id, self.smartphones.id, 2), self.closure())
+
+        self.phones.parent = None
+        self.phones.save()
+        self.assertEqual(self.get_catalog(self.books), self.ids(self.books))
+        self.assertEqual(self.smartphones.get_root_id(), self.phones.id)
+
+    def test_move_into_own_subtree_is_rejected(self):
+        closure = self.closure()
+        self.electronics.parent = self.smartphones
+        with self.assertRaises(ValidationError):
+            self.electronics.full_clean()
+        with self.assertRaises(ValueError):
+            self.electronics.save()
+        self.assertIsNone(Category.objects.get(pk=self.electronics.pk).parent_id)
+        self.assertEqual(self.closure(), closure)
+
+    def test_rebuild_matches_incremental_table(self):
+        self.phones.parent = self.books
+        self.phones.save()
+        Category.objects.create(title='e-readers', parent=self.smartphones)
+        closure = self.closure()
+        CategoryClosure.objects.filter(depth__gt=0).delete()
+        call_command('rebuild_category_tree', stdout=io.StringIO())
+        self.assertEqual(self.closure(), closure)
+
+
+class ProductRatingCountersTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='phones')
+        self.product = Product.objects.create(category=category, price=100, quantity=1, title='phone')
+        self.other = Product.objects.create(category=category, price=200, quantity=1, title='other phone')
+        self.user = User.objects.create_user(username='author', password='password', name='author')
+
+    def assertCounters(self, product, *rates):
+        product.refresh_from_db()
+        self.assertEqual(product.review_count, len(rates))
+        self.assertEqual(product.rating_sum, sum(rates))
+        self.assertEqual(product.rating_histogram(), {rate: rates.count(rate) for rate in RATING_STARS})
+
+    def test_counters_follow_review_changes(self):
+        first = Review.objects.create(product=self.product, author=self.user, rate=5)
+        second = Review.objects.create(product=self.product, author=self.user, rate=3)
+        self.assertCounters(self.product, 5, 3)
+        self.assertEqual(self.product.average_rating(), 4)
+
+        second.rate = 1
+        second.save()
+        self.assertCounters(self.product, 5, 1)
+
+        # Перенос отзыва на другой товар вычитает прежнюю оценку у старого товара
+        first.product = self.other
+        first.rate = 4
+        first.save()
+        self.assertCounters(self.product, 1)
+        self.assertCounters(self.other, 4)
+
+        # Повторное сохранение без изменений не меняет счетчики
+        first.save()
+        self.assertCounters(self.other, 4)
+
+        second.delete()
+        self.assertCounters(self.product)
+        self.assertIsNone(self.product.average_rating())
+
+    def test_stale_product_save_keeps_counters(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, author=self.user, rate=5)
+        stale.price = 150
+        stale.save()
+        self.assertCounters(self.product, 5)
+        self.assertEqual(self.product.price, 150)
+        # Явный update_fields со счетчиками их тоже не трогает
+        stale.save(update_fields=['title', 'review_count'])
+        self.assertCounters(self.product, 5)
+
+    def test_rebuild_recomputes_drifted_counters(self):
+        Review.objects.create(product=self.product, author=self.user, rate=5)
+        Review.objects.create(product=self.product, author=self.user, rate=2)
+        Review.objects.create(product=self.other, author=self.user, rate=4)
+        Product.objects.filter(pk=self.product.pk).update(review_count=7, rating_sum=1, rate_5_count=0, rate_1_count=3)
+        # Отзыв, измененный в обход сигналов
+        Review.objects.filter(product=self.other).update(rate=3)
+        version = Product.objects.get(pk=self.product.pk).version
+
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_product_ratings', stdout=out)
+        self.assertIn('Updated 2 products', out.getvalue())
+        self.assertCounters(self.product, 5, 2)
+        self.assertCounters(self.other, 3)
+        self.assertEqual(self.product.version, version + 1)
+
+        out = io.StringIO()
+        call_command('rebuild_product_ratings', stdout=out)
+        self.assertIn('Updated 0 products', out.getvalue())
+
+
+class ConvertOrderProductsTestCase(TestCase):
+    def setUp(self):
+        category = Category.objects.create(title='phones')
+        self.phone = Product.objects.create(category=category, price=Decimal('99.90'), quantity=5, title='phone',
+                                            full_description='phone ' * 20, free_delivery=True)
+        self.case = Product.objects.create(category=category, price=10, quantity=5, title='case')
+        ProductImage.objects.create(product=self.phone, image='products/product_1/images/front.jpg')
+        self.phone.tags.add(Tag.objects.create(name='android'))
+        self.user = User.objects.create_user(username='buyer', password='password', name='buyer')
+        Profile.objects.create(user=self.user, fullName='Buyer', email='buyer@example.com')
+        Review.objects.create(product=self.phone, author=self.user, rate=4)
+        self.client.force_login(self.user)
+
+    def legacy_card(self, product, price, count):
+        """Карточка товара в том виде, в котором ее сохранял старый POST /api/orders"""
+        product.refresh_from_db()
+        return {
+            'id': product.id,
+            'category': product.category.id,
+            'price': float(price),
+            'count': count,
+            'date': product.date.strftime('%a %b %d %Y %H:%M:%S GMT%z (%Z)'),
+            'title': product.title,
+            'description': product.short_description(),
+            'freeDelivery': product.free_delivery,
+            'images': [{'src': image.image.url, 'alt': product.title} for image in product.images.all()],
+            'tags': [{'id': tag.id, 'name': tag.name} for tag in product.tags.all()],
+            'reviews': product.reviews_count(),
+            'rating': product.average_rating(),
+        }
+
+    def test_api_output_is_unchanged_by_conversion(self):
+        order = Order.objects.create(user=self.user, total_cost=Decimal('219.80'), city='Moscow', address='street', products=[
+            self.legacy_card(self.phone, '99.90', 2),
+            self.legacy_card(self.case, '20', 1),
+        ])
+        # Строка без id товара пропускается
+        broken = Order.objects.create(user=self.user, total_cost=10, products=[{'title': 'broken'}])
+        before = (self.client.get(reverse('orders-list')).json(),
+                  self.client.get(reverse('order-detail', args=[order.id])).json())
+
+        out = io.StringIO()
+        call_command('convert_order_products', stdout=out)
+        self.assertIn('Converted 2 orders into 2 order items', out.getvalue())
+        self.assertIn('Skipped 1 malformed order lines', out.getvalue())
+        order.refresh_from_db()
+        self.assertIsNone(order.products)
+        self.assertEqual(list(order.items.values_list('product_id', 'price', 'quantity')),
+                         [(self.phone.id, Decimal('99.90'), 2), (self.case.id, Decimal('20.00'), 1)])
+
+        after = (self.client.get(reverse('orders-list')).json(),
+                 self.client.get(reverse('order-detail', args=[order.id])).json())
+        self.assertEqual(after[1], before[1])
+        self.assertEqual([item for item in after[0] if item['id'] != broken.id],
+                         [item for item in before[0] if item['id'] != broken.id])
+
+        # Повторный запуск не находит непереносенных заказов
+        out = io.StringIO()
+        call_command('convert_order_products', stdout=out)
+        self.assertIn('Converted 0 orders', out.getvalue())
+
+
+def rename_tag(tag, name):
+    tag.name = name
+    tag.save()
+
+
+class BenchCommandTestCase(SimpleTestCase):
+    def test_smoke(self):
+        # bench создает и удаляет свою тестовую БД, поэтому запускается отдельным процессом
+        output = os.path.join(tempfile.mkdtemp(), 'bench.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(output))
+        subprocess.run(
+            [sys.executable, 'manage.py', 'bench', '--products', '5', '--categories', '2', '--images', '1',
+             '--tags', '3', '--reviews', '10', '--users', '3', '--orders', '2', '--requests', '2',
+             '--routes', 'catalog-list', '--output', output],
+            cwd=settings.BASE_DIR, check=True, capture_output=True, timeout=120)
+        with open(output) as file:
+            report = json.load(file)
+        self.assertEqual(report['meta']['scale']['products'], 5)
+        self.assertEqual(set(report['routes']), {'catalog-list', 'catalog-list [tags any]', 'catalog-list [tags all]'})
+        for result in report['routes'].values():
+            self.assertEqual(result['statuses'], {'200': 2})
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+            self.assertGreater(result['queries_max'], 0)
+
+
+class ProductImportExportTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings = override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.category = Category.objects.create(title='phones')
+        self.existing = Product.objects.create(category=self.category, price=10, quantity=1, title='old')
+        with open(os.path.join(self.directory, 'photo.jpg'), 'wb') as file:
+            Image.new('RGB', (10, 10)).save(file, 'JPEG')
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def import_products(self, path, *args):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_products', path, '--images-dir', self.directory, *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_creates_updates_and_reports_invalid_rows(self):
+        path = self.write('products.csv', (
+            'id,category,title,price,quantity,free_delivery,tags,images\n'
+            f',phones,first,5.5,3,false,new|sale,photo.jpg\n'
+            f',{self.category.id},broken,cheap,3,true,,\n'
+            f',unknown,orphan,1,1,true,,\n'
+            f'{self.existing.id},,renamed,12,,,sale,\n'
+        ))
+        version = Product.objects.get(pk=self.existing.pk).version
+        stdout, stderr = self.import_products(path, '--chunk-size', '2')
+
+        self.assertIn('Row 2: price:', stderr)
+        self.assertIn('Row 3: category: Unknown category: unknown.', stderr)
+        self.assertIn('Created 1, updated 1 products, attached 1 images', stdout)
+        first = Product.objects.get(title='first')
+        self.assertEqual((first.price, first.quantity, first.free_delivery), (5.5, 3, False))
+        self.assertEqual(sorted(first.tags.values_list('name', flat=True)), ['new', 'sale'])
+        self.assertTrue(default_storage.exists(first.images.get().image.name))
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.title, self.existing.price, self.existing.quantity), ('renamed', 12, 1))
+        self.assertEqual(self.existing.version, version + 1)
+        self.assertEqual(list(self.existing.tags.values_list('name', flat=True)), ['sale'])
+        self.assertEqual(Tag.objects.filter(name='sale').count(), 1)
+        self.assertEqual(ImportCheckpoint.objects.get().rows, 4)
+
+        # Файл уже импортирован целиком, повторный запуск ничего не создает
+        stdout, _ = self.import_products(path)
+        self.assertIn('Resuming after row 4', stdout)
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_import_resumes_from_checkpoint(self):
+        path = self.write('products.jsonl', ''.join(
+            json.dumps({'category': self.category.id, 'title': f'product {index}', 'price': index, 'quantity': 1})
+            + '\n' for index in range(5)))
+        self.import_products(path, '--chunk-size', '2')
+        checkpoint = ImportCheckpoint.objects.get()
+        # Прерванный после второй пачки импорт
+        Product.objects.filter(title__in=['product 4']).delete()
+        checkpoint.rows = 4
+        checkpoint.save()
+
+        self.import_products(path)
+        self.assertEqual(sorted(Product.objects.values_list('title', flat=True)),
+                         ['old'] + [f'product {index}' for index in range(5)])
+
+        with open(path, 'a') as file:
+            file.write('{}\n')
+        with self.assertRaises(CommandError):
+            self.import_products(path)
+        self.import_products(path, '--restart')
+        self.assertEqual(Product.objects.count(), 11)
+
+    def test_export_round_trip(self):
+        tag = Tag.objects.create(name='tag')
+        tag.product.add(self.existing)
+        ProductImage.objects.create(product=self.existing, image='products/photo.jpg')
+        for format in FORMATS:
+            path = os.path.join(self.directory, f'products.{format}')
+            call_command('export_products', path, '--chunk-size', '1', stdout=io.StringIO())
+            with open(path, encoding='utf-8', newline='') as file:
+                rows = list(read_rows(file, format))
+            self.assertEqual(len(rows), 1)
+            row = ProductImporter.parse(rows[0])
+            self.assertEqual(row['id'], self.existing.id)
+            self.assertEqual(parse_list(row['tags']), ['tag'])
+            self.assertEqual(parse_list(row['images']), ['products/photo.jpg'])
+            self.assertEqual(str(row['category']), str(self.category.id))
+
+
+class SalesRollupTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(title='phones')
+        cls.cases = Category.objects.create(title='cases')
+        cls.phone = Product.objects.create(category=cls.phones, price=100, quantity=50, title='phone')
+        cls.case = Product.objects.create(category=cls.cases, price=10, quantity=50, title='case')
+        cls.user = User.objects.create_user(username='buyer', password='password', name='buyer')
+
+    def checkout(self, *lines):
+        self.client.force_login(self.user)
+        for product, count in lines:
+            self.client.post(reverse('basket'), {'id': product.id, 'count': count})
+        return Order.objects.get(pk=self.client.post(reverse('orders-list')).json()['orderId'])
+
+    def get_rollups(self):
+        return {(row.product_id, row.category_id): (row.units, row.revenue, row.orders)
+                for row in SalesRollup.objects.all()}
+
+    def assertRebuildMatches(self):
+        incremental = self.get_rollups()
+        rebuild_sales()
+        self.assertEqual(self.get_rollups(), {key: value for key, value in incremental.items() if value[0]})
+
+    def test_rollups_follow_orders(self):
+        order = self.checkout((self.phone, 2), (self.case, 1))
+        self.checkout((self.case, 3))
+        self.assertEqual(self.get_rollups(), {
+            (None, None): (6, Decimal('240.00'), 2),
+            (self.phone.id, None): (2, Decimal('200.00'), 1),
+            (self.case.id, None): (4, Decimal('40.00'), 2),
+            (None, self.phones.id): (2, Decimal('200.00'), 1),
+            (None, self.cases.id): (4, Decimal('40.00'), 2),
+        })
+        self.assertRebuildMatches()
+
+        order.status = 'rejected'
+        order.save()
+        self.assertEqual(self.get_rollups()[(None, None)], (3, Decimal('30.00'), 1))
+        self.assertEqual(self.get_rollups()[(self.phone.id, None)], (0, Decimal('0.00'), 0))
+        self.assertRebuildMatches()
+
+        order.status = 'delivered'
+        order.save()
+        item = order.items.get(product=self.phone)
+        item.quantity = 1
+        item.save()
+        order.items.filter(product=self.case).delete()
+        self.assertEqual(self.get_rollups()[(None, None)], (4, Decimal('130.00'), 2))
+        self.assertEqual(self.get_rollups()[(self.case.id, None)], (3, Decimal('30.00'), 1))
+        self.assertRebuildMatches()
+
+        order.delete()
+        self.assertEqual(self.get_rollups()[(None, None)], (3, Decimal('30.00'), 1))
+        self.assertRebuildMatches()
+
+    # Админка подключает статику, а манифест collectstatic в тестах не собран
+    @override_settings(STORAGES={**settings.STORAGES, 'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+    def test_dashboard_reads_rollups(self):
+        self.checkout((self.phone, 1), (self.case, 2))
+        admin = User.objects.create_superuser(username='admin', password='password', name='admin')
+        self.client.force_login(admin)
+        url = reverse('admin:app_shop_salesrollup_changelist')
+        # Сессия и пользователь, затем итоги, ряд, топы товаров и категорий с названиями
+        with self.assertNumQueries(8):
+            response = self.client.get(url, {'from': '2000-01-01'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['by_month'])
+        self.assertEqual(response.context['totals'], {'units': 3, 'revenue': Decimal('120.00'), 'orders': 1})
+        self.assertEqual([row['title'] for row in response.context['top_products']], ['phone', 'case'])
+        self.assertEqual([row['title'] for row in response.context['top_categories']], ['phones', 'cases'])
+        self.assertEqual(self.client.get(url, {'from': 'bad'}).status_code, 200)
+
+
+# Админка подключает статику, а манифест collectstatic в тестах не собран
+@override_settings(STORAGES={**settings.STORAGES, 'staticfiles': {
+    'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}})
+class AdminChangelistTestCase(TestCase):
+    changelists = ('app_shop_product', 'app_shop_review', 'app_shop_order', 'app_users_user', 'app_users_profile')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='admin', password='password', name='admin')
+        cls.category = Category.objects.create(title='phones')
+        cls.add_rows(3)
+
+    @classmethod
+    def add_rows(cls, count):
+        for _ in range(count):
+            number = User.objects.count()
+            user = User.objects.create_user(username=f'user{number}', password='password', name=f'user {number}')
+            Profile.objects.get_or_create(user=user, defaults={'fullName': f'user {number}'})
+            product = Product.objects.create(category=cls.category, price=100, quantity=5, title=f'phone {number}')
+            Review.objects.create(product=product, author=user, rate=5)
+            order = Order.objects.create(user=user, total_cost=100, city='Moscow', address='Street 1')
+            OrderItem.objects.create(order=order, product=product, title=product.title, price=100, quantity=1)
+
+    def get_query_counts(self):
+        counts = {}
+        for name in self.changelists:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(reverse(f'admin:{name}_changelist')).status_code, 200)
+            counts[name] = len(queries)
+            # Подсчет строк только с ограничением LIMIT, без COUNT(*) всей таблицы
+            self.assertFalse([query for query in queries
+                              if 'COUNT(*)' in query['sql'] and 'LIMIT' not in query['sql']])
+        return counts
+
+    def test_query_count_does_not_depend_on_rows(self):
+        self.client.force_login(self.admin)
+        counts = self.get_query_counts()
+        self.add_rows(10)
+        self.assertEqual(self.get_query_counts(), counts)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=2)
+    def test_estimated_count(self):
+        products = Product.objects.order_by('id')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(EstimatedCountPaginator(products, 10).count, products.last().id)
+        self.assertNotIn('COUNT(', queries[0]['sql'])
+        # Отфильтрованный список считается не дальше ADMIN_EXACT_COUNT_LIMIT + 1 строк
+        self.assertEqual(EstimatedCountPaginator(products.filter(price=100), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(products.filter(title='phone 1'), 10).count, 1)
+
+    def test_search_and_autocomplete(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:app_shop_product_changelist'), {'q': 'phone 2'})
+        self.assertEqual([product.title for product in response.context['cl'].result_list], ['phone 2'])
+        order = Order.objects.first()
+        response = self.client.get(reverse('admin:app_shop_order_changelist'), {'q': str(order.id)})
+        self.assertEqual(list(response.context['cl'].result_list), [order])
+        response = self.client.get(reverse('admin:app_shop_review_changelist'), {'q': 'user2'})
+        self.assertEqual([review.author.username for review in response.context['cl'].result_list], ['user2'])
+        response = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'app_shop', 'model_name': 'orderitem', 'field_name': 'product', 'term': 'phone 3'})
+        self.assertEqual([item['text'] for item in response.json()['results']],
+                         [str(Product.objects.get(title='phone 3'))])
+
+
+class CatalogFacetsTestCase(TestCase):
+    query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+             'filter[available]': '', 'category': '', 'sort': 'price', 'sortType': 'inc', 'currentPage': 1,
+             'facets': 1}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.electronics = Category.objects.create(title='electronics')
+        cls.phones = Category.objects.create(title='phones', parent=cls.electronics)
+        cls.books = Category.objects.create(title='books')
+        products = [
+            Product.objects.create(category=cls.phones, price=100, quantity=1, title='red phone', free_delivery=True),
+            Product.objects.create(category=cls.phones, price=300, quantity=1, title='blue phone', free_delivery=False),
+            Product.objects.create(category=cls.electronics, price=500, quantity=1, title='red radio',
+                                   available=False),
+            Product.objects.create(category=cls.books, price=10, quantity=1, title='red book'),
+        ]
+        red = Tag.objects.create(name='red')
+        red.product.add(products[0], products[2], products[3])
+        Tag.objects.create(name='phone').product.add(products[0], products[1])
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_facets_for_filter(self):
+        facets = self.client.get(reverse('catalog-list'), {**self.query, 'category': self.electronics.id}).json()[
+            'facets']
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual([(row['title'], row['count']) for row in facets['categories']],
+                         [('electronics', 3), ('phones', 2)])
+        self.assertEqual(facets['freeDelivery'], {'true': 2, 'false': 1})
+        self.assertEqual(facets['available'], {'true': 2, 'false': 1})
+        self.assertEqual((facets['price']['min'], facets['price']['max']), (100, 500))
+        self.assertEqual([bucket['count'] for bucket in facets['price']['buckets']], [1, 0, 1, 0, 1])
+        self.assertEqual([(tag['name'], tag['count']) for tag in facets['tags']], [('red', 2), ('phone', 2)])
+
+        facets = self.client.get(reverse('catalog-list'), {**self.query, 'filter[name]': 'red'}).json()['facets']
+        self.assertEqual(facets['total'], 3)
+        self.assertEqual(facets['tags'][0], {'id': Tag.objects.get(name='red').id, 'name': 'red', 'count': 3})
+        self.assertNotIn('facets', self.client.get(reverse('catalog-list'), {**self.query, 'facets': 0}).json())
+
+    def test_price_buckets_include_non_round_extremes(self):
+        cheap = Product.objects.create(category=self.books, price=10.006, quantity=1, title='cheap')
+        dear = Product.objects.create(category=self.books, price=20.004, quantity=1, title='dear')
+        buckets = get_price_buckets(Product.objects.filter(id__in=[cheap.id, dear.id]), 10.006, 20.004)
+        self.assertEqual((buckets[0]['min'], buckets[-1]['max']), (10.0, 20.01))
+        self.assertEqual([bucket['count'] for bucket in buckets], [1, 0, 0, 0, 1])
+
+    def test_facets_use_bounded_queries_and_cache(self):
+        with self.assertNumQueries(5):
+            compute_facets(Product.objects.all())
+        with self.assertNumQueries(1):
+            self.assertEqual(compute_facets(Product.objects.filter(price__gt=1000))['total'], 0)
+
+        self.assertEqual(get_filter_signature({'filter[name]': ' Red ', 'filter[minPrice]': '10'}),
+                         get_filter_signature({'filter[name]': 'red', 'filter[minPrice]': '10.0', 'sort': 'date'}))
+        url = reverse('catalog-list')
+        self.client.get(url, self.query)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url, {**self.query, 'currentPage': 2, 'sort': 'date'})
+        # Фасеты взяты из кеша: запросы только за страницей товаров
+        self.assertFalse(any('MIN(' in query['sql'] for query in first))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(category=self.books, price=20, quantity=1, title='new book')
+        self.assertEqual(self.client.get(url, self.query).json()['facets']['total'], 5)
+
+
+class CatalogTagsFilterTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='phones')
+        cls.products = [Product.objects.create(category=category, price=price, quantity=1, title=f'phone {price}')
+                        for price in (100, 200, 300)]
+        cls.red, cls.new, cls.sale = (Tag.objects.create(name=name) for name in ('red', 'new', 'sale'))
+        cls.red.product.add(cls.products[0], cls.products[1])
+        cls.new.product.add(cls.products[1], cls.products[2])
+
+    def get_ids(self, **params):
+        data = self.client.get(reverse('catalog-list'), {'sort': 'price', 'sortType': 'inc', 'limit': 20, **params}).json()
+        return [product['id'] for product in data['items']]
+
+    def test_any_and_all(self):
+        first, second, third = (product.id for product in self.products)
+        tags = f'{self.red.id},{self.new.id}'
+        self.assertEqual(self.get_ids(**{'filter[tags]': tags}), [first, second, third])
+        self.assertEqual(self.get_ids(**{'filter[tags]': tags, 'filter[tagsMode]': 'all'}), [second])
+        self.assertEqual(self.get_ids(**{'tags[]': [self.red.id, self.sale.id], 'filter[tagsMode]': 'all'}), [])
+        self.assertEqual(self.get_ids(**{'filter[tags]': f'{self.new.id},x,{self.new.id}'}), [second, third])
+        self.assertEqual(parse_tags({'filter[tags]': '3,1,3', 'filter[tagsMode]': 'ALL'}), ([1, 3], 'all'))
+        self.assertEqual(parse_tags({'filter[tagsMode]': 'none'}), ([], 'any'))
+        self.assertNotEqual(get_filter_signature({'filter[tags]': tags}),
+                            get_filter_signature({'filter[tags]': tags, 'filter[tagsMode]': 'all'}))
+
+    def test_query_plans_use_through_indexes(self):
+        for mode in ('any', 'all'):
+            plan = filter_by_tags(Product.objects.order_by('price'), [self.red.id, self.new.id], mode).explain()
+            # Подзапрос читает только индекс (tag, product), без полного просмотра таблицы связи
+            self.assertRegex(plan, r'SEARCH \w+ USING COVERING INDEX \w+ \(tag_id=\?\)')
+            self.assertNotRegex(plan, r'SCAN (app_shop_tag_product|U0)\b')
+            self.assertIn('USING INTEGER PRIMARY KEY', plan)
+        plan = Product.tags.through.objects.filter(product_id=self.products[0].id).values('tag_id').explain()
+        self.assertIn('COVERING INDEX product_tag_product_idx', plan)
+
+
+class CatalogIndexesTestCase(TestCase):
+    filters = ({}, {'filter[minPrice]': '10', 'filter[maxPrice]': '100'}, {'filter[freeDelivery]': 'true'},
+               {'filter[available]': 'true'}, {'category': '1'}, {'filter[tags]': '1,2'}, {'filter[name]': 'phone'})
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='phones')
+        cls.products = [Product.objects.create(category=category, price=price, quantity=1, title=f'phone {price}')
+                        for price in (300, 100, 200)]
+        Review.objects.create(product=cls.products[2], author=User.objects.create_user(
+            username='reviewer', password='password', name='reviewer'), rate=4)
+
+    def get_plan(self, params):
+        view = CatalogAPIView()
+        view.request = view.initialize_request(RequestFactory().get(reverse('catalog-list'), params))
+        return view.get_queryset().explain()
+
+    def test_every_filter_and_sort_uses_an_index(self):
+        for params in self.filters:
+            for sort in SORT_FIELDS:
+                for sort_type in ('inc', 'dec'):
+                    with self.subTest(sort=sort, sort_type=sort_type, **params):
+                        plan = self.get_plan({**params, 'sort': sort, 'sortType': sort_type})
+                        lines = re.findall(r'(?:SCAN|SEARCH) app_shop_product\b(?!_).*', plan)
+                        self.assertTrue(lines)
+                        for line in lines:
+                            # Просмотр таблицы без индекса допустим только в порядке первичного ключа
+                            if sort != 'id' or 'TEMP B-TREE' in plan:
+                                self.assertIn(' USING ', line)
+
+    def test_storefront_queries_use_indexes(self):
+        self.assertIn('USING INDEX product_sale_idx', SaleProductsView().get_queryset().explain())
+        for name, index in (('rated', 'product_rating_idx'), ('limited', 'product_quantity_idx')):
+            self.assertIn(f'USING INDEX {index}', LEADERBOARDS[name].get_ranked_products().explain())
+
+    def test_sort_whitelist(self):
+        self.assertEqual(get_ordering({'sort': 'reviews', 'sortType': 'dec'}), ['-review_count', '-id'])
+        self.assertEqual(get_ordering({'sort': 'title; DROP', 'sortType': 'inc'}), ['id'])
+        url = reverse('catalog-list')
+        first, second, third = (product.id for product in self.products)
+        data = self.client.get(url, {'sort': 'full_description', 'limit': 10}).json()
+        self.assertEqual([item['id'] for item in data['items']], [first, second, third])
+        data = self.client.get(url, {'sort': 'rating', 'sortType': 'dec', 'limit': 2, 'cursor': ''}).json()
+        self.assertEqual([item['id'] for item in data['items']], [third, second])
+        data = self.client.get(url, {'sort': 'rating', 'sortType': 'dec', 'limit': 2,
+                                     'cursor': data['nextCursor']}).json()
+        self.assertEqual([item['id'] for item in data['items']], [first])
+
+
+class ProductReviewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='phones')
+        cls.product = Product.objects.create(category=category, price=100, quantity=1, title='phone')
+        cls.other = Product.objects.create(category=category, price=200, quantity=1, title='other phone')
+        now = timezone.now()
+        for index in range(25):
+            user = User.objects.create_user(username=f'author{index}', password='password', name=f'author{index}')
+            Profile.objects.create(user=user, fullName=f'Author {index}', email=f'author{index}@example.com')
+            review = Review.objects.create(product=cls.product, author=user, rate=index % 5 + 1, text=f'text {index}')
+            # date с auto_now задается только через update
+            Review.objects.filter(pk=review.pk).update(date=now - timedelta(hours=index // 2))
+        Review.objects.create(product=cls.other, author=user, rate=1)
+        cls.product.refresh_from_db()
+
+    def get_pages(self, params):
+        url = reverse('product-review', args=[self.product.id])
+        pages, cursor = [], ''
+        while cursor is not None:
+            with self.assertNumQueries(2):
+                data = self.client.get(url, {**params, 'cursor': cursor}).json()
+            pages.append(data)
+            cursor = data['nextCursor']
+        return pages
+
+    def test_cursor_pages_in_sort_order(self):
+        for params, ordering in (({}, ('-date', '-id')), ({'sort': 'rating'}, ('-rate', '-date', '-id')),
+                                 ({'sort': 'rating', 'sortType': 'inc'}, ('rate', 'date', 'id'))):
+            with self.subTest(**params):
+                pages = self.get_pages({**params, 'limit': 10})
+                self.assertEqual([len(page['items']) for page in pages], [10, 10, 5])
+                expected = self.product.reviews.order_by(*ordering)
+                self.assertEqual([(item['author'], item['rate']) for page in pages for item in page['items']],
+                                 [(review.author.profile.fullName, review.rate) for review in expected])
+                # prevCursor возвращает предыдущую страницу
+                previous = self.client.get(reverse('product-review', args=[self.product.id]),
+                                           {**params, 'limit': 10, 'cursor': pages[2]['prevCursor']}).json()
+                self.assertEqual(previous['items'], pages[1]['items'])
+
+    def test_product_detail_embeds_first_page_and_summary(self):
+        data = self.client.get(reverse('product-detail', args=[self.product.id])).json()
+        first_page = self.client.get(reverse('product-review', args=[self.product.id]), {'cursor': ''}).json()
+        self.assertEqual(data['reviews'], first_page['items'])
+        self.assertEqual(len(data['reviews']), ReviewPagination.page_size)
+        self.assertEqual(data['reviewsSummary'], {
+            'count': 25, 'rating': 3.0, 'histogram': {str(rate): 5 for rate in range(1, 6)},
+            'nextCursor': first_page['nextCursor'],
+        })
+        self.assertEqual(self.client.get(reverse('product-review', args=[0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('product-review', args=[self.product.id]),
+                                         {'cursor': 'broken'}).status_code, 404)
+
+    def test_review_pages_use_indexes(self):
+        for params, index in (({}, 'review_product_date_idx'), ({'sort': 'rating'}, 'review_product_rate_idx'),
+                              ({'sort': 'rating', 'sortType': 'inc'}, 'review_product_rate_idx')):
+            with self.subTest(**params):
+                plan = get_review_queryset(self.product.id, params).explain()
+                self.assertIn(f'USING INDEX {index}', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+class AsyncStorefrontViewsTestCase(TestCase):
+    catalog_query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+                     'filter[available]': '', 'category': '', 'sort': 'price', 'sortType': 'inc', 'limit': 2}
+
+    @classmethod
+    def setUpTestData(cls):
+        parent = Category.objects.create(title='electronics')
+        category = Category.objects.create(title='phones', parent=parent)
+        cls.products = [Product.objects.create(category=category, price=price, quantity=price // 10, title=f'phone {price}',
+                                               discount=10 if price > 100 else 0) for price in (100, 200, 300)]
+        ProductImage.objects.create(product=cls.products[0], image='products/product_1/images/phone.jpg')
+        Tag.objects.create(name='new').product.add(cls.products[0], cls.products[2])
+        user = User.objects.create_user(username='author', password='password', name='author')
+        Profile.objects.create(user=user, fullName='author', email='author@example.com')
+        Review.objects.create(product=cls.products[0], author=user, rate=5, text='good')
+        for leaderboard in LEADERBOARDS.values():
+            leaderboard.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def get_async(self, url, params=None, headers=None):
+        match = resolve(url)
+        view = ASYNC_VIEWS[match.func.view_class].as_view()
+        return async_to_sync(view)(AsyncRequestFactory().get(url, params, headers=headers), **match.kwargs)
+
+    def test_json_matches_sync_views(self):
+        cases = [
+            ('categories-list', [], {}),
+            ('catalog-list', [], self.catalog_query),
+            ('catalog-list', [], {**self.catalog_query, 'page': 2, 'facets': 1}),
+            ('catalog-list', [], {**self.catalog_query, 'sort': 'rating', 'sortType': 'dec', 'cursor': ''}),
+            ('catalog-list', [], {**self.catalog_query, 'page': 5}),
+            ('popular-products', [], {}),
+            ('limited-products', [], {}),
+            ('sales-products', [], {'limit': 5}),
+            ('banners-products', [], {}),
+            ('tags-list', [], {}),
+            ('product-detail', [self.products[0].id], {}),
+            ('product-detail', [0], {}),
+        ]
+        for name, args, params in cases:
+            with self.subTest(name=name, **params):
+                url = reverse(name, args=args)
+                response = self.get_async(url, params)
+                cache.clear()
+                expected = self.client.get(url, params)
+                self.assertEqual(response.status_code, expected.status_code)
+                self.assertEqual(response['Content-Type'], 'application/json')
+                self.assertEqual(json.loads(response.content), expected.json())
+
+    def test_etag_and_response_cache_are_shared(self):
+        url = reverse('popular-products')
+        response = self.get_async(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        expected = self.client.get(url)
+        self.assertEqual(expected['X-Cache'], 'HIT')
+        self.assertEqual(response['ETag'], expected['ETag'])
+        self.assertEqual(self.get_async(url, headers={'If-None-Match': response['ETag']}).status_code, 304)
+
+        url = reverse('product-detail', args=[self.products[0].id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_async(url, headers={'If-None-Match': etag}).status_code, 304)
+        # Карточка с изображениями, тегами и отзывами с авторами: без N+1
+        with self.assertNumQueries(5):
+            self.assertEqual(self.get_async(url).status_code, 200)
+
+    def test_async_views_are_routed_by_setting(self):
+        self.assertFalse(iscoroutinefunction(read_view(CatalogAPIView)))
+        with override_settings(STOREFRONT_ASYNC_VIEWS=True):
+            self.assertTrue(iscoroutinefunction(read_view(CatalogAPIView)))
+        # Async цепочка middleware (в том числе CartMiddleware) под ASGI
+        async def get():
+            return await self.async_client.get(reverse('tags-list'))
+
+        response = async_to_sync(get)()
+        self.assertEqual(response.json(), [{'id': tag.id, 'name': tag.name} for tag in Tag.objects.all()])
+
+
+@override_settings(SQL_INSTRUMENTATION=True, SQL_N_PLUS_ONE_THRESHOLD=5, SQL_SLOW_QUERY_MS=None)
+class SQLInstrumentationTestCase(TestCase):
+    query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+             'filter[available]': '', 'sort': 'id', 'sortType': 'inc', 'limit': 20}
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='phones')
+        tag = Tag.objects.create(name='new')
+        for index in range(8):
+            tag.product.add(Product.objects.create(category=category, price=100, quantity=1, title=f'phone {index}'))
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_headers(self):
+        with self.assertNoLogs('marketplace.sql'):
+            response = self.client.get(reverse('catalog-list'), self.query)
+        self.assertEqual(response['X-DB-Queries'], '4')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=\d+\.\d{2};desc="4 queries"$')
+
+    def test_repeated_query_is_logged(self):
+        # Полный ProductSerializer без prefetch_related('tags') читает теги каждого товара отдельным запросом
+        with mock.patch.object(ProductListMixin, 'fast_serializer', False), \
+                self.assertLogs('marketplace.sql', 'WARNING') as logs:
+            response = self.client.get(reverse('catalog-list'), self.query)
+        [record] = logs.records
+        self.assertEqual(record.view, 'app_shop.views.CatalogAPIView')
+        self.assertEqual(record.db_queries, int(response['X-DB-Queries']))
+        [repeated] = record.repeated_queries
+        self.assertEqual(repeated['count'], 8)
+        self.assertIn('"app_shop_tag"', repeated['sql'])
+        self.assertNotIn('%s', repeated['sql'])
+
+    @override_settings(SQL_SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged(self):
+        with self.assertLogs('marketplace.sql', 'WARNING') as logs:
+            self.client.get(reverse('tags-list'))
+        [record] = logs.records
+        self.assertTrue(record.getMessage().startswith('Slow queries in app_shop.views.TagsAPIView'))
+        self.assertEqual(len(record.slow_queries), record.db_queries)
+
+    def test_async_chain(self):
+        async def get_response(request):
+            await Product.objects.acount()
+            # Задачи gather получают копию контекста запроса
+            await asyncio.gather(Product.objects.acount(), Category.objects.acount())
+            return HttpResponse()
+
+        middleware = SQLInstrumentationMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        self.assertEqual(response['X-DB-Queries'], '3')
+
+
+@override_settings(DATABASE_REPLICA='replica', DATABASE_REPLICA_APPS=('app_shop',), DATABASE_REPLICA_PIN_SECONDS=5)
+class DatabaseRoutingTestCase(TransactionTestCase):
+    # Без транзакции TestCase: внутри транзакции основной БД роутер не читает из реплики
+    router = PrimaryReplicaRouter()
+    catalog_query = {'filter[name]': '', 'filter[minPrice]': '', 'filter[maxPrice]': '', 'filter[freeDelivery]': '',
+                     'filter[available]': '', 'sort': 'id', 'sortType': 'inc', 'limit': 20}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Реплика - второе соединение к тестовой основной БД, как alias replica с TEST MIRROR при DB_REPLICA_NAME.
+        # Alias добавляется после проверок тестового раннера, поэтому не входит в databases
+        cls.added_replica = 'replica' not in connections
+        if cls.added_replica:
+            connections.settings['replica'] = dict(connections['default'].settings_dict, TEST={'MIRROR': 'default'})
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.added_replica:
+            connections['replica'].close()
+            del connections['replica']
+            del connections.settings['replica']
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.product = Product.objects.create(category=Category.objects.create(title='phones'), price=100,
+                                              quantity=10, title='phone')
+
+    def get_catalog(self):
+        """Запросы каталога к таблицам app_shop в основной БД и в реплике (сессии всегда читаются из основной)"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(reverse('catalog-list'), self.catalog_query)
+        self.assertEqual(response.json()['items'][0]['id'], self.product.id)
+        return [[query['sql'] for query in context.captured_queries if '"app_shop_' in query['sql']]
+                for context in (primary, replica)]
+
+    def test_storefront_get_selects_from_replica(self):
+        primary, replica = self.get_catalog()
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+        self.assertTrue(all(sql.startswith('SELECT') for sql in replica))
+        self.assertNotIn(settings.DATABASE_REPLICA_PIN_COOKIE, self.client.cookies)
+
+    def test_get_after_post_reads_primary_within_pin_window(self):
+        # Корзина хранится в сессии и не закрепляет клиента за основной БД, отзыв - закрепляет
+        self.client.force_login(User.objects.create_user(username='author', password='password', name='author'))
+        self.client.post(reverse('basket'), {'id': self.product.id, 'count': 1})
+        self.assertNotIn(settings.DATABASE_REPLICA_PIN_COOKIE, self.client.cookies)
+        self.client.post(reverse('product-review', args=[self.product.id]), {'text': 'good', 'rate': 5})
+        self.assertIn(settings.DATABASE_REPLICA_PIN_COOKIE, self.client.cookies)
+        primary, replica = self.get_catalog()
+        self.assertEqual(replica, [])
+        self.assertTrue(primary)
+
+        # После окна чтения снова идут в реплику
+        expired = time.time() + settings.DATABASE_REPLICA_PIN_SECONDS + 1
+        with mock.patch('marketplace.middleware.time.time', return_value=expired):
+            primary, replica = self.get_catalog()
+        self.assertEqual(primary, [])
+        self.assertTrue(replica)
+        # Другой клиент не закреплен за основной БД
+        self.client = self.client_class()
+        primary, replica = self.get_catalog()
+        self.assertEqual(primary, [])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+                                           'LOCATION': 'storefront_cache'}})
+    def test_database_cache_writes_do_not_pin(self):
+        call_command('createcachetable', verbosity=0)
+        for _ in range(2):
+            primary, replica = self.get_catalog()
+            self.assertEqual(primary, [])
+            self.assertTrue(replica)
+        self.assertNotIn(settings.DATABASE_REPLICA_PIN_COOKIE, self.client.cookies)
+        self.assertTrue(get_stats())
+
+    def route_request(self, method, url):
+        """Алиас БД для чтения товаров внутри запроса, прошедшего ReplicaRoutingMiddleware"""
+        def get_response(request):
+            middleware.process_view(request, resolve(url).func, (), {})
+            return self.router.db_for_read(Product)
+
+        middleware = ReplicaRoutingMiddleware(get_response)
+        return middleware(getattr(RequestFactory(), method)(url))
+
+    def test_storefront_reads_use_replica(self):
+        self.assertEqual(self.route_request('get', reverse('catalog-list')), 'replica')
+        self.assertEqual(self.route_request('head', reverse('product-detail', args=[1])), 'replica')
+        self.assertEqual(self.route_request('post', reverse('product-review', args=[1])), 'default')
+        self.assertEqual(self.route_request('get', reverse('orders-list')), 'default')
+        # Вне HTTP запроса и без настроенной реплики - основная БД
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+        with override_settings(DATABASE_REPLICA=None):
+            self.assertEqual(self.route_request('get', reverse('catalog-list')), 'default')
+
+    def test_reads_stick_to_primary_after_write(self):
+        tag = Tag.objects.create(name='new')
+        with routing_context() as state:
+            state.replica = True
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Product), 'default')
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            Tag.objects.filter(pk=tag.pk).update(name='sale')
+            self.assertTrue(state.pinned)
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+
+
+class StaticPipelineTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        static_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, static_root)
+        settings = override_settings(STATIC_ROOT=static_root)
+        settings.enable()
+        cls.addClassCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0, ignore_patterns=['admin', 'rest_framework'])
+
+    def serve(self, path, **headers):
+        return serve_static(RequestFactory().get(f'/static/{path}', **headers), path)
+
+    def test_files_are_hashed_and_precompressed(self):
+        css = staticfiles_storage.stored_name('frontend/assets/css/basic.css')
+        self.assertRegex(css, r'^frontend/assets/css/basic\.[0-9a-f]{12}\.css$')
+        self.assertTrue(staticfiles_storage.exists(css + '.gz'))
+        font = staticfiles_storage.stored_name('frontend/assets/fonts/Roboto/Roboto-Bold.woff')
+        self.assertFalse(staticfiles_storage.exists(font + '.gz'))
+
+    def test_templates_reference_hashed_names(self):
+        content = self.client.get('/cart/').content.decode()
+        self.assertIn(staticfiles_storage.url('frontend/assets/img/icons/card/delete.svg'), content)
+        self.assertNotIn('/static/frontend/assets/img/icons/card/delete.svg', content)
+
+    def test_serving_honors_accept_encoding(self):
+        css = staticfiles_storage.stored_name('frontend/assets/css/basic.css')
+        with staticfiles_storage.open(css) as original:
+            content = original.read()
+
+        response = self.serve(css, HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), content)
+
+        response = self.serve(css)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+        for header in ('gzip;q=0', 'br, gzip; q=0.000', '*;q=0', 'gzip;q=0, *'):
+            response = self.serve(css, HTTP_ACCEPT_ENCODING=header)
+            self.assertFalse(response.has_header('Content-Encoding'), header)
+        self.assertEqual(self.serve(css, HTTP_ACCEPT_ENCODING='br, *')['Content-Encoding'], 'gzip')
+
+        self.assertEqual(self.serve('frontend/assets/css/basic.css')['Cache-Control'], 'public, max-age=3600')
+        with self.assertRaises(Http404):
+            self.serve('../manage.py')
@@ -1,21 +1,36 @@
+from django.conf import settings
 from django.urls import path
 
+from marketplace.routers import use_replica
+from .async_views import ASYNC_VIEWS
 from .views import CategoriesAPIView, CatalogAPIView, TagsAPIView, PopularProductsView, LimitedProductsView, \
     SaleProductsView, BannerProductsView, OrdersListAPIView, OrderRetrieveAPIView, PaymentAPIView, \
-    ProductRetrieveAPIView, ReviewAPIView
+    ProductRetrieveAPIView, ReviewAPIView, StorefrontCacheStatsAPIView
+
+
+def read_view(view_class):
+    """
+    Эндпоинт витрины только для чтения: async версия при STOREFRONT_ASYNC_VIEWS (запуск под ASGI), иначе sync.
+    Каталог читается из реплики, если она настроена
+    """
+    if getattr(settings, 'STOREFRONT_ASYNC_VIEWS', False):
+        view_class = ASYNC_VIEWS[view_class]
+    return use_replica(view_class.as_view())
+
 
 urlpatterns = [
-    path('categories', CategoriesAPIView.as_view(), name='categories-list'),
-    path('catalog', CatalogAPIView.as_view(), name='catalog-list'),
-    path('products/popular', PopularProductsView.as_view(), name='popular-products'),
-    path('products/limited', LimitedProductsView.as_view(), name='limited-products'),
-    path('sales', SaleProductsView.as_view(), name='sales-products'),
-    path('banners', BannerProductsView.as_view(), name='banners-products'),
-    path('tags', TagsAPIView.as_view(), name='tags-list'),
+    path('categories', read_view(CategoriesAPIView), name='categories-list'),
+    path('catalog', read_view(CatalogAPIView), name='catalog-list'),
+    path('products/popular', read_view(PopularProductsView), name='popular-products'),
+    path('products/limited', read_view(LimitedProductsView), name='limited-products'),
+    path('sales', read_view(SaleProductsView), name='sales-products'),
+    path('banners', read_view(BannerProductsView), name='banners-products'),
+    path('tags', read_view(TagsAPIView), name='tags-list'),
+    path('cache/stats', StorefrontCacheStatsAPIView.as_view(), name='cache-stats'),
     path('orders', OrdersListAPIView.as_view(), name='orders-list'),
     path('order/<int:pk>', OrderRetrieveAPIView.as_view(), name='order-detail'),
     path('payment', PaymentAPIView.as_view(), name='payment-detail'),
-    path('product/<int:pk>', ProductRetrieveAPIView.as_view(), name='product-detail'),
-    path('product/<int:pk>/reviews', ReviewAPIView.as_view(), name='product-review')
+    path('product/<int:pk>', read_view(ProductRetrieveAPIView), name='product-detail'),
+    path('product/<int:pk>/reviews', use_replica(ReviewAPIView.as_view()), name='product-review')
 
 ]
@@ -1,174 +1,215 @@
+from collections import defaultdict
 from datetime import datetime
 from decimal import Decimal
 
-from django.db.models import Avg
-from rest_framework import pagination
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import NotFound
 from rest_framework.generics import ListAPIView, RetrieveAPIView
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from cart.cart import Cart
-from .models import Category, Product, Tag, Order, Review
+from .cache import ConditionalGetMixin, StorefrontCacheMixin, get_stats, make_etag
+from .catalog import filter_by_tags, get_ordering, is_explicit_sort, parse_tags
+from .facets import get_facets
+from .models import Category, Product, Tag, Order, OrderItem, Review, rating_rank_expression
+from .leaderboards import LEADERBOARDS
+from .pagination import CustomCatalogPagination, ReviewPagination
+from .reviews import get_review_queryset
+from .sales import record_order
+from .search import get_search_backend
+from .stock import OutOfStock, reserve_stock
 from .serializers import CategorySerializer, ProductSerializer, TagsSerializer, OrderSerializer, \
-    ProductDetailSerializer, ReviewSerializer
+    ProductDetailSerializer, ReviewSerializer, ProductCardSerializer
 
 
 # Create your views here.
 
-class CategoriesAPIView(ListAPIView):
-    """ Список категорий """
-    queryset = Category.objects.filter(active=True, parent=None).order_by('id').prefetch_related('subcategories')
+class CategoriesAPIView(ConditionalGetMixin, StorefrontCacheMixin, ListAPIView):
+    """ Список категорий, дерево любой глубины строится из одного запроса """
+    cache_name = 'categories'
+    cache_models = ('Category',)
+    queryset = Category.objects.filter(active=True).order_by('id')
     serializer_class = CategorySerializer
 
+    def list(self, request, *args, **kwargs):
+        children = defaultdict(list)
+        for category in self.get_queryset():
+            children[category.parent_id].append(category)
+        context = self.get_serializer_context()
+        context['children'] = children
+        serializer = self.get_serializer_class()(children[None], many=True, context=context)
+        return Response(serializer.data)
 
-class CustomCatalogPagination(pagination.PageNumberPagination):
+
+class ProductListMixin:
     """
-    Кастомная пагинация с помощью PageNumberPagination
-    Метод get_paginated_response переопределен для соответствия с swagger
+    Сериализация карточек товаров в списках.
+    fast_serializer = True - ProductCardSerializer (проекция колонок и пакетная загрузка изображений и тегов),
+    False - полный ProductSerializer. JSON в обоих случаях одинаковый
     """
-    page_size = 1
-    max_page_size = 100
-    page_size_query_param = 'limit'
+    fast_serializer = True
+
+    def get_serializer_class(self):
+        return ProductCardSerializer if self.fast_serializer else ProductSerializer
 
-    def get_paginated_response(self, data):
-        return Response({
-            'items': data,
-            'currentPage': self.page.number,
-            'lastPage': self.page.paginator.num_pages
-        })
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.fast_serializer:
+            queryset = ProductCardSerializer.prepare_queryset(queryset)
+        return queryset
 
 
-class CatalogAPIView(ListAPIView):
+class CatalogAPIView(ConditionalGetMixin, ProductListMixin, ListAPIView):
     permission_classes = [AllowAny]
-    serializer_class = ProductSerializer
+    cache_models = ('Product', 'Review', 'ProductImage', 'Tag', 'Category')
     pagination_class = CustomCatalogPagination
 
     def get_queryset(self):
-        if self.request.query_params:
+        params = self.request.query_params
+        # Фронтенд передает все параметры фильтра, но фасеты (facets=1) можно запросить и без них
+        if set(params) - {'facets'}:
             filter_data = {}
-            if self.request.query_params['filter[name]']:
-                title = self.request.query_params['filter[name]']
-                filter_data['title__contains'] = title
-            if self.request.query_params['filter[minPrice]']:
-                min_price = self.request.query_params['filter[minPrice]']
+            search_text = params.get('filter[name]', '')
+            if params.get('filter[minPrice]'):
+                min_price = params['filter[minPrice]']
                 filter_data['price__gte'] = float(min_price)
-            if self.request.query_params['filter[maxPrice]']:
-                max_price = Decimal(self.request.query_params['filter[maxPrice]'])
+            if params.get('filter[maxPrice]'):
+                max_price = Decimal(params['filter[maxPrice]'])
 
                 filter_data['price__lte'] = float(max_price)
-            if self.request.query_params['filter[freeDelivery]']:
-                free_delivery = self.request.query_params['filter[freeDelivery]'].capitalize()
+            if params.get('filter[freeDelivery]'):
+                free_delivery = params['filter[freeDelivery]'].capitalize()
                 filter_data['free_delivery'] = free_delivery
-            if self.request.query_params['filter[available]']:
-                available = self.request.query_params['filter[available]'].capitalize()
+            if params.get('filter[available]'):
+                available = params['filter[available]'].capitalize()
                 filter_data['available'] = available
-            if self.request.query_params['category']:
-                category_id = self.request.query_params['category']
-                category = Category.objects.get(id=category_id)
-                if category.parent:
-                    # print("It's subcategory")
-                    filter_data['category'] = category_id
-                else:
-                    # print("It's category")
-                    subcategories_id_list = [subcategory for subcategory in category.subcategories.values_list('id')]
-                    subcategories_id_list.append(category_id)
-                    filter_data['category__in'] = subcategories_id_list
-            if self.request.query_params['sort']:
-                sort_by = self.request.query_params['sort']
-            if self.request.query_params['sortType']:
-                sort_type = self.request.query_params['sortType']
-                if sort_type == 'dec':
-                    sort_by = '-' + sort_by
+            if params.get('category'):
+                # Товары категории и всех ее подкатегорий на любой глубине
+                filter_data['category__ancestors__ancestor'] = params['category']
+            # sort передается в order_by только через белый список индексированных полей
+            ordering = get_ordering(params)
             queryset = Product.objects.prefetch_related('images').filter(**filter_data).annotate(
-                rating=Avg('reviews__rate')).order_by(sort_by)
-            return queryset
+                rating_rank=rating_rank_expression())
+            queryset = filter_by_tags(queryset, *parse_tags(params))
+            if search_text:
+                queryset = get_search_backend().search(queryset, search_text)
+                if is_explicit_sort(params):
+                    # Релевантность учитывается после выбранной клиентом сортировки
+                    return queryset.order_by(ordering[0], 'search_rank', *ordering[1:])
+                return queryset.order_by('search_rank', 'id')
+            return queryset.order_by(*ordering)
         return Product.objects.prefetch_related('images').all()
 
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets') in ('1', 'true'):
+            response.data['facets'] = get_facets(self.get_queryset(), request.query_params)
+        return response
+
 
-class PopularProductsView(ListAPIView):
+class PopularProductsView(ConditionalGetMixin, StorefrontCacheMixin, ProductListMixin, ListAPIView):
     """Список из 5 продуктов с наивысшим рейтингом"""
+    cache_name = 'popular'
+    cache_models = ('Product', 'Review', 'ProductImage', 'Tag')
     permission_classes = [AllowAny]
-    serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return Product.objects.prefetch_related('images').annotate(rating=Avg('reviews__rate')).order_by('-rating')[:5]
+        return LEADERBOARDS['rated'].queryset().prefetch_related('images')[:5]
 
 
-class LimitedProductsView(ListAPIView):
+class LimitedProductsView(ConditionalGetMixin, StorefrontCacheMixin, ProductListMixin, ListAPIView):
     """Список из 5 продуктов с самым низким количеством"""
+    cache_name = 'limited'
+    cache_models = ('Product', 'Review', 'ProductImage', 'Tag')
     permission_classes = [AllowAny]
-    serializer_class = ProductSerializer
 
     def get_queryset(self):
-        return Product.objects.prefetch_related('images').order_by('quantity')[:5]
+        return LEADERBOARDS['limited'].queryset().prefetch_related('images')[:5]
 
 
-class SaleProductsView(ListAPIView):
+class SaleProductsView(ConditionalGetMixin, StorefrontCacheMixin, ProductListMixin, ListAPIView):
     """Список продуктов у которых имеется скидка, т.е значение поля discount > 0"""
+    cache_name = 'sales'
+    cache_models = ('Product', 'Review', 'ProductImage', 'Tag')
     permission_classes = [AllowAny]
-    serializer_class = ProductSerializer
     pagination_class = CustomCatalogPagination
 
     def get_queryset(self):
-        return Product.objects.prefetch_related('images').filter(discount__gt=0)
+        return Product.objects.prefetch_related('images').filter(discount__gt=0).order_by('id')
 
 
-class BannerProductsView(ListAPIView):
+class BannerProductsView(ConditionalGetMixin, StorefrontCacheMixin, ProductListMixin, ListAPIView):
     """Список из 5 последних продуктов для баннеров"""
+    cache_name = 'banners'
+    cache_models = ('Product', 'Review', 'ProductImage', 'Tag')
     permission_classes = [AllowAny]
-    serializer_class = ProductSerializer
     pagination_class = CustomCatalogPagination
 
     def get_queryset(self):
-        return Product.objects.prefetch_related('images').all()[:5]
+        # Первые товары по первичному ключу читаются с края индекса, доска для этого не нужна
+        return Product.objects.prefetch_related('images').order_by('id')[:5]
 
 
-class TagsAPIView(ListAPIView):
+class TagsAPIView(ConditionalGetMixin, StorefrontCacheMixin, ListAPIView):
     """Список из 5 последних тегов"""
+    cache_name = 'tags'
+    cache_models = ('Tag',)
     queryset = Tag.objects.all()[:5]
     serializer_class = TagsSerializer
 
 
+class StorefrontCacheStatsAPIView(APIView):
+    """Счетчики попаданий и промахов кеша витрины"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(get_stats())
+
+
 class OrdersListAPIView(ListAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = OrderSerializer
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).select_related('user')
-
-    def get_cart_items(self, cart):
-        cart_items = []
-        for item in cart:
-            product = Product.objects.get(id=item["product_id"])
-            cart_items.append(
-                {
-                    "id": product.id,
-                    "category": product.category.id,
-                    "price": float(item["price"]),
-                    "count": item["quantity"],
-                    "date": product.date.strftime("%a %b %d %Y %H:%M:%S GMT%z (%Z)"),
-                    "title": product.title,
-                    "description": product.short_description(),
-                    "freeDelivery": product.free_delivery,
-                    "images": [
-                        {"src": image.image.url, "alt": product.title}
-                        for image in product.images.all()
-                    ],
-                    "tags": [
-                        {"id": tag.id, "name": tag.name} for tag in product.tags.all()
-                    ],
-                    "reviews": product.reviews_count(),
-                    "rating": product.average_rating(),
-                }
-            )
-        return cart_items
+        return Order.objects.filter(user=self.request.user).select_related('user__profile').prefetch_related('items')
 
     def post(self, request):
         cart = Cart(request)
-        cart_items = self.get_cart_items(cart)
-        order = Order(user=request.user, total_cost=cart.get_total_price(), products=cart_items)
-        order.save()
+        invalid = [{'id': int(product_id), 'requested': line.get('quantity')} for product_id, line in cart.cart.items()
+                   if type(line.get('quantity')) is not int or line['quantity'] <= 0]
+        if invalid:
+            return Response({'error': 'Invalid quantity', 'items': invalid}, status=status.HTTP_400_BAD_REQUEST)
+
+        products = Product.objects.filter(id__in=cart.cart.keys()).only('id', 'title', 'price', 'category_id').order_by(
+            'id')
+        # Цена и название фиксируются в строках заказа по текущему состоянию товаров
+        lines = [(product, cart.cart[str(product.id)]['quantity']) for product in products]
+        # Товары, удаленные после добавления в корзину, не пропускаются молча: их остаток считается нулевым
+        found = {str(product.id) for product, _ in lines}
+        missing = [{'id': int(product_id), 'title': '', 'requested': line['quantity'], 'available': 0}
+                   for product_id, line in cart.cart.items() if product_id not in found]
+        try:
+            if missing:
+                raise OutOfStock(missing)
+            # Заказ создается только вместе со списанием остатков по всем строкам
+            with transaction.atomic():
+                reserve_stock((product.id, quantity) for product, quantity in lines)
+                order = Order.objects.create(
+                    user=request.user,
+                    total_cost=round(sum(product.price * quantity for product, quantity in lines), 2),
+                )
+                OrderItem.objects.bulk_create([
+                    OrderItem(order=order, product=product, category_id=product.category_id, title=product.title,
+                              price=round(product.price, 2), quantity=quantity)
+                    for product, quantity in lines
+                ])
+                # bulk_create не вызывает сигналы, заказ добавляется в статистику продаж здесь
+                record_order(order)
+        except OutOfStock as error:
+            return Response({'error': str(error), 'items': error.lines}, status=status.HTTP_409_CONFLICT)
         cart.clear()
         return Response({'orderId': order.id})
 
@@ -178,7 +219,7 @@ class OrderRetrieveAPIView(RetrieveAPIView):
     serializer_class = OrderSerializer
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).select_related('user')
+        return Order.objects.filter(user=self.request.user).select_related('user__profile').prefetch_related('items')
 
     def post(self, request, pk):
         order = Order.objects.get(id=pk)
@@ -207,12 +248,37 @@ class PaymentAPIView(APIView):
         return Response(data)
 
 
-class ProductRetrieveAPIView(RetrieveAPIView):
+class ProductRetrieveAPIView(ConditionalGetMixin, RetrieveAPIView):
     serializer_class = ProductDetailSerializer
     queryset = Product.objects.prefetch_related('images').all()
 
+    def get_etag(self, request, *args, **kwargs):
+        # ETag по версии товара: один запрос одной колонки вместо загрузки и сериализации карточки
+        version = Product.objects.filter(pk=kwargs['pk']).values_list('version', flat=True).first()
+        if version is None:
+            return None
+        return make_etag('product', kwargs['pk'], version, request.accepted_media_type)
+
+
+class ReviewAPIView(ConditionalGetMixin, ListAPIView):
+    """
+    GET - отзывы товара по страницам курсора (cursor, limit), sort=date (по умолчанию) или rating,
+    по убыванию или с sortType=inc по возрастанию. POST - новый отзыв
+    """
+    serializer_class = ReviewSerializer
+    pagination_class = ReviewPagination
 
-class ReviewAPIView(APIView):
+    def get_queryset(self):
+        return get_review_queryset(self.kwargs['pk'], self.request.query_params)
+
+    def get_etag(self, request, *args, **kwargs):
+        # Версия товара меняется при любом изменении его отзывов
+        version = Product.objects.filter(pk=kwargs['pk']).values_list('version', flat=True).first()
+        if version is None:
+            # Отзывы несуществующего товара: 404 без запроса страницы
+            raise NotFound
+        return make_etag('product-reviews', kwargs['pk'], version, request.accepted_media_type,
+                         request.META.get('QUERY_STRING', ''))
 
     def post(self, request, pk):
         print(request.data)
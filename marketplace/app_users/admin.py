@@ -1,17 +1,21 @@
 from django.contrib import admin
 
+from marketplace.admin import LargeTableAdminMixin
 from .models import User, Profile
 
 
 # Register your models here.
 
 @admin.register(User)
-class UserAdmin(admin.ModelAdmin):
+class UserAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ['name', 'username']
-
+    # Точное совпадение по уникальному индексу логина
+    search_fields = ['username__exact']
 
 
 @admin.register(Profile)
-class ProfileAdmin(admin.ModelAdmin):
-    list_display = ['fullName', 'email', ]
+class ProfileAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+    list_display = ['fullName', 'email', 'user']
+    list_select_related = ['user']
+    search_fields = ['user__username__exact']
 
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from marketplace.renditions import image_data
 # Подключаем модель user
 from .models import User, Profile
 
@@ -51,10 +52,7 @@ class ProfileAvatarSerializer(serializers.ModelSerializer):
     def get_avatar(self, obj):
         print(obj)
         if obj.avatar:
-            return {
-                'src': obj.avatar.url,
-                'alt': 'profile image'
-            }
+            return image_data(obj.avatar, 'profile image')
 
 class ProfileSerializer(serializers.ModelSerializer):
     class Meta:
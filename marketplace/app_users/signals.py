@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from marketplace.renditions import generate_field_renditions
+from .models import Profile
+
+
+@receiver(post_save, sender=Profile)
+def generate_avatar_renditions(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    generate_field_renditions(instance.avatar)
@@ -1,17 +1,16 @@
-from django.conf import settings
-
 from app_shop.models import Product
+from .storage import CartTooLarge, get_cart_storage
 
 
 class Cart(object):
-    """Объект корзины в сессии"""
+    """
+    Корзина текущего посетителя. Хранилище выбирается настройками CART_STORAGE и CART_ANONYMOUS_STORAGE:
+    сессия, таблица CartLine или подписанная cookie (cart.storage)
+    """
 
     def __init__(self, request):
-        self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        self.storage = get_cart_storage(request)
+        self.cart = self.storage.load()
 
     def __iter__(self):
         product_ids = self.cart.keys()
@@ -35,14 +34,25 @@ class Cart(object):
         return sum(item["quantity"] for item in self.cart.values())
 
     def add(self, product, quantity=1, override_quantity=False):
+        """Добавляет товар; если корзина не помещается в хранилище, откатывает изменение и бросает CartTooLarge"""
         product_id = str(product.id)
-        if product_id not in self.cart:
+        previous = self.cart.get(product_id)
+        if previous is not None:
+            previous = dict(previous)
+        else:
             self.cart[product_id] = {"quantity": 0, "price": float(product.price)}
         if override_quantity:
             self.cart[product_id]["quantity"] = quantity
         else:
             self.cart[product_id]["quantity"] += quantity
-        self.save()
+        try:
+            self.storage.save_line(self.cart, product_id)
+        except CartTooLarge:
+            if previous is None:
+                del self.cart[product_id]
+            else:
+                self.cart[product_id] = previous
+            raise
 
     def remove(self, product, quantity=1):
         product_id = str(product.id)
@@ -51,7 +61,7 @@ class Cart(object):
                 del self.cart[product_id]
             else:
                 self.cart[product_id]["quantity"] -= quantity
-            self.save()
+            self.storage.save_line(self.cart, product_id)
 
     def get_total_price(self):
         return round(sum(
@@ -59,10 +69,8 @@ class Cart(object):
         ), 2)
 
     def clear(self):
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
+        self.cart = {}
+        self.storage.clear()
 
     def save(self):
-        self.session[settings.CART_SESSION_ID] = self.cart
-        self.session.modified = True
-
+        self.storage.save(self.cart)
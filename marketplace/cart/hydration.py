@@ -0,0 +1,38 @@
+from app_shop.models import Product
+from marketplace.renditions import image_data
+
+
+def hydrate_cart(cart):
+    """
+    Собирает строки корзины в формате карточки товара для API.
+    Все строки загружаются фиксированным числом запросов независимо от размера корзины:
+    товары, их изображения и теги. Рейтинг и количество отзывов хранятся в самом товаре.
+    """
+    products = Product.objects.filter(id__in=cart.cart.keys()).prefetch_related('images', 'tags')
+    products = {str(product.id): product for product in products}
+
+    cart_items = []
+    for product_id in sorted(products):
+        product = products[product_id]
+        item = cart.cart[product_id]
+        # Как и Cart.__iter__, актуализируем цену строки, чтобы итог заказа считался по текущим ценам
+        item["price"] = float(product.price)
+        cart_items.append(
+            {
+                "id": product.id,
+                "category": product.category_id,
+                "price": item["price"],
+                "count": item["quantity"],
+                "date": product.date.strftime("%a %b %d %Y %H:%M:%S GMT%z (%Z)"),
+                "title": product.title,
+                "description": product.short_description(),
+                "freeDelivery": product.free_delivery,
+                "images": [image_data(image.image, product.title) for image in product.images.all()],
+                "tags": [
+                    {"id": tag.id, "name": tag.name} for tag in product.tags.all()
+                ],
+                "reviews": product.reviews_count(),
+                "rating": product.average_rating(),
+            }
+        )
+    return cart_items
@@ -0,0 +1,46 @@
+from datetime import timedelta
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cart.models import CartLine
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет анонимные корзины из CartLine, не менявшиеся дольше CART_COOKIE_AGE, и истекшие сессии. '
+        'Строки удаляются пачками, чтобы не блокировать таблицы надолго'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--keep-sessions', action='store_true', help='не удалять истекшие сессии')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        expired = timezone.now() - timedelta(seconds=settings.CART_COOKIE_AGE)
+        lines = self.delete_in_batches(CartLine.objects.filter(user__isnull=True, updated_at__lt=expired), batch_size)
+        self.stdout.write(self.style.SUCCESS(f'Deleted {lines} anonymous cart lines'))
+
+        if options['keep_sessions']:
+            return
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if hasattr(store, 'get_model_class'):
+            sessions = self.delete_in_batches(
+                store.get_model_class().objects.filter(expire_date__lt=timezone.now()), batch_size)
+            self.stdout.write(self.style.SUCCESS(f'Deleted {sessions} expired sessions'))
+        else:
+            # Сессии не в БД: файловые и кеш-бэкенды очищаются своим способом
+            store.clear_expired()
+            self.stdout.write(self.style.SUCCESS('Cleared expired sessions'))
+
+    @staticmethod
+    def delete_in_batches(queryset, batch_size):
+        deleted = 0
+        while True:
+            keys = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            deleted += queryset.model._default_manager.filter(pk__in=keys).delete()[0]
@@ -0,0 +1,34 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+
+class CartMiddleware:
+    """
+    Дает хранилищам корзины (cart.storage) записать cookie в ответ; должен стоять после AuthenticationMiddleware.
+    Поддерживает async цепочку: под ASGI запросы без корзины проходят без перехода в пул потоков
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        self.finalize(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if getattr(request, '_cart_storages', None):
+            await sync_to_async(self.finalize)(request, response)
+        return response
+
+    @staticmethod
+    def finalize(request, response):
+        for storage in getattr(request, '_cart_storages', {}).values():
+            storage.finalize(response)
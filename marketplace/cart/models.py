@@ -1,4 +1,33 @@
+from django.db import models
+from django.db.models import Q
 
-# Create your models here.
+from app_shop.models import Product
+from app_users.models import User
 
 
+class CartLine(models.Model):
+    """
+    Строка корзины для cart.storage.DatabaseCartStorage.
+    Корзина принадлежит пользователю или анонимному посетителю, которого определяет токен из cookie
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='cart_lines')
+    token = models.CharField(max_length=64, null=True, blank=True)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cart_lines')
+    quantity = models.PositiveIntegerField()
+    price = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], condition=Q(user__isnull=False),
+                                    name='unique_cart_line_user'),
+            models.UniqueConstraint(fields=['token', 'product'], condition=Q(token__isnull=False),
+                                    name='unique_cart_line_token'),
+        ]
+        indexes = [
+            # Поиск устаревших анонимных корзин командой clear_carts
+            models.Index(fields=['updated_at'], condition=Q(user__isnull=True), name='cart_line_anonymous_idx'),
+        ]
+
+    def __str__(self):
+        return f'Cart line: {self.product_id} x {self.quantity}'
@@ -0,0 +1,208 @@
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import CartLine
+
+
+class CartTooLarge(Exception):
+    """Корзина не помещается в хранилище (например, в cookie), изменение не сохранено"""
+
+
+class BaseCartStorage:
+    """
+    Хранилище корзины. Корзина - словарь {str(product_id): {'quantity': .., 'price': ..}}.
+    save_line() сохраняет изменение одной строки, save() - корзину целиком.
+    Хранилища, которым нужно записать cookie, делают это в finalize(), который вызывает cart.middleware.CartMiddleware
+    """
+    # Корзина привязана к пользователю, а не к браузеру: при входе в нее переносится анонимная корзина
+    per_user = False
+
+    def __init__(self, request, user=None):
+        self.request = request
+        self.user = user
+
+    def load(self):
+        raise NotImplementedError
+
+    def save_line(self, cart, product_id):
+        self.save(cart)
+
+    def save(self, cart):
+        raise NotImplementedError
+
+    def clear(self):
+        self.save({})
+
+    def finalize(self, response):
+        """Записывает в ответ cookie, если это нужно хранилищу"""
+
+
+class SessionCartStorage(BaseCartStorage):
+    """Корзина в сессии Django: каждое изменение перезаписывает сессию целиком"""
+
+    def load(self):
+        return self.request.session.get(settings.CART_SESSION_ID) or {}
+
+    def save(self, cart):
+        self.request.session[settings.CART_SESSION_ID] = cart
+        self.request.session.modified = True
+
+    def clear(self):
+        self.request.session.pop(settings.CART_SESSION_ID, None)
+
+
+class DatabaseCartStorage(BaseCartStorage):
+    """
+    Корзина в таблице CartLine: изменение количества обновляет только одну строку.
+    Анонимная корзина определяется токеном из cookie CART_TOKEN_COOKIE_NAME, сессия для нее не нужна
+    """
+    per_user = True
+
+    def __init__(self, request, user=None):
+        super().__init__(request, user)
+        self.token = None if user else request.COOKIES.get(settings.CART_TOKEN_COOKIE_NAME)
+        self.token_created = False
+
+    @property
+    def owner(self):
+        if self.user:
+            return {'user': self.user}
+        if self.token is None:
+            self.token = secrets.token_urlsafe(32)
+            self.token_created = True
+        return {'token': self.token}
+
+    def load(self):
+        if not self.user and self.token is None:
+            return {}
+        lines = CartLine.objects.filter(**self.owner).values_list('product_id', 'quantity', 'price')
+        return {str(product_id): {'quantity': quantity, 'price': price} for product_id, quantity, price in lines}
+
+    def save_line(self, cart, product_id):
+        lines = CartLine.objects.filter(**self.owner, product_id=product_id)
+        line = cart.get(product_id)
+        if line is None:
+            lines.delete()
+            return
+        values = {'quantity': line['quantity'], 'price': line['price'], 'updated_at': timezone.now()}
+        if lines.update(**values):
+            return
+        try:
+            with transaction.atomic():
+                CartLine.objects.create(**self.owner, product_id=product_id, **values)
+        except IntegrityError:
+            # Строку успел создать параллельный запрос
+            lines.update(**values)
+
+    def save(self, cart):
+        with transaction.atomic():
+            CartLine.objects.filter(**self.owner).exclude(product_id__in=list(cart)).delete()
+            for product_id in cart:
+                self.save_line(cart, product_id)
+
+    def clear(self):
+        if self.user or self.token is not None:
+            CartLine.objects.filter(**self.owner).delete()
+
+    def finalize(self, response):
+        if self.token_created:
+            response.set_cookie(settings.CART_TOKEN_COOKIE_NAME, self.token, max_age=settings.CART_COOKIE_AGE,
+                                secure=settings.SESSION_COOKIE_SECURE, httponly=True, samesite='Lax')
+
+
+class CookieCartStorage(BaseCartStorage):
+    """
+    Корзина в подписанной cookie, без записей в БД. Подходит для небольших анонимных корзин:
+    браузеры молча отбрасывают cookie больше ~4 КБ, поэтому корзину длиннее CART_COOKIE_MAX_SIZE
+    save() не принимает и бросает CartTooLarge
+    """
+    salt = 'cart.storage.CookieCartStorage'
+
+    def __init__(self, request, user=None):
+        super().__init__(request, user)
+        self.modified = False
+        self.cart = {}
+        self.value = ''
+        value = request.COOKIES.get(settings.CART_COOKIE_NAME)
+        if value:
+            try:
+                lines = signing.loads(value, salt=self.salt, max_age=settings.CART_COOKIE_AGE)
+                self.cart = {product_id: {'quantity': quantity, 'price': price}
+                             for product_id, (quantity, price) in lines.items()}
+            except (signing.BadSignature, ValueError, TypeError, AttributeError):
+                self.modified = True
+
+    def load(self):
+        return {product_id: dict(line) for product_id, line in self.cart.items()}
+
+    def save(self, cart):
+        value = ''
+        if cart:
+            lines = {product_id: [line['quantity'], line['price']] for product_id, line in cart.items()}
+            value = signing.dumps(lines, salt=self.salt, compress=True)
+            if len(value) > settings.CART_COOKIE_MAX_SIZE:
+                raise CartTooLarge
+        self.cart = {product_id: dict(line) for product_id, line in cart.items()}
+        self.value = value
+        self.modified = True
+
+    def finalize(self, response):
+        if not self.modified:
+            return
+        if not self.value:
+            response.delete_cookie(settings.CART_COOKIE_NAME, samesite='Lax')
+            return
+        response.set_cookie(settings.CART_COOKIE_NAME, self.value,
+                            max_age=settings.CART_COOKIE_AGE, secure=settings.SESSION_COOKIE_SECURE, httponly=True,
+                            samesite='Lax')
+
+
+def get_user(request):
+    user = getattr(request, 'user', None)
+    return user if user is not None and user.is_authenticated else None
+
+
+def get_cart_storage(request, anonymous=None):
+    """
+    Хранилище корзины для запроса: CART_ANONYMOUS_STORAGE для анонимных посетителей (если задано),
+    иначе CART_STORAGE. Хранилище создается один раз на запрос, чтобы CartMiddleware мог записать cookie
+    """
+    # DRF Request проксирует атрибуты, но устанавливать их нужно на исходный HttpRequest
+    request = getattr(request, '_request', request)
+    if anonymous is None:
+        anonymous = get_user(request) is None
+    storages = getattr(request, '_cart_storages', None)
+    if storages is None:
+        storages = request._cart_storages = {}
+    if anonymous not in storages:
+        path = settings.CART_STORAGE
+        if anonymous:
+            path = getattr(settings, 'CART_ANONYMOUS_STORAGE', None) or path
+        storages[anonymous] = import_string(path)(request, None if anonymous else get_user(request))
+    return storages[anonymous]
+
+
+def merge_anonymous_cart(request):
+    """Переносит анонимную корзину в корзину вошедшего пользователя, количества одинаковых товаров складываются"""
+    anonymous = get_cart_storage(request, anonymous=True)
+    storage = get_cart_storage(request, anonymous=False)
+    if type(anonymous) is type(storage) and not storage.per_user:
+        # Корзина хранится в браузере (сессии или cookie) и остается той же после входа
+        return
+    lines = anonymous.load()
+    if not lines:
+        return
+    cart = storage.load()
+    with transaction.atomic():
+        for product_id, line in lines.items():
+            if product_id in cart:
+                cart[product_id]['quantity'] += line['quantity']
+            else:
+                cart[product_id] = line
+            storage.save_line(cart, product_id)
+        anonymous.clear()
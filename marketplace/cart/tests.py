@@ -1 +1,168 @@
-# Create your tests here.
+import io
+import json
+from datetime import timedelta
+
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from app_shop.models import Category, Product, ProductImage, Tag
+from app_users.models import User
+from .cart import Cart
+from .hydration import hydrate_cart
+from .models import CartLine
+
+
+class FakeRequest:
+    def __init__(self, session):
+        self.session = session
+
+
+class CartHydrationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='category')
+        tag = Tag.objects.create(name='tag')
+        cls.products = []
+        for index in range(30):
+            product = Product.objects.create(category=category, price=10 + index, quantity=5, title=f'product {index}')
+            ProductImage.objects.create(product=product, image=f'products/product_{product.id}/images/1.png')
+            tag.product.add(product)
+            cls.products.append(product)
+
+    def make_cart(self, size):
+        cart = Cart(FakeRequest(SessionStore()))
+        for product in self.products[:size]:
+            cart.add(product, 2)
+        return cart
+
+    def test_hydration_query_count_does_not_depend_on_cart_size(self):
+        for size in (1, 30):
+            cart = self.make_cart(size)
+            # товары, изображения, теги
+            with self.assertNumQueries(3):
+                items = hydrate_cart(cart)
+            self.assertEqual(len(items), size)
+
+    def test_hydrated_item_shape(self):
+        cart = self.make_cart(1)
+        item = hydrate_cart(cart)[0]
+        product = self.products[0]
+        self.assertEqual(item['id'], product.id)
+        self.assertEqual(item['count'], 2)
+        self.assertEqual(item['price'], float(product.price))
+        directory = f'/media/products/product_{product.id}/images'
+        self.assertEqual(item['images'], [{
+            'src': f'{directory}/1.png',
+            'alt': product.title,
+            'srcset': ', '.join(f'{directory}/renditions/1.png.{width}w.webp {width}w' for width in (200, 400, 800)),
+            'fallbackSrcset': ', '.join(f'{directory}/renditions/1.png.{width}w.png {width}w'
+                                        for width in (200, 400, 800)),
+        }])
+        self.assertEqual(item['tags'], [{'id': product.tags.get().id, 'name': 'tag'}])
+        self.assertEqual(item['reviews'], 0)
+        self.assertIsNone(item['rating'])
+
+    def test_basket_endpoint_query_count_is_constant(self):
+        url = reverse('basket')
+        counts = []
+        for size in (1, 30):
+            client = Client()
+            for product in self.products[:size]:
+                client.post(url, {'id': product.id, 'count': 1})
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(url)
+            self.assertEqual(len(response.json()), size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class CartStorageTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(title='category')
+        cls.first = Product.objects.create(category=category, price=10, quantity=5, title='first')
+        cls.second = Product.objects.create(category=category, price=20, quantity=5, title='second')
+        cls.user = User.objects.create_user(username='buyer', password='password', name='buyer')
+
+    def add(self, product, count=1):
+        return self.client.post(reverse('basket'), {'id': product.id, 'count': count})
+
+    def basket(self):
+        return {item['id']: item['count'] for item in self.client.get(reverse('basket')).json()}
+
+    def sign_in(self):
+        data = json.dumps({'username': 'buyer', 'password': 'password'})
+        self.client.post(reverse('sign-in'), data, content_type='application/x-www-form-urlencoded')
+
+    @override_settings(CART_STORAGE='cart.storage.DatabaseCartStorage')
+    def test_database_storage_writes_only_changed_line(self):
+        self.add(self.first)
+        self.add(self.second)
+        with CaptureQueriesContext(connection) as queries:
+            self.add(self.first, 2)
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 1)
+        self.assertIn('cart_cartline', writes[0])
+        self.assertEqual(self.basket(), {self.first.id: 3, self.second.id: 1})
+        self.assertNotIn('sessionid', self.client.cookies)
+
+    @override_settings(CART_STORAGE='cart.storage.CookieCartStorage')
+    def test_cookie_storage_keeps_cart_in_signed_cookie(self):
+        self.add(self.first, 2)
+        self.assertEqual(self.basket(), {self.first.id: 2})
+        self.assertFalse(CartLine.objects.exists())
+
+        self.client.cookies['cart'] = self.client.cookies['cart'].value[:-1] + 'x'
+        self.assertEqual(self.basket(), {})
+
+    @override_settings(CART_STORAGE='cart.storage.CookieCartStorage')
+    def test_cookie_storage_rejects_cart_over_size_limit(self):
+        self.add(self.first)
+        value = self.client.cookies['cart'].value
+        with self.settings(CART_COOKIE_MAX_SIZE=len(value)):
+            response = self.add(self.second)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'error': 'Cart is too large'})
+        self.assertEqual(self.client.cookies['cart'].value, value)
+        self.assertEqual(self.basket(), {self.first.id: 1})
+
+    @override_settings(CART_STORAGE='cart.storage.DatabaseCartStorage',
+                       CART_ANONYMOUS_STORAGE='cart.storage.CookieCartStorage')
+    def test_anonymous_cart_is_merged_on_login(self):
+        CartLine.objects.create(user=self.user, product=self.first, quantity=1, price=10)
+        self.add(self.first, 2)
+        self.add(self.second)
+
+        self.sign_in()
+        self.assertEqual(self.basket(), {self.first.id: 3, self.second.id: 1})
+        self.assertEqual(self.client.cookies['cart'].value, '')
+
+    @override_settings(CART_STORAGE='cart.storage.DatabaseCartStorage')
+    def test_database_anonymous_cart_is_merged_on_login(self):
+        self.add(self.first, 2)
+        self.sign_in()
+        self.assertEqual(self.basket(), {self.first.id: 2})
+        self.assertEqual(list(CartLine.objects.values_list('user', 'token')), [(self.user.id, None)])
+
+    def test_clear_carts_removes_expired_anonymous_lines_and_sessions(self):
+        old = timezone.now() - timedelta(days=60)
+        CartLine.objects.create(token='old', product=self.first, quantity=1, price=10)
+        CartLine.objects.create(token='fresh', product=self.first, quantity=1, price=10)
+        CartLine.objects.create(user=self.user, product=self.first, quantity=1, price=10)
+        CartLine.objects.filter(token='old').update(updated_at=old)
+        CartLine.objects.filter(user=self.user).update(updated_at=old)
+        expired = SessionStore()
+        expired.set_expiry(-1)
+        expired.save()
+        active = SessionStore()
+        active.save()
+
+        call_command('clear_carts', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(set(CartLine.objects.values_list('token', flat=True)), {'fresh', None})
+        self.assertFalse(SessionStore().exists(expired.session_key))
+        self.assertTrue(SessionStore().exists(active.session_key))
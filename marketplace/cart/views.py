@@ -5,42 +5,17 @@ from rest_framework.views import APIView
 
 from app_shop.models import Product
 from .cart import Cart
+from .hydration import hydrate_cart
+from .storage import CartTooLarge
 
 
 class CartAPIView(APIView):
     permission_classes = [AllowAny]
     """APIView для корзины, реализация методов get, post и delete"""
 
-    def get_cart_items(self, cart):
-        cart_items = []
-        for item in cart:
-            product = Product.objects.get(id=item["product_id"])
-            cart_items.append(
-                {
-                    "id": product.id,
-                    "category": product.category.id,
-                    "price": float(item["price"]),
-                    "count": item["quantity"],
-                    "date": product.date.strftime("%a %b %d %Y %H:%M:%S GMT%z (%Z)"),
-                    "title": product.title,
-                    "description": product.short_description(),
-                    "freeDelivery": product.free_delivery,
-                    "images": [
-                        {"src": image.image.url, "alt": product.title}
-                        for image in product.images.all()
-                    ],
-                    "tags": [
-                        {"id": tag.id, "name": tag.name} for tag in product.tags.all()
-                    ],
-                    "reviews": product.reviews_count(),
-                    "rating": product.average_rating(),
-                }
-            )
-        return cart_items
-
     def get(self, request):
         cart = Cart(request)
-        cart_items = self.get_cart_items(cart)
+        cart_items = hydrate_cart(cart)
         return Response(cart_items)
 
     def post(self, request):
@@ -53,8 +28,11 @@ class CartAPIView(APIView):
             return Response(status=status.HTTP_404_NOT_FOUND)
 
         cart = Cart(request)
-        cart.add(product, quantity)
-        cart_items = self.get_cart_items(cart)
+        try:
+            cart.add(product, quantity)
+        except CartTooLarge:
+            return Response({'error': 'Cart is too large'}, status=status.HTTP_400_BAD_REQUEST)
+        cart_items = hydrate_cart(cart)
         return Response(cart_items)
 
     def delete(self, request):
@@ -68,5 +46,5 @@ class CartAPIView(APIView):
 
         cart = Cart(request)
         cart.remove(product, quantity)
-        cart_items = self.get_cart_items(cart)
+        cart_items = hydrate_cart(cart)
         return Response(cart_items)
@@ -0,0 +1,50 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, QuerySet
+from django.utils.functional import cached_property
+
+
+def get_table_estimate(model, using='default'):
+    """
+    Приблизительное количество строк таблицы без COUNT(*): статистика pg_class.reltuples в PostgreSQL,
+    иначе наибольший целочисленный первичный ключ (чтение края индекса). None, если оценить нельзя
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1: таблица еще не анализировалась
+        if row and row[0] >= 0:
+            return row[0]
+    if model._meta.pk.get_internal_type() in ('AutoField', 'BigAutoField', 'SmallAutoField'):
+        return model._default_manager.using(using).aggregate(last=Max('pk'))['last'] or 0
+    return None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator списков админки для больших таблиц. Для списка без фильтров и поиска берется оценка
+    get_table_estimate, если она больше ADMIN_EXACT_COUNT_LIMIT. Остальные списки считаются COUNT по подзапросу
+    с LIMIT ADMIN_EXACT_COUNT_LIMIT + 1: найденные сверх этого строки не попадают в номера страниц.
+    Оценка может быть больше реального количества, последние страницы тогда пустые
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        limit = getattr(settings, 'ADMIN_EXACT_COUNT_LIMIT', 10000)
+        if not queryset.query.where and not queryset.query.extra_tables:
+            estimate = get_table_estimate(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+        return queryset.order_by()[:limit + 1].count()
+
+
+class LargeTableAdminMixin:
+    """Список без точного COUNT(*) таблицы: EstimatedCountPaginator и без второго подсчета для фильтров"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,218 @@
+import logging
+import math
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .routers import get_routing_state, routing_context
+
+logger = logging.getLogger('marketplace.sql')
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+SPACES_RE = re.compile(r'\s+')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def normalize_sql(sql):
+    """
+    Форма запроса без конкретных значений: литералы и параметры заменяются на ?, списки IN (...) схлопываются,
+    поэтому запросы одного цикла по объектам получают одинаковую форму
+    """
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return SPACES_RE.sub(' ', sql).strip()
+
+
+class QueryRecorder:
+    """Считает запросы, суммарное время в БД, повторы форм запросов и запросы дольше slow_threshold секунд"""
+
+    def __init__(self, slow_threshold=None):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.slow_threshold = slow_threshold
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.duration += duration
+            self.count += 1
+            shape = normalize_sql(sql)
+            self.shapes[shape] += 1
+            if self.slow_threshold is not None and duration >= self.slow_threshold:
+                self.slow.append((shape, duration))
+
+    def repeated(self, threshold):
+        """Формы запросов, выполненные больше threshold раз, от самых частых"""
+        return [(sql, count) for sql, count in self.shapes.most_common() if count > threshold]
+
+
+_recorder = ContextVar('sql_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Обертка execute_wrapper, постоянно установленная на соединения. Записывает запрос в QueryRecorder текущего
+    HTTP запроса из ContextVar, поэтому под ASGI видит запросы из потоков sync_to_async и задач asyncio.gather:
+    соединения привязаны к потоку, а ContextVar копируется в них из запроса
+    """
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_record_query(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class SQLInstrumentationMiddleware:
+    """
+    Инструментирование запросов к БД на каждый HTTP запрос, включается настройкой SQL_INSTRUMENTATION.
+    Добавляет в ответ заголовки Server-Timing (время в БД) и X-DB-Queries (число запросов),
+    а если одна форма запроса повторилась больше SQL_N_PLUS_ONE_THRESHOLD раз или запрос шел дольше
+    SQL_SLOW_QUERY_MS - пишет предупреждение в логгер marketplace.sql с именем view.
+    Поддерживает async цепочку: под ASGI запрос не переходит в пул потоков ради этого middleware
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'SQL_N_PLUS_ONE_THRESHOLD', 5)
+        slow_query_ms = getattr(settings, 'SQL_SLOW_QUERY_MS', None)
+        self.slow_threshold = slow_query_ms / 1000 if slow_query_ms is not None else None
+        # Уже открытые соединения этого потока получают обертку сразу, остальные - при подключении
+        for connection in connections.all(initialized_only=True):
+            install_record_query(connection)
+        connection_created.connect(install_record_query, dispatch_uid='marketplace.sql.record_query')
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with self.record() as recorder:
+            response = self.get_response(request)
+        return self.finalize(request, response, recorder)
+
+    async def __acall__(self, request):
+        with self.record() as recorder:
+            response = await self.get_response(request)
+        return self.finalize(request, response, recorder)
+
+    @contextmanager
+    def record(self):
+        recorder = QueryRecorder(self.slow_threshold)
+        token = _recorder.set(recorder)
+        try:
+            yield recorder
+        finally:
+            _recorder.reset(token)
+
+    def finalize(self, request, response, recorder):
+        duration = recorder.duration * 1000
+        response['Server-Timing'] = f'db;dur={duration:.2f};desc="{recorder.count} queries"'
+        response['X-DB-Queries'] = str(recorder.count)
+
+        view = getattr(request, 'sql_instrumentation_view', None)
+        extra = {
+            'view': view,
+            'path': request.path,
+            'method': request.method,
+            'status_code': response.status_code,
+            'db_queries': recorder.count,
+            'db_duration_ms': round(duration, 2),
+        }
+        repeated = recorder.repeated(self.threshold)
+        if repeated:
+            logger.warning(
+                'Possible N+1 in %s: %s', view or request.path,
+                '; '.join(f'{count}x {sql}' for sql, count in repeated),
+                extra={**extra, 'repeated_queries': [{'sql': sql, 'count': count} for sql, count in repeated]},
+            )
+        if recorder.slow:
+            logger.warning(
+                'Slow queries in %s: %s', view or request.path,
+                '; '.join(f'{duration * 1000:.2f}ms {sql}' for sql, duration in recorder.slow),
+                extra={**extra, 'slow_queries': [{'sql': sql, 'duration_ms': round(duration * 1000, 2)}
+                                                 for sql, duration in recorder.slow]},
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Для class-based view (в том числе DRF) в лог попадает класс, а не функция-обертка as_view()
+        view = getattr(view_func, 'view_class', view_func)
+        request.sql_instrumentation_view = f'{view.__module__}.{view.__qualname__}'
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Состояние marketplace.routers.PrimaryReplicaRouter на время запроса: GET/HEAD/OPTIONS к view с use_replica
+    читают модели каталога из реплики, пока в запросе не было записи. После записи ответ получает cookie
+    DATABASE_REPLICA_PIN_COOKIE, и следующие DATABASE_REPLICA_PIN_SECONDS секунд запросы клиента читают из основной
+    БД, чтобы видеть свои изменения несмотря на отставание реплики. Поддерживает async цепочку
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with routing_context() as state:
+            state.pinned = self.is_pinned(request)
+            response = self.get_response(request)
+        return self.pin(request, response, state)
+
+    async def __acall__(self, request):
+        with routing_context() as state:
+            state.pinned = self.is_pinned(request)
+            response = await self.get_response(request)
+        return self.pin(request, response, state)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = get_routing_state()
+        if state is not None and request.method in SAFE_METHODS and getattr(view_func, 'use_replica', False):
+            state.replica = True
+
+    @staticmethod
+    def is_pinned(request):
+        try:
+            return float(request.COOKIES[settings.DATABASE_REPLICA_PIN_COOKIE]) > time.time()
+        except (AttributeError, KeyError, ValueError):
+            return False
+
+    @staticmethod
+    def pin(request, response, state):
+        """Продлевает чтение из основной БД клиенту, чей запрос что-то записал"""
+        seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 0)
+        if state.wrote and seconds and getattr(settings, 'DATABASE_REPLICA', None):
+            response.set_cookie(settings.DATABASE_REPLICA_PIN_COOKIE, str(math.ceil(time.time() + seconds)),
+                                max_age=seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,173 @@
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, Http404
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('marketplace.renditions')
+
+# Производные изображения лежат рядом с оригиналом в папке renditions:
+# products/product_1/images/photo.jpg -> products/product_1/images/renditions/photo.jpg.400w.webp
+RENDITIONS_DIR = 'renditions'
+RENDITION_RE = re.compile(rf'^(?P<directory>(?:.+/)?){RENDITIONS_DIR}/(?P<filename>[^/]+)\.(?P<width>\d+)w\.'
+                          rf'(?P<extension>webp|jpg|png)$')
+PIL_FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG', 'png': 'PNG'}
+
+
+def get_widths():
+    return tuple(getattr(settings, 'IMAGE_RENDITION_WIDTHS', (200, 400, 800)))
+
+
+def get_fallback_extension(name):
+    """Формат производных для браузеров без WebP: PNG для изображений с прозрачностью, иначе JPEG"""
+    return 'png' if os.path.splitext(name)[1].lower() in ('.png', '.gif') else 'jpg'
+
+
+def get_rendition_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, RENDITIONS_DIR, f'{filename}.{width}w.{extension}')
+
+
+def get_rendition_names(name):
+    """[(ширина, расширение, имя файла)] всех производных изображения"""
+    return [(width, extension, get_rendition_name(name, width, extension))
+            for extension in ('webp', get_fallback_extension(name)) for width in get_widths()]
+
+
+def parse_rendition_name(name):
+    """(имя оригинала, ширина, расширение) для имени производного изображения или None, если такого быть не может"""
+    match = RENDITION_RE.match(name)
+    if match is None:
+        return None
+    original = match['directory'] + match['filename']
+    width, extension = int(match['width']), match['extension']
+    if width not in get_widths() or extension not in ('webp', get_fallback_extension(original)):
+        return None
+    return original, width, extension
+
+
+def image_data(image, alt, storage=None):
+    """
+    Изображение для API: src - оригинал, srcset - производные в WebP, fallbackSrcset - в формате оригинала.
+    image - FieldFile или имя файла в storage
+    """
+    name = getattr(image, 'name', image) or ''
+    if not name:
+        return {'src': '', 'alt': alt, 'srcset': '', 'fallbackSrcset': ''}
+    storage = getattr(image, 'storage', None) or storage or default_storage
+    srcsets = {}
+    for width, extension, rendition in get_rendition_names(name):
+        srcsets.setdefault(extension == 'webp', []).append(f'{storage.url(rendition)} {width}w')
+    return {
+        'src': storage.url(name),
+        'alt': alt,
+        'srcset': ', '.join(srcsets[True]),
+        'fallbackSrcset': ', '.join(srcsets[False]),
+    }
+
+
+def generate_renditions(name, storage=None):
+    """
+    Создает недостающие и устаревшие (старше оригинала) производные изображения.
+    Оригинал открывается один раз, возвращается количество созданных файлов
+    """
+    storage = storage or default_storage
+    missing = [(width, extension, rendition) for width, extension, rendition in get_rendition_names(name)
+               if not is_fresh(storage, rendition, name)]
+    if not missing:
+        return 0
+    try:
+        with storage.open(name, 'rb') as original:
+            image = Image.open(original)
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+        for width, extension, rendition in missing:
+            content = render(image, width, extension)
+            if storage.exists(rendition):
+                storage.delete(rendition)
+            storage.save(rendition, ContentFile(content))
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.warning('Cannot generate renditions for %s: %s', name, error)
+        return 0
+    return len(missing)
+
+
+def is_fresh(storage, rendition, original):
+    if not storage.exists(rendition):
+        return False
+    try:
+        return storage.get_modified_time(rendition) >= storage.get_modified_time(original)
+    except (NotImplementedError, OSError):
+        return True
+
+
+def render(image, width, extension):
+    """Уменьшает изображение до ширины width (без увеличения) и кодирует в нужный формат"""
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    if extension == 'jpg':
+        if has_alpha:
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+    else:
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    quality = getattr(settings, 'IMAGE_RENDITION_QUALITY', 80)
+    options = {
+        'webp': {'quality': quality, 'method': 4},
+        'jpg': {'quality': quality, 'optimize': True, 'progressive': True},
+        'png': {'optimize': True},
+    }[extension]
+    buffer = BytesIO()
+    image.save(buffer, PIL_FORMATS[extension], **options)
+    return buffer.getvalue()
+
+
+def generate_field_renditions(field_file):
+    """
+    Для обработчиков post_save: производные загруженного изображения создаются после фиксации транзакции.
+    Если файла оригинала нет, производные будут созданы при первом запросе
+    """
+    if not field_file:
+        return
+    name, storage = field_file.name, field_file.storage
+
+    def generate():
+        if storage.exists(name):
+            generate_renditions(name, storage)
+
+    transaction.on_commit(generate, robust=True)
+
+
+def serve_rendition(request, path):
+    """
+    Отдает производное изображение из MEDIA_ROOT, при первом запросе создавая его из оригинала.
+    Веб-сервер отдает уже созданные файлы сам и передает в Django только отсутствующие
+    """
+    parsed = parse_rendition_name(path)
+    if parsed is None:
+        raise Http404
+    if not default_storage.exists(path):
+        original = parsed[0]
+        if not default_storage.exists(original):
+            raise Http404
+        generate_renditions(original)
+        if not default_storage.exists(path):
+            raise Http404
+    response = FileResponse(default_storage.open(path, 'rb'), content_type=mimetypes.guess_type(path)[0])
+    response['Cache-Control'] = 'public, max-age=604800'
+    return response
@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_routing_state = ContextVar('db_routing_state', default=None)
+
+
+class RoutingState:
+    """
+    Состояние маршрутизации одного HTTP запроса: можно ли читать из реплики, закреплен ли запрос за основной БД
+    (была запись или недавняя запись того же клиента) и была ли запись в этом запросе
+    """
+
+    def __init__(self):
+        self.replica = False
+        self.pinned = False
+        self.wrote = False
+
+
+@contextmanager
+def routing_context():
+    """
+    Состояние маршрутизации на время запроса. Хранится изменяемым объектом в ContextVar, поэтому отметка о записи
+    видна и из потоков sync_to_async, и из задач asyncio.gather того же запроса
+    """
+    state = RoutingState()
+    token = _routing_state.set(state)
+    try:
+        yield state
+    finally:
+        _routing_state.reset(token)
+
+
+def get_routing_state():
+    return _routing_state.get()
+
+
+def use_replica(view_func):
+    """Помечает view, чьи GET/HEAD запросы могут читать из реплики (аналогично csrf_exempt)"""
+    view_func.use_replica = True
+    return view_func
+
+
+class PrimaryReplicaRouter:
+    """
+    Запись всегда в основную БД. Чтение моделей DATABASE_REPLICA_APPS идет в реплику DATABASE_REPLICA только внутри
+    запроса, для которого ReplicaRoutingMiddleware разрешил реплику, до первой записи (read-your-writes), вне окна
+    после записи того же клиента и вне транзакций основной БД. Вне HTTP запросов (команды, shell) все читается
+    из основной БД
+    """
+
+    def db_for_read(self, model, **hints):
+        state = get_routing_state()
+        replica = getattr(settings, 'DATABASE_REPLICA', None)
+        if (state is not None and state.replica and not state.pinned and replica
+                and model._meta.app_label in getattr(settings, 'DATABASE_REPLICA_APPS', ())
+                and not connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = get_routing_state()
+        # Закрепляет за основной БД только запись моделей, читаемых из реплики: сессии, корзины и кеш в БД
+        # (DatabaseCache пишет статистику и версии витрины на каждый GET) реплику не затрагивают
+        if state is not None and model._meta.app_label in getattr(settings, 'DATABASE_REPLICA_APPS', ()):
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика содержит те же строки, что основная БД
+        aliases = {DEFAULT_DB_ALIAS, getattr(settings, 'DATABASE_REPLICA', None)}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
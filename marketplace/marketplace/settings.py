@@ -52,11 +52,14 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'app_users.User'
 
 MIDDLEWARE = [
+    'marketplace.middleware.SQLInstrumentationMiddleware',
+    'marketplace.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'cart.middleware.CartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -86,12 +89,38 @@ WSGI_APPLICATION = 'marketplace.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Подключения задаются переменными окружения DB_ENGINE, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT,
+# по умолчанию - файл SQLite. Реплика для чтения каталога (alias replica) подключается, если задана DB_REPLICA_NAME,
+# остальные параметры DB_REPLICA_* по умолчанию берутся у основной БД.
+# DB_CONN_MAX_AGE - время жизни соединения в секундах (0 - закрывать после запроса, none - без ограничения),
+# DB_CONN_HEALTH_CHECKS=0 отключает проверку постоянного соединения перед повторным использованием
+DB_CONN_MAX_AGE = os.getenv('DB_CONN_MAX_AGE', '0')
+
+
+def get_database(prefix, defaults):
+    database = {key: os.getenv(f'{prefix}_{key}') or defaults.get(key, '')
+                for key in ('ENGINE', 'NAME', 'USER', 'PASSWORD', 'HOST', 'PORT')}
+    database['CONN_MAX_AGE'] = None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE)
+    database['CONN_HEALTH_CHECKS'] = os.getenv('DB_CONN_HEALTH_CHECKS', '1') == '1'
+    return database
+
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': get_database('DB', {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db.sqlite3'}),
 }
+if os.getenv('DB_REPLICA_NAME'):
+    # В тестах реплика указывает на тестовую основную БД
+    DATABASES['replica'] = dict(get_database('DB_REPLICA', DATABASES['default']), TEST={'MIRROR': 'default'})
+
+# Чтения моделей из DATABASE_REPLICA_APPS во view, помеченных marketplace.routers.use_replica (GET витрины),
+# идут в реплику; запись и все чтения после нее до конца запроса - в основную БД
+DATABASE_ROUTERS = ['marketplace.routers.PrimaryReplicaRouter']
+DATABASE_REPLICA = 'replica' if 'replica' in DATABASES else None
+DATABASE_REPLICA_APPS = ('app_shop',)
+# После записи запросы того же клиента еще DB_REPLICA_PIN_SECONDS секунд читают из основной БД (отставание реплики),
+# срок хранится в cookie DATABASE_REPLICA_PIN_COOKIE
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 5))
+DATABASE_REPLICA_PIN_COOKIE = 'db_primary_until'
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -126,10 +155,21 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
 STATIC_URL = 'static/'
+STATIC_ROOT = BASE_DIR / 'static'
+
+# collectstatic записывает файлы с хешем содержимого в имени и сжатые копии .gz (marketplace.staticfiles)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'marketplace.staticfiles.CompressedManifestStaticFilesStorage'},
+}
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# Производные изображения (marketplace.renditions): ширины в пикселях и качество WebP/JPEG
+IMAGE_RENDITION_WIDTHS = (200, 400, 800)
+IMAGE_RENDITION_QUALITY = 80
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -145,3 +185,40 @@ REST_FRAMEWORK = {
 }
 CART_SESSION_ID = 'cart'
 
+# Хранилище корзины (cart.storage): SessionCartStorage, DatabaseCartStorage (таблица CartLine)
+# или CookieCartStorage (подписанная cookie). Для анонимных посетителей можно задать отдельное хранилище
+CART_STORAGE = os.getenv('CART_STORAGE', 'cart.storage.SessionCartStorage')
+CART_ANONYMOUS_STORAGE = os.getenv('CART_ANONYMOUS_STORAGE') or None
+CART_COOKIE_NAME = 'cart'
+CART_TOKEN_COOKIE_NAME = 'cart_token'
+# Время жизни cookie корзины; анонимные корзины в CartLine старше этого срока удаляет команда clear_carts
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+# Максимальная длина значения cookie CookieCartStorage: браузеры не сохраняют cookie больше ~4 КБ
+CART_COOKIE_MAX_SIZE = 3800
+
+# Кеш эндпоинтов витрины (app_shop.cache) и количества страниц каталога (app_shop.pagination)
+STOREFRONT_CACHE_ALIAS = 'default'
+STOREFRONT_CACHE_TIMEOUT = 60 * 5
+CATALOG_COUNT_CACHE_TIMEOUT = 60
+# Фасеты каталога (app_shop.facets, параметр facets=1): количество диапазонов цены и самых частых тегов
+CATALOG_FACET_PRICE_BUCKETS = 5
+CATALOG_FACET_TOP_TAGS = 10
+
+# Async версии эндпоинтов витрины только для чтения (app_shop.async_views) для запуска под ASGI сервером,
+# включаются переменной окружения STOREFRONT_ASYNC_VIEWS=1
+STOREFRONT_ASYNC_VIEWS = os.getenv('STOREFRONT_ASYNC_VIEWS', '') == '1'
+
+# Предрасчитанные топы товаров (app_shop.leaderboards): сколько записей хранить и когда пересчитывать доску целиком
+LEADERBOARD_SIZE = 50
+LEADERBOARD_MIN_SIZE = 5
+
+# Списки админки (marketplace.admin.EstimatedCountPaginator): таблицы больше этого числа строк не считаются COUNT(*),
+# а отфильтрованные списки считаются не дальше этого числа строк
+ADMIN_EXACT_COUNT_LIMIT = 10000
+
+# Инструментирование SQL (marketplace.middleware): заголовки Server-Timing/X-DB-Queries и предупреждения о N+1
+# и медленных запросах. Выключено по умолчанию, включается переменной окружения SQL_INSTRUMENTATION=1
+SQL_INSTRUMENTATION = os.getenv('SQL_INSTRUMENTATION', '') == '1'
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', 5))
+# Порог медленного запроса в миллисекундах, пустое значение - не проверять
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS')) if os.getenv('SQL_SLOW_QUERY_MS') else None
@@ -0,0 +1,112 @@
+import gzip
+import mimetypes
+import os
+import posixpath
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+from django.utils.functional import cached_property
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+# Форматы, которые сжимаются gzip; woff, png и jpg уже сжаты
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.ttf', '.eot', '.otf', '.ico', '.json', '.map', '.txt', '.xml',
+                           '.html')
+# Сжатая копия сохраняется, только если она заметно меньше оригинала
+MIN_COMPRESSION_RATIO = 0.95
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Файлы без хеша в имени (например, favicon.ico по прямой ссылке) могут меняться
+DEFAULT_CACHE_CONTROL = 'public, max-age=3600'
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Статика для collectstatic: имена файлов с хешем содержимого (ссылки в CSS и {% static %} переписываются
+    на них по манифесту) и рядом с каждым текстовым файлом - сжатая копия name.gz для serve_static
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in {*paths, *self.hashed_files.values()}:
+            if name.lower().endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                self.compress(name)
+
+    def compress(self, name):
+        with self.open(name, 'rb') as original:
+            content = original.read()
+        # mtime=0: одинаковое содержимое всегда дает одинаковый .gz
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        gzip_name = name + '.gz'
+        if self.exists(gzip_name):
+            self.delete(gzip_name)
+        if len(compressed) < len(content) * MIN_COMPRESSION_RATIO:
+            self._save(gzip_name, ContentFile(compressed))
+
+    def is_hashed(self, name):
+        """Имя из манифеста с хешем содержимого: такой файл никогда не меняется"""
+        return name in self.hashed_names
+
+    @cached_property
+    def hashed_names(self):
+        return set(self.hashed_files.values())
+
+
+def accepts_gzip(request):
+    """
+    Клиент принимает gzip: кодировка указана в Accept-Encoding (или есть *) с q больше 0.
+    gzip;q=0 означает отказ, а явное значение для gzip важнее значения для *
+    """
+    weights = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        encoding, *params = item.split(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[encoding] = weight
+    return weights.get('gzip', weights.get('x-gzip', weights.get('*', 0.0))) > 0
+
+
+def serve_static(request, path):
+    """
+    Отдает файлы из STATIC_ROOT, собранные collectstatic: сжатую копию .gz, если клиент принимает gzip,
+    и заголовок immutable с годовым сроком для имен с хешем содержимого
+    """
+    path = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(staticfiles_storage.location, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if path.endswith('.gz') or not os.path.isfile(full_path):
+        raise Http404
+
+    content_type, _ = mimetypes.guess_type(full_path)
+    encoding = None
+    if accepts_gzip(request) and os.path.isfile(full_path + '.gz'):
+        full_path, encoding = full_path + '.gz', 'gzip'
+
+    stat = os.stat(full_path)
+    if was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type or 'application/octet-stream')
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if encoding:
+            response['Content-Encoding'] = encoding
+    else:
+        response = HttpResponseNotModified()
+    patch_vary_headers(response, ('Accept-Encoding',))
+    is_hashed = getattr(staticfiles_storage, 'is_hashed', None)
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_hashed and is_hashed(path) else DEFAULT_CACHE_CONTROL
+    return response
@@ -16,9 +16,11 @@ Including another URLconf
 """
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 
 from marketplace import settings
+from marketplace.renditions import serve_rendition
+from marketplace.staticfiles import serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -26,10 +28,15 @@ urlpatterns = [
     path("api/", include("app_users.urls")),
     path('api/', include("app_shop.urls")),
     path('api/', include("cart.urls")),
-
+    # Отсутствующие производные изображения создаются при первом запросе
+    re_path(rf'^{settings.MEDIA_URL.strip("/")}/(?P<path>.+/renditions/[^/]+)$', serve_rendition,
+            name='image-rendition'),
 ]
 
 if settings.DEBUG:
     urlpatterns.extend(
         static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     )
+else:
+    # Статика после collectstatic: сжатые копии по Accept-Encoding и immutable для файлов с хешем в имени
+    urlpatterns.append(re_path(rf'^{settings.STATIC_URL.strip("/")}/(?P<path>.+)$', serve_static))